@@ -0,0 +1,83 @@
+import numpy as np
+from statistics import NormalDist
+
+'''
+    Sequential stopping rule for the number of test runs performed per model during the final evaluation.
+    Instead of always performing a fixed number of test runs, test runs get performed in batches until the confidence
+    intervals of both the mean score and the mean reaching time of the model are narrower than given tolerances (or
+    until the max. number of test runs is reached).
+'''
+
+
+def confidence_half_width(values, confidence=0.95):
+    """
+        Half-width of the (normal approximation) confidence interval of the mean of the given values. NaN values are
+        ignored.
+    :param values: List/array of observations.
+    :param confidence: Confidence level, e.g. 0.95.
+    :return: Half-width; inf if there are less than 2 (non-NaN) observations.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return np.inf
+    z = NormalDist().inv_cdf(0.5 + confidence / 2.)
+    return z * np.std(values, ddof=1) / np.sqrt(len(values))
+
+
+class SequentialStoppingRule(object):
+    """
+        Decides after each batch of test runs whether a model has been evaluated precisely enough.
+    """
+
+    def __init__(self, min_test_runs=20, max_test_runs=100, batch_size=10, score_tolerance=0.25, time_tolerance=10.,
+                 confidence=0.95):
+        """
+        :param min_test_runs: Min. number of test runs performed per model.
+        :param max_test_runs: Max. number of test runs performed per model.
+        :param batch_size: Number of test runs performed between two checks of the stopping criterion.
+        :param score_tolerance: Max. half-width of the confidence interval of the mean score (in grasps per test run).
+        :param time_tolerance: Max. half-width of the confidence interval of the mean reaching time (in time steps).
+        :param confidence: Confidence level of the confidence intervals.
+        """
+        if not 0 < min_test_runs <= max_test_runs:
+            raise ValueError('Expected 0 < min_test_runs <= max_test_runs.')
+        if batch_size < 1:
+            raise ValueError('Expected batch_size >= 1.')
+        self.min_test_runs = min_test_runs
+        self.max_test_runs = max_test_runs
+        self.batch_size = batch_size
+        self.score_tolerance = score_tolerance
+        self.time_tolerance = time_tolerance
+        self.confidence = confidence
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def next_batch_size(self, num_test_runs_done):
+        """
+        :param num_test_runs_done: Number of test runs performed so far.
+        :return: Number of test runs to be performed before checking the stopping criterion (again)
+        """
+        num_test_runs = max(self.batch_size, self.min_test_runs - num_test_runs_done)
+        return min(num_test_runs, self.max_test_runs - num_test_runs_done)
+
+    def is_satisfied(self, test_scores, test_times_means):
+        """
+            Checks whether the model has been evaluated precisely enough.
+            Test runs without any successful grasp have an undefined (NaN) reaching time and do not contribute to the
+            reaching time's confidence interval. If no test run contains a successful grasp at all, there is no
+            reaching time to be estimated, so only the score's confidence interval is considered.
+        :param test_scores: Scores of the test runs performed so far.
+        :param test_times_means: Mean reaching times of the test runs performed so far.
+        :return: True if no further test runs need to be performed
+        """
+        if len(test_scores) >= self.max_test_runs:
+            return True
+        if len(test_scores) < self.min_test_runs:
+            return False
+        if confidence_half_width(test_scores, self.confidence) > self.score_tolerance:
+            return False
+        if np.all(np.isnan(np.asarray(test_times_means, dtype=float))):
+            return True
+        return confidence_half_width(test_times_means, self.confidence) <= self.time_tolerance
@@ -0,0 +1,410 @@
+import os
+import io, json, csv
+import time
+import shutil
+import zipfile
+import argparse
+import platform
+import subprocess
+import contextlib
+import numpy as np
+
+import training_analysis
+from training_log import TRAINING_LOG_COLUMNS, sidecar_base_path
+from run_catalog import RunCatalog
+from profiling import PhaseCounters, peak_rss_kb
+
+'''
+    Benchmark suite for both analysis pipelines.
+
+    Generates synthetic Results trees (Benchmarks/Synthetic/<scale>x/Results/PPO2/) at multiples of the 50 runs in
+    Results/PPO2 and times, per scale:
+        - run discovery: building the run catalog from scratch (cold) and refreshing it (warm),
+        - grouping: selecting the complete runs and grouping them per parameter-specification-id,
+        - training_analysis.py: loading the training logs (cold: parsing the csv-files; warm: memory-mapping the
+          sidecar files), aggregating them and emitting the csv-files, without the bootstrap confidence intervals,
+        - bootstrap: the confidence intervals of the training analysis (only if --bootstrap is given),
+        - final_evaluation.py: evaluating a fixed number of models using a stub environment (StubRobotEnv) and the
+          NumPy policy (see numpy_policy.py).
+    The timings get written to a json file (Benchmarks/benchmark_<commit>.json by default), so that they can be
+    compared across commits. For each timed phase, the report also lists the exponent k of the observed growth
+    t ~ runs^k between consecutive scales; exponents noticeably above 1 indicate superlinear behaviour.
+
+    Usage (from AnalysisTools/): python benchmark.py --scales 10 100 1000
+'''
+
+PATH_BENCHMARKS = '../Benchmarks/'
+BASE_RUNS = 50              # Number of runs in Results/PPO2
+RUNS_PER_PARAM_FILE = 5     # Runs per parameter specification, as in Results/PPO2
+OBS_DIM = 19
+ACTION_DIM = 8
+NET_ARCH = [150, 150]
+CHECKPOINT_FREQUENCY = 500  # Update-nrs of the checkpoints: 500, 1000, ...
+SUPERLINEAR_EXPONENT = 1.2  # Growth exponents above this get reported as superlinear
+
+
+class StubRobotEnv(object):
+    """
+        Stand-in for PandaRobotEnv with the same constructor arguments and step/reset interface, returning random
+        observations. Each step, the gripper reaches its goal with probability success_rate (reward 1, episode done)
+        or the episode fails with probability failure_rate (reward 0, episode done). Used for benchmarking the
+        evaluation loop without simulating the robot.
+    """
+    success_rate = 1. / 150
+    failure_rate = 1. / 400
+
+    def __init__(self, renders=False, fixedActionRepetitions=False, distSpecifications=None, maxDist=0.25,
+                 maxDeviation=0.25, maxSteps=1000, evalFlag=True):
+        self.max_steps = maxSteps
+        self.action_dim = ACTION_DIM - 1 if fixedActionRepetitions else ACTION_DIM
+        self.rng = np.random.RandomState()
+        self.step_counter = 0
+
+    def seed(self, seed=None):
+        self.rng = np.random.RandomState(seed)
+        return [seed]
+
+    def set_step_counter(self, step_counter):
+        self.step_counter = step_counter
+
+    def reset(self):
+        return self.rng.uniform(-1., 1., OBS_DIM).astype(np.float32)
+
+    def step(self, action):
+        self.step_counter += 1
+        event = self.rng.rand()
+        reward = 1 if event < self.success_rate else 0
+        done = event < self.success_rate + self.failure_rate or self.step_counter >= self.max_steps
+        return self.reset(), reward, done, [reward, self.step_counter, done]
+
+    def close(self):
+        pass
+
+
+def write_stub_model(model_path, rng, fixed_action_repetitions=False):
+    """
+        Writes a zip-archive laid out like the ones saved by stable-baselines' PPO2 (data, parameters,
+        parameter_list) holding random weights of an MlpPolicy. Such archives can be loaded by NumpyMlpPolicy, but not
+        by PPO2.load(), since data only holds the entries needed by NumpyMlpPolicy.
+    :param model_path: Path of the archive to be written.
+    :param rng: Numpy RandomState used for drawing the weights.
+    :param fixed_action_repetitions: Whether the model's action space lacks the action-repetition dimension.
+    :return: -
+    """
+    action_dim = ACTION_DIM - 1 if fixed_action_repetitions else ACTION_DIM
+    layer_sizes = [OBS_DIM] + NET_ARCH
+    parameters = dict()
+    for idx in range(len(NET_ARCH)):
+        parameters['model/shared_fc{}/w:0'.format(idx)] = rng.normal(0, 0.1, layer_sizes[idx:idx + 2])
+        parameters['model/shared_fc{}/b:0'.format(idx)] = np.zeros(layer_sizes[idx + 1])
+    parameters['model/vf/w:0'] = rng.normal(0, 0.1, (NET_ARCH[-1], 1))
+    parameters['model/vf/b:0'] = np.zeros(1)
+    parameters['model/pi/w:0'] = rng.normal(0, 0.1, (NET_ARCH[-1], action_dim))
+    parameters['model/pi/b:0'] = np.zeros(action_dim)
+    parameters['model/pi/logstd:0'] = np.full((1, action_dim), -0.5)
+    parameters['model/q/w:0'] = rng.normal(0, 0.1, (NET_ARCH[-1], action_dim))
+    parameters['model/q/b:0'] = np.zeros(action_dim)
+    parameters = {name: value.astype(np.float32) for name, value in parameters.items()}
+
+    data = {'action_space': {'low': str(-np.ones(action_dim, dtype=np.float32)),
+                             'high': str(np.ones(action_dim, dtype=np.float32)),
+                             'shape': str([action_dim]), 'dtype': 'float32'},
+            'policy_kwargs': {'act_fun': '<function tanh at 0x0>', 'net_arch': NET_ARCH}}
+    buffer = io.BytesIO()
+    np.savez(buffer, **parameters)
+    with zipfile.ZipFile(model_path, 'w') as archive:
+        archive.writestr('data', json.dumps(data))
+        archive.writestr('parameters', buffer.getvalue())
+        archive.writestr('parameter_list', json.dumps(list(parameters), indent=4))
+
+
+def write_training_log(log_path, rng, num_rows, update_frequency=10, steps_per_update=128):
+    """
+        Writes a synthetic training_eval.csv. The number of grasps per logged period follows a Poisson distribution
+        whose rate grows over training. As in the logs written during training, the grasping times of periods
+        without any grasp are NaN, as is their std for periods with a single grasp.
+    :param log_path: Path of the file to be written.
+    :param rng: Numpy RandomState.
+    :param num_rows: Number of logged periods (rows).
+    :param update_frequency: Number of weight updates per logged period.
+    :param steps_per_update: Number of time steps per weight update.
+    :return: -
+    """
+    update_nrs = np.arange(1, num_rows + 1) * update_frequency
+    grasps = rng.poisson(0.5 + 20. * update_nrs / update_nrs[-1])
+    with open(log_path, 'w') as f:
+        w = csv.writer(f, dialect='excel', quoting=csv.QUOTE_ALL)
+        w.writerow(TRAINING_LOG_COLUMNS)
+        for update_nr, count in zip(update_nrs, grasps):
+            times = rng.randint(20, 600, size=count)
+            if count == 0:
+                stats = ['nan'] * 4
+            else:
+                stats = [np.mean(times), np.std(times) if count > 1 else 'nan', np.max(times), np.min(times)]
+            w.writerow([update_nr, count] + stats + [update_nr * steps_per_update])
+
+
+def generate_results_tree(path, num_runs, num_rows=781, num_checkpoints=15, incomplete_fraction=0.02, seed=0):
+    """
+        Generates a synthetic Results tree. Runs get assigned to parameter specifications
+        ParameterSettings/params_<k>.json in groups of RUNS_PER_PARAM_FILE. Each run folder contains a params.json
+        laid out like the ones written during training, a training_eval.csv (see write_training_log()), checkpoint
+        archives and, unless the run is incomplete, a final_model.zip. All model archives of a tree are hard links to
+        (or, where not supported, copies of) two stub models (see write_stub_model()), to keep large trees small.
+    :param path: Folder to create the runs' folders in (e.g. .../Results/PPO2/).
+    :param num_runs: Number of runs to be generated.
+    :param num_rows: Number of rows per training_eval.csv.
+    :param num_checkpoints: Number of checkpoint archives per run.
+    :param incomplete_fraction: Fraction of runs lacking a final_model.zip (i.e. excluded as incomplete).
+    :param seed: Seed making the generated tree reproducible.
+    :return: -
+    """
+    rng = np.random.RandomState(seed)
+    os.makedirs(path, exist_ok=True)
+    stub_models = os.path.join(path, os.pardir, 'stub_models')
+    os.makedirs(stub_models, exist_ok=True)
+    for fixed_action_repetitions in (False, True):
+        write_stub_model(os.path.join(stub_models, 'model_{}.zip'.format(int(fixed_action_repetitions))), rng,
+                         fixed_action_repetitions)
+
+    def link(source, target):
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+    for run_idx in range(num_runs):
+        model_id = 'PandaController_synthetic__{:07d}'.format(run_idx)
+        run_dir = os.path.join(path, model_id)
+        os.makedirs(run_dir, exist_ok=True)
+        param_specification = run_idx // RUNS_PER_PARAM_FILE + 1
+        fixed_action_repetitions = bool(param_specification % 2)
+        params = {'render': False, 'policy': 'MlpPolicy', 'act_fun': 'tf.nn.tanh', 'net_arch': NET_ARCH,
+                  'verbose': 1, 'learning_rate': float(rng.choice([0.00025, 0.0005, 0.001])),
+                  'total_timesteps': 1000000, 'algo': 'PPO2', 'model_id': model_id,
+                  'fixed_action_repetitions': fixed_action_repetitions, 'checkpoint_frequency': 10,
+                  'path': 'Results/PPO2/' + model_id + '/',
+                  'tensorboard_log': 'Results/PPO2/' + model_id + '/tensorboard/',
+                  'dist_specification': [int(rng.randint(0, 2)), str(rng.choice(['A', 'B']))],
+                  'log_train_progress_frequency': 10,
+                  'log_train_progress_data': TRAINING_LOG_COLUMNS,
+                  'maxDist': 0.25, 'maxDeviation': 0.25,
+                  'provided_params_file': 'ParameterSettings/params_{}.json'.format(param_specification)}
+        with open(os.path.join(run_dir, 'params.json'), 'w') as f:
+            json.dump(params, f)
+
+        write_training_log(os.path.join(run_dir, 'training_eval.csv'), rng, num_rows)
+
+        stub_model = os.path.join(stub_models, 'model_{}.zip'.format(int(fixed_action_repetitions)))
+        for checkpoint_idx in range(1, num_checkpoints + 1):
+            link(stub_model, os.path.join(run_dir, 'checkpoint_{}.zip'.format(checkpoint_idx * CHECKPOINT_FREQUENCY)))
+        if rng.rand() >= incomplete_fraction:
+            link(stub_model, os.path.join(run_dir, 'final_model.zip'))
+
+
+def prepare_tree(directory, scale, settings):
+    """
+        Returns the Results tree of the given scale, generating it unless a tree generated using the same settings
+        exists already.
+    :param directory: Folder holding the synthetic trees.
+    :param scale: Multiple of BASE_RUNS runs.
+    :param settings: Dictionary of keyword arguments for generate_results_tree() (except path and num_runs).
+    :return: Tuple (path to the tree's run folders, seconds needed for generating it; None if re-used)
+    """
+    tree_dir = os.path.join(directory, '{}x'.format(scale))
+    path = os.path.join(tree_dir, 'Results', 'PPO2') + '/'
+    meta_path = os.path.join(tree_dir, 'settings.json')
+    settings = dict(settings, num_runs=scale * BASE_RUNS)
+    try:
+        with open(meta_path) as f:
+            if json.load(f) == settings:
+                return path, None
+    except (IOError, ValueError):
+        pass  # Not generated (completely) yet
+
+    shutil.rmtree(tree_dir, ignore_errors=True)
+    start = time.perf_counter()
+    generate_results_tree(path, **settings)
+    duration = time.perf_counter() - start
+    with open(meta_path, 'w') as f:
+        json.dump(settings, f)
+    return path, duration
+
+
+def time_training_analysis(path, write_path, num_resamples=0):
+    """
+        Times discovery, grouping and training_analysis.py on a Results tree. The bootstrap confidence intervals are
+        left out of the timed aggregation and timed as a separate phase (bootstrap) if num_resamples > 0.
+    :param path: Path to the tree's run folders.
+    :param write_path: Folder to emit the csv-files to.
+    :param num_resamples: Number of bootstrap resamples for the separately timed bootstrap phase; 0 to skip it.
+    :return:    timings: Dictionary of timings in seconds (and the number of runs used)
+                used_dict: Grouping of the runs as returned by RunCatalog.remove_redundant_runs()
+    """
+    timings = dict()
+    # Start from scratch: no catalog and no sidecar files of the training logs
+    catalog_path = os.path.join(os.path.dirname(os.path.normpath(path)), 'run_catalog.sqlite')
+    if os.path.exists(catalog_path):
+        os.remove(catalog_path)
+    shutil.rmtree(os.path.dirname(os.path.dirname(sidecar_base_path(os.path.join(path, 'run', 'training_eval.csv')))),
+                  ignore_errors=True)
+
+    start = time.perf_counter()
+    catalog = RunCatalog(path)
+    timings['discovery_cold'] = time.perf_counter() - start
+    start = time.perf_counter()
+    catalog.refresh()
+    timings['discovery_warm'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    candidate_dirs, list_outtakes_failure = catalog.get_complete_trials()
+    used_dict, filtered_out = catalog.remove_redundant_runs(candidate_dirs)
+    timings['grouping'] = time.perf_counter() - start
+    catalog.close()
+
+    for mode in ('cold', 'warm'):  # Cold: training logs get parsed; warm: their sidecar files get memory-mapped
+        training_analysis.counters = PhaseCounters()
+        with training_analysis.counters.phase('aggregate'):
+            training_analysis.evaluate_measurements_per_param_specification(path, used_dict, direct=write_path,
+                                                                            num_resamples=0)
+        training_analysis.save_which_data_was_used(write_path + 'EvaluatedData', used_dict,
+                                                   [list_outtakes_failure, filtered_out])
+        for phase in ('load', 'aggregate', 'write'):
+            timings[phase + '_' + mode] = training_analysis.counters.seconds.get(phase, 0.)
+    if num_resamples > 0:
+        training_analysis.counters = PhaseCounters()
+        training_analysis.evaluate_measurements_per_param_specification(path, used_dict, direct=write_path,
+                                                                        num_resamples=num_resamples)
+        timings['bootstrap'] = training_analysis.counters.seconds.get('bootstrap', 0.)
+    training_analysis.counters = PhaseCounters(enabled=False)
+
+    timings['runs_used'] = sum(len(runs) for runs in used_dict.values())
+    return timings, used_dict
+
+
+def time_final_evaluation(path, used_dict, num_models, num_test_runs, seed=0):
+    """
+        Times final_evaluation.py on the first num_models models of a Results tree, using StubRobotEnv and the NumPy
+        policy. Neither the evaluation cache nor the journal are used.
+    :param path: Path to the tree's run folders.
+    :param used_dict: Grouping of the runs as returned by RunCatalog.remove_redundant_runs().
+    :param num_models: Number of models to be evaluated.
+    :param num_test_runs: Number of test runs per model.
+    :param seed: Seed for the evaluation.
+    :return: Dictionary: number of evaluated models, test runs per model, seconds needed in total and per model,
+             simulated steps per second
+    """
+    # Imported here, so that the training analysis can be benchmarked without the simulation being installed
+    import final_evaluation
+    from adaptive_stopping import SequentialStoppingRule
+
+    subset = dict()
+    for param_specification_id, runs in used_dict.items():
+        runs = runs[:num_models - sum(len(r) for r in subset.values())]
+        if runs:
+            subset[param_specification_id] = runs
+    stopping = SequentialStoppingRule(min_test_runs=num_test_runs, max_test_runs=num_test_runs,
+                                      batch_size=num_test_runs)
+
+    start = time.perf_counter()
+    final_evaluation.evaluate_measurements_per_param_specification(path, subset, inference='numpy', seed=seed,
+                                                                   stopping=stopping, env_class=StubRobotEnv)
+    duration = time.perf_counter() - start
+    models = sum(len(runs) for runs in subset.values())
+    steps = models * num_test_runs * 1000  # 1000 time steps per test run, see final_evaluation.test_run()
+    return {'models': models, 'test_runs_per_model': num_test_runs, 'evaluation': duration,
+            'evaluation_per_model': duration / models if models else None,
+            'steps_per_s': steps / duration if duration > 0 else None}
+
+
+def scaling_exponents(results, phases):
+    """
+        Exponents k of the growth t ~ runs^k of each phase's time between consecutive scales.
+    :param results: List of per-scale results (ordered by scale), each holding 'runs' and 'timings'.
+    :param phases: Names of the timed phases.
+    :return: Dictionary; key = 'runs_a->runs_b', val = dictionary of exponents per phase
+    """
+    exponents = dict()
+    for smaller, larger in zip(results[:-1], results[1:]):
+        ratio = np.log(larger['runs'] / smaller['runs'])
+        exponents['{}->{}'.format(smaller['runs'], larger['runs'])] = {
+            phase: float(np.log(larger['timings'][phase] / smaller['timings'][phase]) / ratio)
+            for phase in phases if smaller['timings'].get(phase) and larger['timings'].get(phase)}
+    return exponents
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark both analysis pipelines on synthetic Results trees.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Tree sizes as multiples of the ' + str(BASE_RUNS) + ' runs in Results/PPO2.')
+    parser.add_argument('--rows', type=int, default=781, help='Rows per training_eval.csv (default: 781).')
+    parser.add_argument('--checkpoints', type=int, default=15, help='Checkpoint archives per run (default: 15).')
+    parser.add_argument('--incomplete-fraction', type=float, default=0.02,
+                        help='Fraction of runs lacking a final model (default: 0.02).')
+    parser.add_argument('--eval-models', type=int, default=5,
+                        help='Models evaluated per scale using the stub env; 0 skips the evaluation (default: 5).')
+    parser.add_argument('--eval-test-runs', type=int, default=10, help='Test runs per evaluated model (default: 10).')
+    parser.add_argument('--bootstrap', type=int, default=0,
+                        help='Bootstrap resamples for timing the confidence intervals of the training analysis as a '
+                             'separate phase; 0 skips them (default: 0).')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for generating the trees and evaluating.')
+    parser.add_argument('--directory', default=PATH_BENCHMARKS + 'Synthetic/',
+                        help='Folder the synthetic trees get generated in (and re-used from).')
+    parser.add_argument('--output', default=None,
+                        help='Path of the json report (default: Benchmarks/benchmark_<commit>.json).')
+    args = parser.parse_args()
+
+    commit = current_commit()
+    output = args.output or PATH_BENCHMARKS + 'benchmark_' + commit + '.json'
+    settings = {'num_rows': args.rows, 'num_checkpoints': args.checkpoints,
+                'incomplete_fraction': args.incomplete_fraction, 'seed': args.seed}
+
+    results = []
+    for scale in sorted(args.scales):
+        print('Scale ' + str(scale) + 'x (' + str(scale * BASE_RUNS) + ' runs)')
+        path, generation_time = prepare_tree(args.directory, scale, settings)
+        if generation_time is not None:
+            print('Generated tree in ' + str(round(generation_time, 2)) + ' s: ' + path)
+        write_path = os.path.join(args.directory, '{}x'.format(scale), 'TrainingProgressEvaluation') + '/'
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            timings, used_dict = time_training_analysis(path, write_path, num_resamples=args.bootstrap)
+            evaluation = None
+            if args.eval_models > 0:
+                evaluation = time_final_evaluation(path, used_dict, args.eval_models, args.eval_test_runs,
+                                                   seed=args.seed)
+        if evaluation is not None:
+            timings['evaluation_per_model'] = evaluation['evaluation_per_model']
+
+        results.append({'scale': scale, 'runs': scale * BASE_RUNS, 'generation': generation_time,
+                        'timings': timings, 'evaluation': evaluation, 'peak_rss_kb': peak_rss_kb()})
+        print(timings)
+
+    phases = ['discovery_cold', 'discovery_warm', 'grouping', 'load_cold', 'load_warm', 'aggregate_cold',
+              'aggregate_warm', 'write_cold', 'write_warm', 'bootstrap', 'evaluation_per_model']
+    exponents = scaling_exponents(results, phases)
+    for scales, phase_exponents in exponents.items():
+        for phase, exponent in phase_exponents.items():
+            if exponent > SUPERLINEAR_EXPONENT:
+                print('Superlinear growth of ' + phase + ' (' + scales + ' runs): t ~ runs^' + str(round(exponent, 2)))
+
+    report = {'commit': commit,
+              'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'settings': dict(settings, eval_models=args.eval_models, eval_test_runs=args.eval_test_runs,
+                               bootstrap=args.bootstrap),
+              'results': results,
+              'scaling_exponents': exponents}
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Benchmark report: ' + output)
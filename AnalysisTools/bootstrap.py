@@ -0,0 +1,170 @@
+import numpy as np
+
+'''
+    Vectorized bootstrap confidence intervals for the statistics computed over the runs of each parameter setting.
+    With only a handful of runs per setting, a mean (or std) over the runs alone says little about how much it would
+    change if other runs had been trained. Resampling the runs with replacement many times and recomputing the
+    statistic on each resample yields its sampling distribution, whose percentiles form the confidence interval.
+
+    All settings, resamples and rows (e.g. logged periods) get processed at once: the resampled runs are drawn as one
+    index tensor of shape (settings, resamples, runs), turned into counts of how often each run is drawn, and the
+    statistic of every resample is computed as count-weighted mean (or std) via a single batched matrix product over
+    the runs. Resamples are processed in chunks of rows (or resamples), so that memory usage stays bounded.
+
+    NaN values (runs lacking a value, e.g. logged periods without any grasp) are ignored as done by np.nanmean(). A
+    resample whose drawn runs all lack a value yields NaN and does not contribute to the percentiles.
+'''
+
+DEFAULT_NUM_RESAMPLES = 10000
+
+# Max. number of floats held per intermediate array
+CHUNK_ELEMENTS = 1 << 22
+
+
+def percentile_interval(samples, confidence=0.95, axis=1):
+    """
+        Percentile interval of the samples along an axis, ignoring NaN samples. Equals np.nanpercentile() (linear
+        interpolation) at the lower and upper percentile, but handles all other axes at once.
+    :param samples: Numpy array.
+    :param confidence: Confidence level, e.g. 0.95 for the interval between the 2.5th and the 97.5th percentile.
+    :param axis: Axis holding the samples.
+    :return: Tuple (lower, upper) of Numpy arrays shaped like samples without axis; NaN where all samples are NaN
+    """
+    samples = np.sort(np.moveaxis(samples, axis, -1), axis=-1)  # NaN sorted last
+    num_valid = (~np.isnan(samples)).sum(axis=-1)
+    bounds = []
+    for quantile in ((1. - confidence) / 2., (1. + confidence) / 2.):
+        position = quantile * np.maximum(num_valid - 1, 0)
+        below = np.floor(position).astype(int)
+        above = np.minimum(below + 1, np.maximum(num_valid - 1, 0))
+        lower = np.take_along_axis(samples, below[..., np.newaxis], axis=-1)[..., 0]
+        upper = np.take_along_axis(samples, above[..., np.newaxis], axis=-1)[..., 0]
+        bound = lower + (position - below) * (upper - lower)
+        bounds.append(np.where(num_valid > 0, bound, np.nan))
+    return tuple(bounds)
+
+
+def resample_counts(run_counts, num_resamples, rng):
+    """
+        Draws num_resamples resamples (with replacement) of the runs of each parameter setting.
+    :param run_counts: Numpy array holding the number of runs per setting.
+    :param num_resamples: Number of resamples per setting.
+    :param rng: Numpy RandomState.
+    :return: Numpy array (float64) of shape (settings, num_resamples, max. runs per setting): how often each run is
+             drawn per resample; runs beyond a setting's number of runs are never drawn
+    """
+    run_counts = np.asarray(run_counts, dtype=int)
+    num_settings, max_runs = len(run_counts), int(run_counts.max(initial=0))
+    # Index tensor: run drawn per setting, resample and draw; draws beyond a setting's number of runs get discarded
+    indices = (rng.random_sample((num_settings, num_resamples, max_runs)) * run_counts[:, None, None]).astype(int)
+    drawn = np.arange(max_runs) < run_counts[:, None, None]
+    offsets = (np.arange(num_settings * num_resamples) * max_runs).reshape((num_settings, num_resamples, 1))
+    counts = np.bincount((offsets + indices)[np.broadcast_to(drawn, indices.shape)],
+                         minlength=num_settings * num_resamples * max_runs)
+    return counts.reshape((num_settings, num_resamples, max_runs)).astype(np.float64)
+
+
+def _nanmean(values, axis):
+    # np.nanmean() without the warning about all-NaN slices
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(valid, values, 0.).sum(axis=axis) / valid.sum(axis=axis)
+
+
+def weighted_statistics(values, weights, std=True):
+    """
+        Count-weighted mean and std (ddof=0) over the runs for each resample at once, ignoring NaN values.
+    :param values: Numpy array of shape (settings, runs, rows).
+    :param weights: Numpy array of shape (settings, resamples, runs) as returned by resample_counts().
+    :param std: Whether to compute the stds as well.
+    :return: Tuple (means, stds) of Numpy arrays of shape (settings, resamples, rows); NaN where no drawn run has a
+             value. stds is None unless std is True.
+    """
+    valid = ~np.isnan(values)
+    # Centered on the mean over all runs, so that the variances below do not suffer from cancellation
+    center = np.nan_to_num(_nanmean(values, axis=1))[:, np.newaxis, :]
+    filled = np.where(valid, values - center, 0.)
+    stds = None
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = 1. / np.matmul(weights, valid.astype(np.float64))  # inf (yielding NaN) where no drawn run has a value
+        shifts = np.matmul(weights, filled)
+        shifts *= scale
+        if std:
+            stds = np.matmul(weights, filled ** 2)
+            stds *= scale
+            stds -= shifts ** 2
+            np.sqrt(np.maximum(stds, 0., out=stds), out=stds)
+    shifts += center
+    return shifts, stds
+
+
+def bootstrap_run_statistics(values, run_counts, num_resamples=DEFAULT_NUM_RESAMPLES, confidence=0.95, seed=0,
+                             weights=None, statistics=('mean', 'std')):
+    """
+        Bootstrap confidence intervals of the mean and the std over the runs of each setting, for all rows at once.
+    :param values: Numpy array of shape (settings, runs, rows), NaN-padded for settings with fewer runs than others
+                   (e.g. a metric of the tensor returned by training_aggregation.load_training_tensor(), transposed).
+    :param run_counts: Numpy array holding the number of runs per setting.
+    :param num_resamples: Number of resamples.
+    :param confidence: Confidence level.
+    :param seed: Seed making the resamples reproducible.
+    :param weights: Resamples as returned by resample_counts(); drawn from seed if None. Passing the same resamples
+                    for several chunks of rows (or several metrics) keeps the runs drawn per resample consistent.
+    :param statistics: Statistics to compute intervals for; 'mean' and/or 'std'.
+    :return: Dictionary; key = statistic ('mean' or 'std'), val = tuple (lower, upper) of Numpy arrays of shape
+             (settings, rows)
+    """
+    if weights is None:
+        weights = resample_counts(run_counts, num_resamples, np.random.RandomState(seed))
+    num_settings, num_resamples = weights.shape[:2]
+    num_rows = values.shape[2]
+    chunk_rows = max(1, CHUNK_ELEMENTS // max(1, num_settings * num_resamples))
+
+    intervals = {name: (np.full((num_settings, num_rows), np.nan), np.full((num_settings, num_rows), np.nan))
+                 for name in statistics}
+    for start in range(0, num_rows, chunk_rows):
+        rows = slice(start, start + chunk_rows)
+        means, stds = weighted_statistics(values[..., rows], weights, std='std' in intervals)
+        for name, samples in [('mean', means), ('std', stds)]:
+            if name not in intervals:
+                continue
+            lower, upper = percentile_interval(samples, confidence, axis=1)
+            intervals[name][0][:, rows], intervals[name][1][:, rows] = lower, upper
+    return intervals
+
+
+def bootstrap_hierarchical_means(episodes, run_counts, episode_counts, num_resamples=DEFAULT_NUM_RESAMPLES,
+                                 confidence=0.95, seed=0):
+    """
+        Two-level bootstrap confidence intervals of the mean over runs of the mean over each run's episodes (e.g. the
+        test runs of the final evaluation), for all settings and statistics at once: each resample draws the runs of a
+        setting with replacement, and then, for each drawn run, its episodes with replacement.
+    :param episodes: Numpy array of shape (settings, runs, episodes, statistics); NaN-padded.
+    :param run_counts: Numpy array holding the number of runs per setting.
+    :param episode_counts: Numpy array of shape (settings, runs) holding the number of episodes per run.
+    :param num_resamples: Number of resamples.
+    :param confidence: Confidence level.
+    :param seed: Seed making the resamples reproducible.
+    :return: Tuple (lower, upper) of Numpy arrays of shape (settings, statistics)
+    """
+    rng = np.random.RandomState(seed)
+    run_counts = np.asarray(run_counts, dtype=int)
+    num_settings, max_runs, max_episodes, num_statistics = episodes.shape
+    chunk_resamples = max(1, CHUNK_ELEMENTS // max(1, num_settings * max_runs * max_episodes * num_statistics))
+    setting_idx = np.arange(num_settings).reshape((num_settings, 1, 1, 1))
+    run_slots = np.arange(max_runs) < run_counts[:, None, None]
+
+    samples = np.full((num_settings, num_resamples, num_statistics), np.nan)
+    for start in range(0, num_resamples, chunk_resamples):
+        size = min(chunk_resamples, num_resamples - start)
+        # Index tensors: run drawn per setting, resample and draw, and episode drawn per drawn run and draw
+        runs = (rng.random_sample((num_settings, size, max_runs)) * run_counts[:, None, None]).astype(int)
+        run_episodes = episode_counts[setting_idx[..., 0], runs]
+        draws = (rng.random_sample((num_settings, size, max_runs, max_episodes)) *
+                 run_episodes[..., None]).astype(int)
+        values = episodes[setting_idx, runs[..., None], draws]
+        values[np.arange(max_episodes) >= run_episodes[..., None]] = np.nan
+        run_means = _nanmean(values, axis=3)
+        run_means[~np.broadcast_to(run_slots, runs.shape)] = np.nan
+        samples[:, start:start + size] = _nanmean(run_means, axis=2)
+    return percentile_interval(samples, confidence, axis=1)
@@ -0,0 +1,239 @@
+import os
+import csv
+import json
+import argparse
+import multiprocessing
+import warnings
+import numpy as np
+
+from final_evaluation import create_dir, clean_parameter_specification_id_string, evaluate_model, PATH_READ
+from eval_cache import EvaluationCache
+from model_pool import process_model_pool
+from run_catalog import RunCatalog
+
+'''
+    Checkpoint sweep: evaluates every checkpoint (checkpoint_*.zip) of every selected run using the same test protocol
+    as final_evaluation.py (see final_evaluation.test_run()), in order to obtain learning curves based on greedy
+    evaluations rather than on the grasps counted during training.
+
+    The evaluations get scheduled over a pool of worker processes. Each finished evaluation is appended to
+    CheckpointEvaluation/checkpoint_results.csv right away, so that an interrupted sweep can be resumed (checkpoints
+    already evaluated using the same settings, i.e. inference backend, seed and number of env copies, are skipped) and
+    partial learning curves can be created at any time using --aggregate-only. Each result is stored along with the
+    settings it was evaluated with; only results of the current settings get re-used and aggregated.
+    Learning curves get aggregated per parameter-specification-id, analogous to training_analysis.py.
+'''
+
+PATH_WRITE = "../CheckpointEvaluation/"
+RESULTS_FILE_NAME = 'checkpoint_results.csv'
+RESULTS_HEADER = ['Model', 'Checkpoint', 'Parameter-specification-id', 'Score', 'Mean grasping time steps',
+                  'Mean std of grasping time steps', 'Settings']
+
+# Statistics returned by test_run(): (name of output folder, column name for mean over models, ... for std)
+STATISTICS = [('Scores', 'Mean_over_scores', 'Std_over_scores'),
+              ('MeanGraspTimes', 'Mean_over_mean_grasp_times', 'Std_over_mean_grasp_times'),
+              ('GraspTimeStds', 'Mean_over_std_grasp_times', 'Std_over_std_grasp_times')]
+
+
+def list_checkpoint_jobs(path, catalog, used_dict):
+    """
+        Lists all checkpoints of all runs to be evaluated.
+    :param path: Path to folder containing the runs' folders.
+    :param catalog: RunCatalog of path.
+    :param used_dict: Dictionary; key = parameter-specification-id, val = list of runs' folders
+    :return: List of tuples (parameter-specification-id, run folder, checkpoint-nr, model path, params path)
+    """
+    checkpoint_jobs = []
+    for param_specification_id, model_folder_lst in used_dict.items():
+        for model_folder in model_folder_lst:
+            for checkpoint_nr, file_name in catalog.get_checkpoints(model_folder):
+                checkpoint_jobs.append((param_specification_id, model_folder, checkpoint_nr,
+                                        path + model_folder + '/' + file_name, path + model_folder + '/params.json'))
+    return checkpoint_jobs
+
+
+def evaluate_checkpoint(checkpoint_job):
+    """
+        Evaluates a single checkpoint; to be mapped over a pool of worker processes.
+    :param checkpoint_job: Tuple (checkpoint_job as listed by list_checkpoint_jobs(), test_run_kwargs)
+    :return: Tuple (checkpoint_job, result of test_run())
+    """
+    job, test_run_kwargs = checkpoint_job
+    _, _, _, model_path, params_path = job
+    return job, evaluate_model((model_path, params_path, test_run_kwargs))
+
+
+def evaluation_settings(test_run_kwargs=None):
+    """
+        Settings of test_run() affecting the results of an evaluation, as stored along with each result.
+    :param test_run_kwargs: Keyword arguments passed on to test_run().
+    :return: Json string of the inference backend, the seed and the number of env copies
+    """
+    test_run_kwargs = test_run_kwargs or {}
+    return json.dumps({'inference': test_run_kwargs.get('inference', 'tf'), 'seed': test_run_kwargs.get('seed'),
+                       'num_envs': test_run_kwargs.get('num_envs', 1)}, sort_keys=True)
+
+
+def read_results(results_path, settings=None):
+    """
+        Reads the results streamed to file so far. Rows that cannot be parsed (e.g. the last row of a sweep killed
+        while writing it) are skipped, as are rows of results files written before the settings got stored.
+    :param results_path: Path to the results file.
+    :param settings: Only rows evaluated using these settings (see evaluation_settings()) get returned; all rows if
+                     None.
+    :return: List of rows [model, checkpoint-nr, parameter-specification-id, score, mean time, mean std time]
+    """
+    if not os.path.exists(results_path):
+        return []
+    with open(results_path, 'r') as f:
+        # Each line parsed on its own, so that a cut-off quoted field cannot swallow the following lines
+        rows = [next(csv.reader([line]), []) for line in f.read().splitlines()[1:]]
+    results = []
+    for row in rows:
+        if len(row) != len(RESULTS_HEADER) or (settings is not None and row[6] != settings):
+            continue
+        try:
+            results.append([row[0], int(row[1]), row[2]] + [float(value) for value in row[3:6]])
+        except ValueError:
+            continue
+    return results
+
+
+def run_sweep(checkpoint_jobs, results_path, num_workers=1, test_run_kwargs=None):
+    """
+        Evaluates all given checkpoints not yet contained in the results file and appends each result to it as soon
+        as it is available.
+    :param checkpoint_jobs: List of checkpoints as returned by list_checkpoint_jobs().
+    :param results_path: Path to the results file.
+    :param num_workers: Number of worker processes.
+    :param test_run_kwargs: Further keyword arguments to be passed on to test_run().
+    :return: -
+    """
+    settings = evaluation_settings(test_run_kwargs)
+    done = set((row[0], row[1]) for row in read_results(results_path, settings))
+    to_do = [(job, test_run_kwargs or {}) for job in checkpoint_jobs if (job[1], job[2]) not in done]
+    print('Checkpoints to be evaluated: ' + str(len(to_do)) + ' (already evaluated: ' + str(len(done)) + ')')
+
+    new_file = not os.path.exists(results_path)
+    torn = False  # Whether the last row got cut off (e.g. by killing a sweep while writing it)
+    if not new_file and os.path.getsize(results_path) > 0:
+        with open(results_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b'\n'
+    pool = None
+    if num_workers > 1:
+        pool = multiprocessing.get_context('spawn').Pool(processes=num_workers)
+        results = pool.imap_unordered(evaluate_checkpoint, to_do)  # Yields results as soon as they are finished
+    else:
+        results = map(evaluate_checkpoint, to_do)
+
+    with open(results_path, 'a') as f:
+        w = csv.writer(f, dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
+        if new_file:
+            w.writerow(RESULTS_HEADER)
+        elif torn:
+            f.write('\n')  # Next row starts on a line of its own; the cut-off row is skipped by read_results()
+        for count, (job, result) in enumerate(results, 1):
+            param_specification_id, model_folder, checkpoint_nr, _, _ = job
+            w.writerow([model_folder, checkpoint_nr, param_specification_id] + [float(value) for value in result[:3]] +
+                       [settings])
+            f.flush()
+            print('Evaluated (' + str(count) + '/' + str(len(to_do)) + '): ' + model_folder + ', checkpoint ' +
+                  str(checkpoint_nr))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def save_learning_curves(direct, results):
+    """
+        Aggregates the (possibly partial) results of a sweep per parameter-specification-id into learning curves.
+        For each statistic returned by test_run(), one file per parameter-specification-id gets created, listing the
+        statistic per run (columns) as a function of the checkpoint's update-nr (rows), followed by the mean and std
+        over the runs. Additionally, the means of all parameter-specification-ids are summarized in Summary/.
+        Checkpoints not evaluated (yet) are left empty (NaN).
+    :param direct: Folder where to store the emission files.
+    :param results: Rows as returned by read_results().
+    :return: -
+    """
+    curves = dict()  # param-specification-id -> model -> checkpoint-nr -> statistics
+    for model_folder, checkpoint_nr, param_specification_id, *statistics in results:
+        curves.setdefault(param_specification_id, dict()).setdefault(model_folder, dict())[checkpoint_nr] = statistics
+
+    checkpoints = sorted(set(row[1] for row in results))
+    summaries = [[] for _ in STATISTICS]
+    summary_header = ['Checkpoint']
+
+    for param_specification_id in sorted(curves):
+        models = sorted(curves[param_specification_id])
+        table = np.full((len(checkpoints), len(models), len(STATISTICS)), np.nan)
+        for model_idx, model_folder in enumerate(models):
+            for checkpoint_nr, statistics in curves[param_specification_id][model_folder].items():
+                table[checkpoints.index(checkpoint_nr), model_idx, :] = statistics
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)  # Checkpoints not evaluated by any model yet
+            means = np.nanmean(table, axis=1)
+            stds = np.nanstd(table, axis=1)
+
+        name = clean_parameter_specification_id_string(param_specification_id)
+        summary_header.append(name)
+        for stat_idx, (folder, mean_name, std_name) in enumerate(STATISTICS):
+            create_dir(direct + folder)
+            with open(direct + folder + '/' + name + '_mean_std.csv', 'w') as f:
+                w = csv.writer(f, dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
+                w.writerow(['Checkpoint'] + models + [mean_name, std_name])
+                for row_idx, checkpoint_nr in enumerate(checkpoints):
+                    w.writerow([checkpoint_nr] + table[row_idx, :, stat_idx].tolist() +
+                               [means[row_idx, stat_idx], stds[row_idx, stat_idx]])
+            summaries[stat_idx].append(means[:, stat_idx])
+
+    create_dir(direct + 'Summary')
+    for stat_idx, (folder, mean_name, _) in enumerate(STATISTICS):
+        with open(direct + 'Summary/' + mean_name + '.csv', 'w') as f:
+            w = csv.writer(f, dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
+            w.writerow(summary_header)
+            for row_idx, checkpoint_nr in enumerate(checkpoints):
+                w.writerow([checkpoint_nr] + [summary[row_idx] for summary in summaries[stat_idx]])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate all checkpoints of all selected runs.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes (default: 1).')
+    parser.add_argument('--envs', type=int, default=1,
+                        help='Number of env copies per checkpoint, each stepped in its own subprocess (default: 1). '
+                             'Requires --workers 1.')
+    parser.add_argument('--inference', choices=['tf', 'numpy'], default='tf',
+                        help='Run the policies via PPO2 (tf) or via the TF-free NumPy implementation (numpy).')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for evaluating each checkpoint.')
+    parser.add_argument('--no-cache', action='store_true', help='Do not re-use cached evaluation results.')
+    parser.add_argument('--model-pool', type=int, default=4,
+                        help='TF inference: max. number of TF graphs/sessions kept alive per process, each re-used for '
+                             'all checkpoints of the same architecture (see model_pool.py). 0: new graph per checkpoint '
+                             '(default: 4).')
+    parser.add_argument('--aggregate-only', action='store_true',
+                        help='Only (re-)create the learning curves from the results evaluated so far using the given '
+                             '--inference, --seed and --envs.')
+    args = parser.parse_args()
+    if args.workers > 1 and args.envs > 1:
+        parser.error('--workers and --envs cannot both be larger than 1.')
+
+    create_dir(PATH_WRITE)
+    results_path = PATH_WRITE + RESULTS_FILE_NAME
+    test_run_kwargs = {'num_envs': args.envs, 'inference': args.inference, 'seed': args.seed}
+
+    if not args.aggregate_only:
+        catalog = RunCatalog(PATH_READ)
+        candidate_dirs, _ = catalog.get_complete_trials()
+        used_dict, _ = catalog.remove_redundant_runs(candidate_dirs)
+        checkpoint_jobs = list_checkpoint_jobs(PATH_READ, catalog, used_dict)
+        catalog.close()
+
+        cache = None if args.no_cache else EvaluationCache()
+        model_pool = process_model_pool(args.model_pool) if args.inference == 'tf' and args.model_pool > 0 else None
+        run_sweep(checkpoint_jobs, results_path, num_workers=args.workers,
+                  test_run_kwargs=dict(test_run_kwargs, cache=cache, model_pool=model_pool))
+
+    save_learning_curves(PATH_WRITE, read_results(results_path, evaluation_settings(test_run_kwargs)))
+    print('Done.')
@@ -0,0 +1,304 @@
+import os, io, re
+import json
+import zlib
+import hashlib
+import zipfile
+import argparse
+import numpy as np
+
+'''
+    Content-addressed, deduplicated storage of the models saved during training (checkpoint_*.zip, final_model.zip).
+
+    Each model's zip-archive consists of the members 'data', 'parameters' and 'parameter_list'. Every distinct member
+    content gets stored once as an object named by its SHA-256 hash (objects/<2 hex digits>/<hash>), so the 'data' and
+    'parameter_list' shared by all checkpoints of a run (and often by all runs of a parameter setting) take up disk space
+    only once. The 'parameters' of a model are stored as delta against those of the run's preceding model: both blobs
+    get XOR'ed byte by byte, which leaves (mostly) zero bytes wherever the weights barely changed, and which can be
+    reverted losslessly. Every keyframe_interval-th model of a run, and every model whose 'parameters' differ in size
+    from the preceding one, is stored as full blob, limiting the number of deltas to be applied when reading a model.
+    Objects may be zlib-compressed.
+
+    Per model, a manifest (manifests/<run>/<file name>.json) lists its members in order, together with the objects
+    holding them and the zip metadata needed to rebuild an archive identical to the original one. Models can be read
+    back as file-like zip-archives (CheckpointStore.open()), which PPO2.load() and numpy_policy.load_parameters()
+    accept in place of a path, or exported to disk (CheckpointStore.export()).
+'''
+
+DEFAULT_STORE_DIR = '../Results/CheckpointStore/'
+DEFAULT_KEYFRAME_INTERVAL = 10
+
+# First byte of each stored object, marking whether the remaining bytes are zlib-compressed
+_RAW, _COMPRESSED = b'R', b'Z'
+
+
+def model_files(run_path):
+    """
+    :param run_path: Folder of a run.
+    :return: File names of the run's checkpoints ordered by update-nr, followed by final_model.zip (if present)
+    """
+    checkpoints = [file_name for file_name in os.listdir(run_path) if re.match(r'checkpoint_\d+\.zip$', file_name)]
+    checkpoints.sort(key=lambda file_name: int(file_name[len('checkpoint_'):-len('.zip')]))
+    if os.path.exists(os.path.join(run_path, 'final_model.zip')):
+        checkpoints.append('final_model.zip')
+    return checkpoints
+
+
+def _xor(blob, base):
+    return (np.frombuffer(blob, dtype=np.uint8) ^ np.frombuffer(base, dtype=np.uint8)).tobytes()
+
+
+class CheckpointStore(object):
+    """
+        Store folder holding the objects and the manifests of all stored models.
+    """
+
+    def __init__(self, directory=DEFAULT_STORE_DIR, compress=True, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        """
+        :param directory: Folder of the store.
+        :param compress: Whether to zlib-compress newly stored objects.
+        :param keyframe_interval: Max. number of consecutive models of a run whose 'parameters' are stored as deltas
+                                  (plus one); 1 stores all 'parameters' as full blobs.
+        """
+        self.directory = directory
+        self.compress = compress
+        self.keyframe_interval = keyframe_interval
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def _manifest_path(self, run, file_name):
+        return os.path.join(self.directory, 'manifests', run, file_name + '.json')
+
+    def put_object(self, content):
+        """
+            Stores content unless an object of the same content exists already.
+        :param content: Bytes to be stored.
+        :return: SHA-256 hex digest addressing the object
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = zlib.compress(content, 6) if self.compress else None
+            stored = _COMPRESSED + compressed if compressed is not None and len(compressed) < len(content) \
+                else _RAW + content
+            # Write to a temporary file first, so that an interrupted write never leaves a corrupt object behind
+            with open(path + '.tmp', 'wb') as f:
+                f.write(stored)
+            os.replace(path + '.tmp', path)
+        return digest
+
+    def get_object(self, digest):
+        """
+        :param digest: Address of the object as returned by put_object().
+        :return: Content of the object
+        """
+        with open(self._object_path(digest), 'rb') as f:
+            stored = f.read()
+        content = zlib.decompress(stored[1:]) if stored[:1] == _COMPRESSED else stored[1:]
+        if hashlib.sha256(content).hexdigest() != digest:
+            raise ValueError('Corrupt object: ' + self._object_path(digest))
+        return content
+
+    def runs(self):
+        """
+        :return: Sorted list of the runs holding stored models
+        """
+        manifests = os.path.join(self.directory, 'manifests')
+        return sorted(os.listdir(manifests)) if os.path.isdir(manifests) else []
+
+    def models(self, run):
+        """
+        :param run: Run folder name.
+        :return: File names of the run's stored models, in the order in which they were added
+        """
+        manifests = [self.load_manifest(run, file_name[:-len('.json')])
+                     for file_name in os.listdir(os.path.join(self.directory, 'manifests', run))
+                     if file_name.endswith('.json')]
+        return [manifest['file_name'] for manifest in sorted(manifests, key=lambda manifest: manifest['position'])]
+
+    def contains(self, run, file_name):
+        return os.path.exists(self._manifest_path(run, file_name))
+
+    def load_manifest(self, run, file_name):
+        with open(self._manifest_path(run, file_name)) as f:
+            return json.load(f)
+
+    def _save_manifest(self, run, file_name, manifest):
+        path = self._manifest_path(run, file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def add_model(self, model_path, run, base=None, position=0):
+        """
+            Stores a model's zip-archive.
+        :param model_path: Path to the zip-archive.
+        :param run: Run folder name the model gets stored under.
+        :param base: File name of the run's preceding model (already stored) the 'parameters' get delta-encoded
+                     against; stored as full blob if None.
+        :param position: Position of the model among the run's models (see models()).
+        :return: Manifest of the model
+        """
+        base_parameters, chain_length = None, 0
+        if base is not None:
+            base_manifest = self.load_manifest(run, base)
+            base_member = next(member for member in base_manifest['members'] if member['name'] == 'parameters')
+            chain_length = base_member.get('chain_length', 0) + 1
+            if chain_length < self.keyframe_interval:
+                base_parameters = self.read_member(run, base, 'parameters')
+
+        members = []
+        with zipfile.ZipFile(model_path) as archive:
+            for info in archive.infolist():
+                content = archive.read(info)
+                member = {'name': info.filename, 'date_time': list(info.date_time),
+                          'compress_type': info.compress_type, 'external_attr': info.external_attr,
+                          'create_system': info.create_system}
+                if info.filename == 'parameters' and base_parameters is not None \
+                        and len(base_parameters) == len(content):
+                    member.update({'object': self.put_object(_xor(content, base_parameters)), 'delta_base': base,
+                                   'chain_length': chain_length})
+                else:
+                    member['object'] = self.put_object(content)
+                members.append(member)
+
+        manifest = {'run': run, 'file_name': os.path.basename(model_path), 'position': position, 'members': members}
+        self._save_manifest(run, manifest['file_name'], manifest)
+        return manifest
+
+    def add_run(self, run_path, run=None):
+        """
+            Stores all models of a run (see model_files()) not stored yet, each delta-encoded against its predecessor.
+        :param run_path: Folder of the run.
+        :param run: Run folder name the models get stored under; the name of run_path if None.
+        :return: List of the file names of the newly stored models
+        """
+        run = run or os.path.basename(os.path.normpath(run_path))
+        added, base = [], None
+        for position, file_name in enumerate(model_files(run_path)):
+            if not self.contains(run, file_name):
+                self.add_model(os.path.join(run_path, file_name), run, base=base, position=position)
+                added.append(file_name)
+            base = file_name
+        return added
+
+    def read_member(self, run, file_name, member_name):
+        """
+        :param run: Run folder name.
+        :param file_name: File name of the stored model, e.g. 'checkpoint_500.zip'.
+        :param member_name: Name of the member of the model's zip-archive, e.g. 'parameters'.
+        :return: Content of the member
+        """
+        manifest = self.load_manifest(run, file_name)
+        member = next(member for member in manifest['members'] if member['name'] == member_name)
+        content = self.get_object(member['object'])
+        if member.get('delta_base') is not None:
+            content = _xor(content, self.read_member(run, member['delta_base'], member_name))
+        return content
+
+    def read_bytes(self, run, file_name):
+        """
+            Rebuilds a stored model's zip-archive.
+        :param run: Run folder name.
+        :param file_name: File name of the stored model.
+        :return: Content of the zip-archive
+        """
+        manifest = self.load_manifest(run, file_name)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for member in manifest['members']:
+                info = zipfile.ZipInfo(member['name'], date_time=tuple(member['date_time']))
+                info.compress_type = member['compress_type']
+                info.external_attr = member['external_attr']
+                info.create_system = member['create_system']
+                archive.writestr(info, self.read_member(run, file_name, member['name']))
+        return buffer.getvalue()
+
+    def open(self, run, file_name):
+        """
+        :param run: Run folder name.
+        :param file_name: File name of the stored model.
+        :return: File-like object holding the model's zip-archive, to be passed to PPO2.load() or
+                 numpy_policy.load_parameters() in place of a path
+        """
+        return io.BytesIO(self.read_bytes(run, file_name))
+
+    def export(self, run, file_name, path):
+        """
+            Writes a stored model's zip-archive to disk.
+        :param run: Run folder name.
+        :param file_name: File name of the stored model.
+        :param path: Path of the zip-archive to be written.
+        :return: -
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(self.read_bytes(run, file_name))
+
+    def verify(self, run_path, run=None):
+        """
+            Checks that every model of a run is stored and reads back with identical members.
+        :param run_path: Folder of the run.
+        :param run: Run folder name the models are stored under; the name of run_path if None.
+        :return: List of the file names of the models not stored (correctly)
+        """
+        run = run or os.path.basename(os.path.normpath(run_path))
+        failed = []
+        for file_name in model_files(run_path):
+            try:
+                with zipfile.ZipFile(os.path.join(run_path, file_name)) as original, \
+                        zipfile.ZipFile(self.open(run, file_name)) as restored:
+                    if original.namelist() != restored.namelist() or \
+                            any(original.read(name) != restored.read(name) for name in original.namelist()):
+                        failed.append(file_name)
+            except (IOError, KeyError, ValueError, zipfile.BadZipFile):
+                failed.append(file_name)
+        return failed
+
+    def size(self):
+        """
+        :return: Total size of all files of the store in bytes
+        """
+        return sum(os.path.getsize(os.path.join(folder, file_name))
+                   for folder, _, file_names in os.walk(self.directory) for file_name in file_names)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Deduplicated storage of the checkpoints and final models of all runs.')
+    parser.add_argument('command', choices=['add', 'verify', 'export'],
+                        help='add: store the models of all runs not stored yet; verify: check that all models of all '
+                             'runs read back identically; export: write a stored model to disk.')
+    parser.add_argument('--results', default='../Results/PPO2/', help='Folder containing the runs\' folders.')
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR, help='Folder of the store.')
+    parser.add_argument('--no-compression', action='store_true', help='Do not zlib-compress stored objects.')
+    parser.add_argument('--keyframe-interval', type=int, default=DEFAULT_KEYFRAME_INTERVAL,
+                        help='Store every n-th model of a run as full blob instead of as delta (default: 10).')
+    parser.add_argument('--run', help='export: run folder name of the model.')
+    parser.add_argument('--model', help='export: file name of the model, e.g. checkpoint_500.zip.')
+    parser.add_argument('--output', help='export: path of the zip-archive to be written.')
+    args = parser.parse_args()
+
+    store = CheckpointStore(args.store, compress=not args.no_compression, keyframe_interval=args.keyframe_interval)
+    runs = sorted(run for run in os.listdir(args.results) if os.path.isdir(os.path.join(args.results, run)))
+
+    if args.command == 'add':
+        for run in runs:
+            added = store.add_run(os.path.join(args.results, run), run)
+            print('Stored ' + str(len(added)) + ' models of run: ' + run)
+        original_size = sum(os.path.getsize(os.path.join(args.results, run, file_name))
+                            for run in runs for file_name in model_files(os.path.join(args.results, run)))
+        print('Size of the models: ' + str(original_size) + ' bytes; size of the store: ' + str(store.size()) +
+              ' bytes')
+    elif args.command == 'verify':
+        failed = {run: store.verify(os.path.join(args.results, run), run) for run in runs}
+        failed = {run: file_names for run, file_names in failed.items() if file_names}
+        print('All models stored correctly.' if not failed else 'Models missing or differing: ' + str(failed))
+        if failed:
+            raise SystemExit(1)
+    else:
+        if not (args.run and args.model and args.output):
+            parser.error('export requires --run, --model and --output.')
+        store.export(args.run, args.model, args.output)
+        print('Exported: ' + args.output)
@@ -0,0 +1,187 @@
+import os, time
+import csv
+import argparse
+import numpy as np
+
+from run_catalog import RunCatalog, add_grouping_arguments, group_runs_from_arguments
+from training_aggregation import load_training_tensor, UPDATE_NR, GRASPS
+from eval_journal import EvaluationJournal
+from sharding import load_shards
+from significance import pairwise_permutation_tests, adjust_pairwise_p_values, DEFAULT_NUM_PERMUTATIONS, CORRECTIONS
+from typed_output import save_table
+
+'''
+    Pairwise comparison of all parameter settings after final_evaluation.py and training_analysis.py have run.
+    For every pair of parameter settings, a permutation test (see significance.py) checks whether the runs of both
+    settings differ in
+        - FinalScore: the mean score of each run's final model in the final evaluation (taken from the evaluation's
+          journal, or from its shards if it was sharded), and
+        - GraspsAUC: the area under each run's training-progress curve of grasps per logged period (training_eval.csv)
+          over the update-nrs.
+    The p-values get corrected for multiple comparisons (over all pairs of a metric) and saved as matrices:
+        <direct>/<metric>/PValues.csv:          Corrected p-values, one row and column per parameter setting
+        <direct>/<metric>/RawPValues.csv:       Uncorrected p-values
+        <direct>/<metric>/MeanDifferences.csv:  Mean of the row's setting minus mean of the column's setting
+        <direct>/<metric>/Pairs.csv:            One row per pair of settings
+'''
+
+PATH_READ = '../Results/PPO2/'
+PATH_WRITE = '../Comparison/'
+JOURNAL_DIR = '../FinalEvaluation/Journal/'
+SHARD_DIR = '../FinalEvaluation/Shards/'
+
+
+def setting_name(param_id):
+    """
+    :param param_id: Parameter-setting-id, e.g. 'ParameterSettings/params_1.json'.
+    :return: Name as used in the headers of the summaries, e.g. 'params_1'
+    """
+    return param_id.replace('ParameterSettings/', '').replace('.json', '')
+
+
+def grasps_auc(path, params):
+    """
+        Area under the curve of grasps per logged period over the update-nrs (trapezoidal rule) of every run. Only
+        segments between two logged periods having both been logged contribute.
+    :param path: Path to the folder containing the runs' folders.
+    :param params: Dictionary; key: parameter-setting-id, val: list of runs trained on the respective parameter setting.
+    :return: Numpy array of shape (settings, max. runs per setting); NaN for missing runs
+    """
+    tensor, run_counts = load_training_tensor(path, params)
+    update_nrs, grasps = tensor[..., UPDATE_NR], tensor[..., GRASPS]
+    segments = (grasps[..., 1:] + grasps[..., :-1]) / 2. * np.diff(update_nrs, axis=-1)
+    valid = ~np.isnan(segments)
+    areas = np.where(valid, segments, 0.).sum(axis=-1)
+    return np.where(valid.any(axis=-1), areas, np.nan)
+
+
+def final_scores(path, params, journal_dir=JOURNAL_DIR, shard_dir=SHARD_DIR):
+    """
+        Mean score of each run's final model, as recorded by final_evaluation.py.
+    :param path: Path to the folder containing the runs' folders (as passed to final_evaluation.py).
+    :param params: Dictionary; key: parameter-setting-id, val: list of runs trained on the respective parameter setting.
+    :param journal_dir: Folder holding the journal of the final evaluation (see eval_journal.py).
+    :param shard_dir: Folder holding the shards of a sharded final evaluation (see sharding.py); used for runs not found
+                      in the journal.
+    :return: Numpy array of shape (settings, max. runs per setting); NaN for runs not evaluated (or missing)
+    """
+    _, completed_models, _ = EvaluationJournal(journal_dir).load()
+    try:
+        _, shard_episodes = load_shards(shard_dir)
+    except (ValueError, IOError):
+        shard_episodes = dict()
+
+    scores = np.full((len(params), max([len(runs) for runs in params.values()] or [0])), np.nan)
+    for setting_idx, runs in enumerate(params.values()):
+        for run_idx, run in enumerate(runs):
+            result = completed_models.get(path + run + '/final_model.zip')
+            if result is not None:
+                scores[setting_idx, run_idx] = result[0]
+            elif run in shard_episodes:
+                scores[setting_idx, run_idx] = np.nanmean([episode[0] for episode in shard_episodes[run]])
+    return scores
+
+
+def compare_settings(names, values, num_permutations=DEFAULT_NUM_PERMUTATIONS, correction='holm', seed=0):
+    """
+        Tests all pairs of parameter settings for a difference in the mean of a metric over their runs.
+    :param names: List of the settings' names.
+    :param values: Numpy array of shape (settings, max. runs per setting) holding the metric per run; NaN-padded.
+    :param num_permutations: Number of permutations per pair.
+    :param correction: Correction for multiple comparisons (see significance.adjust_p_values()).
+    :param seed: Seed making the permutations reproducible.
+    :return: Dictionary holding the settings' names, number of runs and means, and matrices of shape
+             (settings, settings): differences, p_values (uncorrected) and adjusted (corrected p-values)
+    """
+    tests = pairwise_permutation_tests(values, num_permutations=num_permutations, seed=seed)
+    counts = (~np.isnan(values)).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(np.isnan(values), 0., values).sum(axis=1) / counts
+    return {'names': list(names), 'runs': counts, 'means': means, 'differences': tests['differences'],
+            'p_values': tests['p_values'], 'adjusted': adjust_pairwise_p_values(tests['p_values'], correction)}
+
+
+def save_comparison(direct, comparison, alpha=0.05, metadata=None):
+    """
+        Saves the result of compare_settings() as matrices and as list of pairs (csv files and typed binary files).
+    :param direct: Folder where to store the emission files.
+    :param comparison: Result of compare_settings().
+    :param alpha: Significance level the corrected p-values get compared to in Pairs.csv.
+    :param metadata: Optional json-serializable dictionary describing the comparison (saved to the typed files only).
+    :return: -
+    """
+    if not os.path.exists(direct):
+        os.makedirs(direct)
+    names = comparison['names']
+    for file_name, matrix in [('PValues', comparison['adjusted']), ('RawPValues', comparison['p_values']),
+                              ('MeanDifferences', comparison['differences'])]:
+        with open(os.path.join(direct, file_name + '.csv'), 'w') as f:
+            w = csv.writer(f, dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
+            w.writerow(['Parameter-setting'] + names)
+            for name, row in zip(names, matrix.astype(str).tolist()):
+                w.writerow([name] + row)
+        save_table(direct, file_name, names, matrix, row_ids=names, metadata=metadata)
+
+    with open(os.path.join(direct, 'Pairs.csv'), 'w') as f:
+        w = csv.writer(f, dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
+        w.writerow(['Setting A', 'Setting B', 'Runs A', 'Runs B', 'Mean A', 'Mean B', 'Difference', 'p-value',
+                    'Corrected p-value', 'Significant'])
+        first, second = np.triu_indices(len(names), 1)
+        for a, b in zip(first, second):
+            adjusted = comparison['adjusted'][a, b]
+            w.writerow([names[a], names[b], int(comparison['runs'][a]), int(comparison['runs'][b]),
+                        float(comparison['means'][a]), float(comparison['means'][b]),
+                        float(comparison['differences'][a, b]), float(comparison['p_values'][a, b]), float(adjusted),
+                        int(adjusted <= alpha)])
+
+
+def print_significant_pairs(metric, comparison, alpha=0.05):
+    """
+        Prints the pairs of settings differing significantly (corrected p-value <= alpha).
+    :return: -
+    """
+    names = comparison['names']
+    first, second = np.triu_indices(len(names), 1)
+    significant = [(a, b) for a, b in zip(first, second) if comparison['adjusted'][a, b] <= alpha]
+    print(metric + ': ' + str(len(significant)) + ' of ' + str(len(first)) + ' pairs differ significantly (alpha = ' +
+          str(alpha) + ')')
+    for a, b in significant:
+        print('    ' + names[a] + ' vs. ' + names[b] + ': difference ' +
+              '{:.4g}'.format(comparison['differences'][a, b]) + ', corrected p = ' +
+              '{:.4g}'.format(comparison['adjusted'][a, b]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pairwise permutation tests between all parameter settings.')
+    parser.add_argument('--permutations', type=int, default=DEFAULT_NUM_PERMUTATIONS,
+                        help='Number of permutations per pair of settings (default: ' +
+                             str(DEFAULT_NUM_PERMUTATIONS) + ').')
+    parser.add_argument('--correction', choices=CORRECTIONS, default='holm',
+                        help='Correction for multiple comparisons: Holm-Bonferroni, Bonferroni, Benjamini-Hochberg '
+                             '(false discovery rate) or none (default: holm).')
+    parser.add_argument('--alpha', type=float, default=0.05, help='Significance level (default: 0.05).')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the permutations (default: 0).')
+    add_grouping_arguments(parser)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    catalog = RunCatalog(PATH_READ)
+    candidate_dirs, _ = catalog.get_complete_trials()
+    used_dict, _ = group_runs_from_arguments(catalog, candidate_dirs, args)
+    catalog.close()
+    names = [setting_name(key) for key in used_dict]
+
+    for metric, values in [('FinalScore', final_scores(PATH_READ, used_dict)),
+                           ('GraspsAUC', grasps_auc(PATH_READ, used_dict))]:
+        if np.isnan(values).all():
+            print(metric + ': no values found, skipped.')
+            continue
+        comparison = compare_settings(names, values, num_permutations=args.permutations, correction=args.correction,
+                                      seed=args.seed)
+        save_comparison(PATH_WRITE + metric, comparison, alpha=args.alpha,
+                        metadata={'metric': metric, 'permutations': args.permutations, 'correction': args.correction,
+                                  'parameter_settings': list(used_dict.keys())})
+        print_significant_pairs(metric, comparison, alpha=args.alpha)
+
+    print('Compared ' + str(len(names)) + ' parameter settings in ' + '{:.2f}'.format(time.perf_counter() - start) +
+          ' s.')
@@ -0,0 +1,213 @@
+import os, sys
+import json
+import hashlib
+import argparse
+
+'''
+    On-disk cache for the results of final_evaluation.test_run().
+    Each entry is a small json-file named after its key. The key is a content hash of the model's zip-archive combined
+    with all settings influencing the outcome of an evaluation, so that entries stay valid as long as neither the
+    model nor the way it gets evaluated changes. The cache is bounded in its number of entries; once the bound is
+    exceeded, the least recently used entries get evicted.
+
+    Usage as script:
+        python eval_cache.py invalidate --all
+        python eval_cache.py invalidate --model ../Results/PPO2/<model_id>/final_model.zip [...]
+        python eval_cache.py info
+'''
+
+DEFAULT_CACHE_DIR = '../FinalEvaluation/Cache/'
+
+# Fields of params.json affecting the test environment
+ENV_PARAMS = ['fixed_action_repetitions', 'dist_specification', 'maxDist', 'maxDeviation']
+
+# Version of the format of stored results; entries of other versions are never hit
+# 2: [mean score, mean time, mean std of time, number of test runs]
+# 3: as 2, but seeded evaluations seed each test run separately (see final_evaluation.derive_episode_seed())
+# 4: as 3, but keys of seeded evaluations include the model's identity (see model_identity())
+RESULT_FORMAT = 4
+
+
+def model_identity(model_path):
+    """
+        Identity of a model as used for deriving the seeds of its test runs: its run folder's and archive's names, so
+        that it does not depend on where the Results folder is located.
+    :param model_path: Path to the model.
+    :return: String, e.g. '<run folder>/final_model.zip'
+    """
+    return '/'.join(os.path.normpath(model_path).split(os.sep)[-2:])
+
+
+def hash_file(file_path, chunk_size=1 << 20):
+    """
+        Content hash (sha256) of a file.
+    :param file_path: Path to the file to be hashed.
+    :param chunk_size: Number of bytes read at once.
+    :return: Hex digest
+    """
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class EvaluationCache(object):
+    """
+        Size-bounded, persistent cache mapping evaluation settings to the results of test_run().
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_entries=1000):
+        """
+        :param directory: Folder holding the cache entries.
+        :param max_entries: Max. number of entries kept; least recently used entries get evicted beyond that.
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+
+    @staticmethod
+    def make_key(model_path, params, num_test_runs, iterations, seed=None, inference='tf', stopping=None):
+        """
+            Computes the key under which the evaluation result of a model gets stored.
+        :param model_path: Path to the model's zip-archive; its content gets hashed.
+        :param params: Dictionary of parameters the model was trained with (params.json).
+        :param num_test_runs: Number of test runs per evaluation.
+        :param iterations: Number of time steps per test run.
+        :param seed: Seed used for the evaluation (None if unseeded). Since the test runs of seeded evaluations get
+                     seeded depending on the model's identity, content-identical models at different paths get
+                     different keys then.
+        :param inference: Inference backend used for running the policy ('tf' or 'numpy').
+        :param stopping: Settings of the adaptive stopping rule (dict); None if using a fixed number of test runs.
+        :return: Key (hex string)
+        """
+        spec = {'format': RESULT_FORMAT,
+                'model': hash_file(model_path),
+                'env': {field: params.get(field) for field in ENV_PARAMS},
+                'num_test_runs': num_test_runs,
+                'iterations': iterations,
+                'seed': seed,
+                'model_identity': None if seed is None else model_identity(model_path),
+                'inference': inference,
+                'stopping': stopping}
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+    def __len__(self):
+        return len(self._entries())
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')]
+
+    def get(self, key):
+        """
+            Looks up the result stored for a given key and marks the entry as recently used.
+        :param key: Key as returned by make_key().
+        :return: Stored result (list) or None in case of a cache miss.
+        """
+        record = self._read(key)
+        if record is None:
+            return None
+        os.utime(self._entry_path(key))  # Used recently
+        return record['result']
+
+    def get_episodes(self, key):
+        """
+            Looks up the statistics of the single test runs stored along with a result.
+        :param key: Key as returned by make_key().
+        :return: List of [score, mean time, std time] per test run, or None if not stored (or a cache miss).
+        """
+        record = self._read(key)
+        return None if record is None else record.get('episodes')
+
+    def _read(self, key):
+        try:
+            with open(self._entry_path(key)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def put(self, key, result, model_path=None, episodes=None):
+        """
+            Stores a result under a given key and evicts least recently used entries if necessary.
+        :param key: Key as returned by make_key().
+        :param result: Json-serializable result (NaNs are allowed).
+        :param model_path: Path to the evaluated model; recorded for invalidation by model.
+        :param episodes: Optional list of the statistics [score, mean time, std time] of the single test runs the
+                         result is based on (e.g. for bootstrapping, see bootstrap.py).
+        :return: -
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path + '.tmp' + str(os.getpid())
+        record = {'result': result, 'model_path': None if model_path is None else os.path.abspath(model_path)}
+        if episodes is not None:
+            record['episodes'] = [[float(statistic) for statistic in episode] for episode in episodes]
+        with open(tmp_path, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, entry_path)  # Atomic; concurrent workers never see partially written entries
+        self.evict()
+
+    def evict(self):
+        """
+            Removes the least recently used entries until at most max_entries entries are left.
+        :return: Number of removed entries
+        """
+        entries = self._entries()
+        if len(entries) <= self.max_entries:
+            return 0
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        to_be_removed = entries[:len(entries) - self.max_entries]
+        for entry in to_be_removed:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # Evicted concurrently by another worker
+        return len(to_be_removed)
+
+    def invalidate(self, model_paths=None):
+        """
+            Removes entries from the cache.
+        :param model_paths: List of paths to models whose entries are to be removed. If None, all entries get removed.
+        :return: Number of removed entries
+        """
+        if model_paths is not None:
+            model_paths = set(os.path.abspath(model_path) for model_path in model_paths)
+        removed = 0
+        for entry in self._entries():
+            if model_paths is not None:
+                try:
+                    with open(entry.path) as f:
+                        if json.load(f).get('model_path') not in model_paths:
+                            continue
+                except (IOError, ValueError):
+                    pass  # Broken entries get removed in any case
+            os.remove(entry.path)
+            removed += 1
+        return removed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the cache of final evaluation results.')
+    parser.add_argument('--dir', default=DEFAULT_CACHE_DIR, help='Cache directory.')
+    commands = parser.add_subparsers(dest='command')
+    invalidate = commands.add_parser('invalidate', help='Remove cache entries.')
+    invalidate.add_argument('--model', nargs='+', help='Paths to the models whose entries are to be removed.')
+    invalidate.add_argument('--all', action='store_true', help='Remove all entries.')
+    commands.add_parser('info', help='Print the number of cached entries.')
+    args = parser.parse_args()
+
+    cache = EvaluationCache(args.dir)
+    if args.command == 'invalidate':
+        if not args.all and not args.model:
+            parser.error('invalidate requires either --model or --all.')
+        print('Removed entries: ' + str(cache.invalidate(None if args.all else args.model)))
+    elif args.command == 'info':
+        print('Cached entries: ' + str(len(cache)))
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,129 @@
+import os
+import json
+import glob
+
+'''
+    Append-only journal of the progress of final_evaluation.py.
+    Every finished test run (= episode record) and every finished model (= model record) gets appended to the journal
+    as one json-encoded line. Model records are fsync'ed, so that a crashed or killed evaluation can be resumed from
+    the journal (see final_evaluation.py --resume) without losing completed models.
+    Each process writes to its own journal file inside the journal folder, so that worker processes never interleave
+    their records.
+'''
+
+DEFAULT_JOURNAL_DIR = '../FinalEvaluation/Journal/'
+
+
+class EvaluationJournal(object):
+    """
+        Journal folder containing one append-only file (journal_<pid>.jsonl) per writing process.
+    """
+
+    def __init__(self, directory=DEFAULT_JOURNAL_DIR):
+        """
+        :param directory: Folder holding the journal files.
+        """
+        self.directory = directory
+        self._file = None
+        self._pid = None
+
+    def __getstate__(self):
+        # File handles are per process; a worker process opens its own journal file upon its first record
+        return {'directory': self.directory, '_file': None, '_pid': None}
+
+    def _write(self, record, sync=False):
+        if self._file is None or self._pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self._pid = os.getpid()
+            self._file = open(os.path.join(self.directory, 'journal_' + str(self._pid) + '.jsonl'), 'a')
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def clear(self):
+        """
+            Removes all journal files, e.g. before starting an evaluation from scratch. The journal file of this
+            process gets closed, so that later records go to a new one.
+        :return: -
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file, self._pid = None, None
+        for journal_file in glob.glob(os.path.join(self.directory, 'journal_*.jsonl')):
+            os.remove(journal_file)
+
+    def record_start(self, settings):
+        """
+            Records the settings an evaluation got started with.
+        :param settings: Json-serializable dictionary of settings affecting the evaluation's results.
+        :return: -
+        """
+        self._write({'type': 'start', 'settings': settings}, sync=True)
+
+    def record_episode(self, model_path, statistics):
+        """
+            Records the statistics of a single finished test run.
+        :param model_path: Path to the evaluated model.
+        :param statistics: List [score, mean reaching time, std of reaching time] of the test run.
+        :return: -
+        """
+        self._write({'type': 'episode', 'model': model_path, 'statistics': [float(s) for s in statistics]})
+
+    def record_model(self, model_path, result):
+        """
+            Records the result of a completely evaluated model and syncs the journal to disk.
+        :param model_path: Path to the evaluated model.
+        :param result: Result as returned by test_run(): three statistics followed by the number of test runs.
+        :return: -
+        """
+        self._write({'type': 'model', 'model': model_path,
+                     'result': [float(s) for s in result[:3]] + [int(n) for n in result[3:]]}, sync=True)
+
+    def load(self):
+        """
+            Rebuilds the evaluation's state from all journal files. Incomplete trailing lines (e.g. written while the
+            evaluation got killed) are ignored.
+        :return:    settings: Settings recorded by record_start() (None if there are none)
+                    completed_models: Dictionary; key = model path, val = result of test_run()
+                    completed_episodes: Dictionary; key = model path of a not completely evaluated model,
+                                        val = list of statistics of the test runs finished for it
+        """
+        settings = None
+        completed_models = dict()
+        completed_episodes = dict()
+        for journal_file in sorted(glob.glob(os.path.join(self.directory, 'journal_*.jsonl'))):
+            with open(journal_file) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record['type'] == 'start':
+                        settings = record['settings']
+                    elif record['type'] == 'model':
+                        completed_models[record['model']] = tuple(record['result'])
+                    elif record['type'] == 'episode':
+                        completed_episodes.setdefault(record['model'], []).append(record['statistics'])
+
+        for model_path in completed_models:
+            completed_episodes.pop(model_path, None)
+        return settings, completed_models, completed_episodes
+
+    def load_episodes(self):
+        """
+            Collects the statistics of all test runs recorded in all journal files, e.g. for bootstrapping the
+            statistics per parameter setting over the test runs (see bootstrap.py).
+        :return: Dictionary; key = model path, val = list of statistics [score, mean time, std time] of its test runs
+        """
+        episodes = dict()
+        for journal_file in sorted(glob.glob(os.path.join(self.directory, 'journal_*.jsonl'))):
+            with open(journal_file) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record['type'] == 'episode':
+                        episodes.setdefault(record['model'], []).append(record['statistics'])
+        return episodes
@@ -1,14 +1,26 @@
 import os, sys
 import json, csv
+import zlib
+import argparse
+import multiprocessing
+import time
 import numpy as np
-#import time
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 
-import gym
-from stable_baselines import PPO2
-from customRobotEnv import PandaRobotEnv
-from stable_baselines.common.vec_env import DummyVecEnv
+from numpy_policy import NumpyMlpPolicy
+from eval_cache import EvaluationCache, model_identity
+from run_catalog import RunCatalog, add_grouping_arguments, group_runs_from_arguments
+from eval_journal import EvaluationJournal
+from adaptive_stopping import SequentialStoppingRule
+from profiling import EvaluationProfiler
+from model_pool import process_model_pool
+from typed_output import save_table
+from bootstrap import bootstrap_hierarchical_means, DEFAULT_NUM_RESAMPLES
+from sharding import ShardFile, parse_shard, list_work_units, assign_work_units, load_shards
+# stable_baselines (and hence TensorFlow) is only imported where needed, i.e. not at all when evaluating serially
+# using inference='numpy'. Likewise, the simulation (customRobotEnv) is only imported when creating a PandaRobotEnv,
+# so that e.g. benchmark.py can evaluate using its stub environment without the simulation being installed.
 
 def create_dir(direct):
     """
@@ -25,88 +37,8 @@ PATH_READ = '../Results/PPO2/'
 PATH_WRITE = "../FinalEvaluation/"
 print(PATH_READ)
 
-
-def get_complete_trials(path):
-    """
-        Takes a path and checks which of the folders/archives inside given folder (specified by path) contain a
-        final model generated during the training progress, and hence determines which data sets in terms of archives
-        are complete (due to complete training process).
-    :param path: Path to archive(s)-location
-    :return:    dirs: List of directories/archives only containing those with complete data sets.
-                list_outtakes: List of data directories/archives containing not completed test runs indicated by
-                               absence of final model.
-    """
-    dirs = os.listdir(path)
-    list_outtakes = []
-    print('All dirs:')
-    print(dirs)
-    print()
-
-    for direct in dirs:
-        f = []
-        for (dirpath, dirnames, filenames) in os.walk(path+direct):
-            f.extend(filenames)
-            break
-        if 'final_model.zip' in f:
-            pass
-        else:
-            print('Incomplete data at: ' + direct)
-            list_outtakes.append(direct)
-            dirs.remove(direct)
-
-    return dirs, list_outtakes
-
-
-def return_parameter_specification_id_for_file(file_name):
-    """
-        Given a folder name of a folder containing data created during model's training, the method returns which
-        parameter specification file was used to specify the parameters as a function of which the agent's training
-        proceeded.
-    :param file_name: Folder containing data created during training.
-    :return: -
-    """
-    with open(file_name) as json_file:
-        data = json.load(json_file)
-    try:
-        # Data might not contain requested element
-        return data['provided_params_file']
-    except KeyError:
-        return None
-
-
-def remove_redundant_runs(path, data_directories):
-    """
-        Filter out redundant back-up-test runs which are too many.
-        :param path: Path to directories potentially to be included
-        :param data_directories: Candidate directories to potentially be included in analysis
-        :return:
-            During training, each train run was called with a given parameter specification provided in a named file.
-            This function reads out from the data created during training which parameter specification file was
-            used for generating the respective data set specified by a given data_directory.
-    """
-    parameter_specification_ids = dict()
-    discarded_data_directories = []
-    maxElements = 5
-    #print('Potential data directories: ')
-    #print(data_directories)
-    for directory in data_directories:
-        #print('To be checked: ' + path+directory+'/params.json')
-        parameter_specification_id = return_parameter_specification_id_for_file(path+directory+'/params.json')
-        if parameter_specification_id is not None:
-            if parameter_specification_id not in parameter_specification_ids.keys():
-                id_list = [directory]
-                parameter_specification_ids[parameter_specification_id] = id_list
-            else:
-                prev_records = parameter_specification_ids[parameter_specification_id]
-                if len(prev_records) < maxElements:
-                    prev_records.append(directory)
-                    parameter_specification_ids[parameter_specification_id] = prev_records
-                else:
-                    discarded_data_directories.append(directory)
-        else:
-            discarded_data_directories.append(directory)
-
-    return parameter_specification_ids, discarded_data_directories
+NUM_TEST_RUNS = 100     # Test runs per model
+ITERATIONS = 1000       # Time steps per test run
 
 
 def clean_parameter_specification_id_string(param_id):
@@ -171,7 +103,7 @@ def save_which_data_was_used(direct, used_dict, not_used_lists):
     f.close()
 
 
-def save_mean_and_std_time_to_file(direct, name, data_dict_mean, data_dict_std):
+def save_mean_and_std_time_to_file(direct, name, data_dict_mean, data_dict_std, data_dict_test_runs=None):
     """
         Write both average mean grasping time steps per parameter-specification-id and the corresponding std to file,
         both in consecutive columns.
@@ -179,6 +111,8 @@ def save_mean_and_std_time_to_file(direct, name, data_dict_mean, data_dict_std):
     :param name: Indication how to call resulting file
     :param data_dict_mean: Dict containing mean grasping time steps per parameter-specification-id (saved row-wise)
     :param data_dict_std: Dict containing mean std of mean grasping time steps per parameter-specification-id
+    :param data_dict_test_runs: Optional dict containing the number of test runs the statistics per
+                                parameter-specification-id are based on; added as additional column if given.
     :return: -
     """
     create_dir(direct)
@@ -186,20 +120,28 @@ def save_mean_and_std_time_to_file(direct, name, data_dict_mean, data_dict_std):
     # Save as csv
     with open(direct + "/" + name + ".csv", "w") as f:
         w = csv.writer(f, dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
-        w.writerow(['Parameter-specification-id', 'Mean grasping time steps', 'Mean std of mean grasping time steps'])
+        header = ['Parameter-specification-id', 'Mean grasping time steps', 'Mean std of mean grasping time steps']
+        if data_dict_test_runs is not None:
+            header.append('Test runs used')
+        w.writerow(header)
         for key in data_dict_mean.keys():
-            w.writerow([clean_parameter_specification_id_string(key), data_dict_mean[key], data_dict_std[key]])
+            row = [clean_parameter_specification_id_string(key), data_dict_mean[key], data_dict_std[key]]
+            if data_dict_test_runs is not None:
+                row.append(data_dict_test_runs[key])
+            w.writerow(row)
         pass
 
     f.close()
 
 
-def save_dict_to_file(direct, name, data_dict):
+def save_dict_to_file(direct, name, data_dict, data_dict_test_runs=None):
     """
         Dictionary saving.
     :param direct: Folder where to store emission file
     :param name: Indication how to call resulting file
     :param data_dict: Dictionary containing parameter-setting-ids and their respective evaluation-statistics
+    :param data_dict_test_runs: Optional dictionary containing the number of test runs each statistic is based on;
+                                saved next to the respective statistic if given.
     :return: - (save to file)
     """
     create_dir(direct)
@@ -208,7 +150,10 @@ def save_dict_to_file(direct, name, data_dict):
     with open(direct + "/" + name + ".csv", "w") as f:
         w = csv.writer(f, dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
         for param_id, statistic in data_dict.items():
-            w.writerow([param_id, statistic])
+            if data_dict_test_runs is None:
+                w.writerow([param_id, statistic])
+            else:
+                w.writerow([param_id, statistic, data_dict_test_runs[param_id]])
 
     f.close()
 
@@ -226,50 +171,177 @@ def load_model_params(params_path):
     return params
 
 
-def test_run(model_path, params_path):
+def derive_episode_seed(seed, model_path, episode):
+    """
+        Seed of a single test run, derived from the evaluation's seed, the model and the index of the test run, so that
+        each test run is reproducible no matter in which order, in which process or on which machine it is performed.
+        The model is identified by its run folder's and archive's names only (see eval_cache.model_identity()), so
+        that the seeds do not depend on where the Results folder is located.
+    :param seed: Seed of the evaluation.
+    :param model_path: Path to the model.
+    :param episode: Index of the test run (0, 1, ...).
+    :return: Seed (int)
+    """
+    return int(np.random.SeedSequence([seed % (1 << 32), zlib.crc32(model_identity(model_path).encode()),
+                                       episode]).generate_state(1)[0])
+
+
+def make_test_env(params, num_envs=1, env_class=None):
+    """
+        Creates the vectorized test environment for a model.
+    :param params: Parameters used for training the model (see load_model_params()).
+    :param num_envs: Number of copies of the test environment; each copy runs in its own subprocess if num_envs > 1.
+    :param env_class: Class of the test environment, instantiated with the same arguments as PandaRobotEnv (e.g. the
+                      stub environment of benchmark.py). PandaRobotEnv if None.
+    :return: SingleEnvVecEnv if num_envs == 1, SubprocVecEnv otherwise
+    """
+    if env_class is None:
+        from customRobotEnv import PandaRobotEnv
+        env_class = PandaRobotEnv
+
+    def make_env():
+        return env_class(renders=params['render'],
+                         fixedActionRepetitions=params['fixed_action_repetitions'],
+                         distSpecifications=params['dist_specification'],
+                         maxDist=params['maxDist'],
+                         maxDeviation=params['maxDeviation'],
+                         maxSteps=ITERATIONS,
+                         evalFlag=True)
+    if num_envs > 1:
+        from stable_baselines.common.vec_env import SubprocVecEnv
+        return SubprocVecEnv([make_env for _ in range(num_envs)])  # One subprocess per copy of the env
+    return SingleEnvVecEnv(make_env())  # The algorithms require a vectorized environment to run, hence vectorize
+
+
+def load_test_model(model_path, params, inference='tf', model_pool=None):
     """
-        Performs 100 test runs for a given trained model. See method evaluate_measurements_per_param_specification()
-        for thorough explanation.
     :param model_path: Path to a trained model.
-    :param params_path: Path to the file summarizing the parameters used for training the model.
-    :return:
+    :param params: Parameters used for training the model (see load_model_params()).
+    :param inference: 'tf' to load the model via PPO2.load(), or 'numpy' to load it as NumpyMlpPolicy.
+    :param model_pool: ModelPool (see model_pool.py) re-using the TF graph of a previously loaded model of the same
+                       architecture. Only used if inference == 'tf'; every model gets its own graph if None.
+    :return: Loaded model
     """
+    if inference == 'numpy':
+        return NumpyMlpPolicy.load(model_path, act_fun=params['act_fun'])
+    if model_pool is not None:
+        return model_pool.load(model_path, params)
+    from stable_baselines import PPO2
+    return PPO2.load(model_path)
 
-    # Run simulation 100 times for a single model
 
-    num_test_runs = 100
-    iterations = 1000
+def summarize_test_runs(test_scores, test_times_means, test_times_stds):
+    """
+        Result of evaluating a model, given the statistics of its test runs (in order of the test runs).
+    :return: Tuple (mean score, mean time steps, mean std of time steps, number of test runs)
+    """
+    # mean test score over number of test runs for a single model,
+    # mean over 100*[mean time per test run],
+    # mean over 100*[std of mean time per test run],
+    # number of test runs performed
+    return np.nanmean(np.array(test_scores)), np.nanmean(np.array(test_times_means)), \
+        np.nanmean(np.array(test_times_stds)), len(test_scores)
 
-    print('Running 100 tests on model: ' + model_path)
-    print('Using params: ' + params_path)
 
-    # Load params
-    params = load_model_params(params_path)
+class SingleEnvVecEnv(object):
+    """
+        Minimal stand-in for stable-baselines' DummyVecEnv wrapping a single env: observations, rewards, dones and
+        infos get returned batched (batch size 1) and the env gets reset automatically at the end of an episode.
+        Avoids having to import stable_baselines (and TensorFlow) for serial evaluation.
+    """
 
-    #params['render'] = True
+    def __init__(self, env):
+        self.envs = [env]
+        self.num_envs = 1
 
-    # Creating test env
-    env = PandaRobotEnv(renders=params['render'],
-                        fixedActionRepetitions=params['fixed_action_repetitions'],
-                        distSpecifications=params['dist_specification'],
-                        maxDist=params['maxDist'],
-                        maxDeviation=params['maxDeviation'],
-                        maxSteps=iterations,
-                        evalFlag=True)
-    env = DummyVecEnv([lambda: env])  # The algorithms require a vectorized environment to run, hence vectorize
+    def reset(self):
+        return np.array([self.envs[0].reset()])
 
-    # Load model
-    model = PPO2.load(model_path)
+    def step(self, actions):
+        obs, reward, done, info = self.envs[0].step(actions[0])
+        if done:
+            obs = self.envs[0].reset()
+        return np.array([obs]), np.array([reward]), np.array([done]), [info]
 
-    # Run simulation
+    def seed(self, seed=None):
+        return [self.envs[0].seed(seed)]
+
+    def close(self):
+        self.envs[0].close()
+
+
+def test_run_statistics(rewards, time_step_counters, dones):
+    """
+        Computes the statistics of a single test run in one pass over the per-step buffers recorded while performing
+        it. Each episode end (done) starts a new episode; if the gripper has reached its goal (reward > 0), the time
+        steps since the preceding episode end (or the start of the test run) count as reaching time.
+    :param rewards: Numpy array holding the reward of each time step of the test run.
+    :param time_step_counters: Numpy array holding the step counter reported after each time step.
+    :param dones: Numpy array (bool) holding whether an episode ended with the respective time step.
+    :return: [score, mean reaching time, std of reaching times]; mean and std are NaN if the goal was never reached
+    """
+    events = np.flatnonzero(dones)
+    event_rewards = rewards[events]
+    # Time steps elapsed between successive episode ends
+    durations = np.diff(time_step_counters[events], prepend=0)
+    reached = event_rewards > 0
+    reaching_times = durations[reached]
+    score = float(event_rewards[reached].sum())  # Reward clipped to binary 0 | 1
+    if len(reaching_times) == 0:
+        return [score, float('nan'), float('nan')]
+    return [score, float(reaching_times.mean()), float(reaching_times.std())]
+
+
+def _step_buffers(shape):
+    # Per-step buffers for reward, step counter and done flag
+    return np.zeros(shape), np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=bool)
+
+
+def _grow_step_buffers(buffers):
+    # Doubles the capacity of the per-step buffers along the time axis; only needed if an env reports less than one
+    # time step per step
+    return tuple(np.concatenate([buffer, np.zeros_like(buffer)], axis=-1) for buffer in buffers)
+
+
+def print_throughput(num_steps, seconds):
+    """
+        Prints the number of simulated time steps and the resulting throughput.
+    :param num_steps: Number of env.step() calls times the number of copies stepped per call.
+    :param seconds: Wall time spent.
+    :return: -
+    """
+    print('Simulated ' + str(num_steps) + ' steps in ' + '{:.2f}'.format(seconds) + ' s (' +
+          ('{:.0f}'.format(num_steps / seconds) if seconds > 0 else 'n/a') + ' steps/s)')
+
+
+def run_test_runs(env, model, num_test_runs, iterations, episode_callback=None, episode_seeds=None):
+    """
+        Performs num_test_runs test runs of a given model one after another on a vectorized environment holding a
+        single copy of the test environment. Reward, step counter and done flag of each time step get written into
+        buffers allocated once for all test runs; each test run's statistics get computed from them once it is
+        complete (see test_run_statistics()).
+    :param env: Vectorized environment (SingleEnvVecEnv) holding a single test environment.
+    :param model: Trained model.
+    :param num_test_runs: Number of test runs to be performed.
+    :param iterations: Number of time steps per test run.
+    :param episode_callback: Optional function called with [score, mean time, std time] of each finished test run.
+    :param episode_seeds: Optional list of seeds; the env and the model get seeded with episode_seeds[i] before
+                          test run i.
+    :return: Lists test_scores, test_times_means, test_times_stds containing one entry per test run (see test_run()).
+    """
     test_scores = []        # Over 100 eval runs
     test_times_means = []   # Over 100 eval runs
     test_times_stds = []    # Over 100 eval runs
 
-    for _ in range(num_test_runs):
-        score_over_test_run = 0
-        time_steps_at_previous_event = time_step_counter = 0
-        reaching_times_over_test_run = []
+    rewards, time_step_counters, dones = _step_buffers(iterations)
+    total_steps = 0
+    start = time.perf_counter()
+
+    for run_idx in range(num_test_runs):
+        if episode_seeds is not None:
+            env.seed(episode_seeds[run_idx])
+            model.set_random_seed(episode_seeds[run_idx])
+        num_steps = time_step_counter = 0
         obs = env.reset()
 
         while time_step_counter < iterations:
@@ -278,31 +350,231 @@ def test_run(model_path, params_path):
             action, _ = model.predict(obs)
             obs, _, _, info = env.step(action)  # Assumption: eval conducted on single env only!
 
-            reward, time_step_counter, done = info[0][:]
-
-            #print(info)
-            #time.sleep(0.1)
+            reward, time_step_counter, done = info[0]
 
+            if num_steps == len(rewards):
+                rewards, time_step_counters, dones = _grow_step_buffers((rewards, time_step_counters, dones))
+            rewards[num_steps] = reward
+            time_step_counters[num_steps] = time_step_counter
+            dones[num_steps] = done
+            num_steps += 1
 
             if done:
-                #print('Accumulated rew.:' + str(score_over_test_run))
-                #print('Time: ' + str(time_steps))
+                obs = env.reset()
 
-                if reward > 0:
-                    # Gripper has reached goal position & orientation
-                    score_over_test_run += reward  # Reward clipped to binary 0 | 1
-                    time_steps_reaching = time_step_counter - time_steps_at_previous_event
-                    reaching_times_over_test_run.append(time_steps_reaching)
-                    #print('Time to goal: ' + str(time_steps_reaching))
-                time_steps_at_previous_event = time_step_counter
+        total_steps += num_steps
+        score, time_mean, time_std = test_run_statistics(rewards[:num_steps], time_step_counters[:num_steps],
+                                                         dones[:num_steps])
+        test_scores.append(score)           # Test score obtained per test run
+        test_times_means.append(time_mean)  # Average reaching time per test run
+        test_times_stds.append(time_std)    # Std's of reaching time per test run
+        if episode_callback is not None:
+            episode_callback([score, time_mean, time_std])
 
-                #print(score_over_test_run)
-                #print(reaching_times_over_test_run)
+    print_throughput(total_steps, time.perf_counter() - start)
+    return test_scores, test_times_means, test_times_stds
 
-                obs = env.reset()
-        test_scores.append(score_over_test_run)  # Test score obtained per test run
-        test_times_means.append(np.nanmean(np.array(reaching_times_over_test_run)))  # Average reaching time per test run
-        test_times_stds.append(np.nanstd(np.array(reaching_times_over_test_run)))  # Std's of reaching time per test run
+
+def run_batched_test_runs(env, model, num_test_runs, iterations, episode_callback=None, episode_seeds=None):
+    """
+        Performs num_test_runs test runs of a given model on a vectorized environment holding several copies of the
+        test environment, which get stepped together. Each copy performs one test run at a time; once a copy has
+        finished its test run, it starts the next one until num_test_runs test runs have been started in total.
+        Reward, step counter and done flag of each time step get written into per-copy rows of buffers allocated once
+        for all test runs (= env index), from which a test run's statistics get computed once it is complete (see
+        test_run_statistics()). Copies having no test run left to perform keep being stepped along with the others,
+        but their results get ignored.
+
+        Note: After an episode has ended, the vectorized env resets the respective copy by itself. The copy's step
+        counter gets re-set afterwards, as well as at the start of each new test run.
+    :param env: Vectorized environment (e.g. SubprocVecEnv) holding the copies of the test environment.
+    :param model: Trained model; model.predict() gets called on the stacked observations of all copies.
+    :param num_test_runs: Total number of test runs to be performed.
+    :param iterations: Number of time steps per test run.
+    :param episode_callback: Optional function called with [score, mean time, std time] of each finished test run.
+    :param episode_seeds: Optional list of seeds; the copy performing test run i gets seeded with episode_seeds[i]
+                          before starting it. The model is shared by all copies and hence not seeded per test run.
+    :return: Lists test_scores, test_times_means, test_times_stds containing one entry per test run (see test_run()).
+    """
+    num_envs = env.num_envs
+
+    test_scores = []        # Over all eval runs
+    test_times_means = []   # Over all eval runs
+    test_times_stds = []    # Over all eval runs
+
+    # Per env index: time steps recorded for the test run currently performed by the respective copy
+    rewards, time_step_counters, dones = _step_buffers((num_envs, iterations))
+    num_steps = np.zeros(num_envs, dtype=int)
+    active = np.arange(num_envs) < num_test_runs
+    runs_started = min(num_envs, num_test_runs)
+    total_steps = 0
+    start = time.perf_counter()
+
+    if episode_seeds is not None:
+        for i in range(runs_started):
+            env.env_method('seed', episode_seeds[i], indices=i)
+    obs = env.reset()
+    for i in range(num_envs):
+        env.env_method('set_step_counter', 0, indices=i)
+
+    while active.any():
+        action, _ = model.predict(obs)
+        obs, _, _, info = env.step(action)
+        total_steps += num_envs
+
+        copies = np.flatnonzero(active)
+        step = np.array([info[i] for i in copies], dtype=np.float64)  # Columns: reward, step counter, done
+        if num_steps[copies].max() == rewards.shape[1]:
+            rewards, time_step_counters, dones = _grow_step_buffers((rewards, time_step_counters, dones))
+        positions = num_steps[copies]
+        rewards[copies, positions] = step[:, 0]
+        time_step_counters[copies, positions] = step[:, 1]
+        dones[copies, positions] = step[:, 2] > 0
+        num_steps[copies] += 1
+
+        for i in copies[step[:, 2] > 0].tolist():
+            # Copy has been reset by the vectorized env; continue counting where the test run currently is
+            env.env_method('set_step_counter', int(time_step_counters[i, num_steps[i] - 1]), indices=i)
+
+        for i in copies[step[:, 1] >= iterations].tolist():
+            # Test run performed by copy i is complete
+            statistics = test_run_statistics(rewards[i, :num_steps[i]], time_step_counters[i, :num_steps[i]],
+                                             dones[i, :num_steps[i]])
+            test_scores.append(statistics[0])
+            test_times_means.append(statistics[1])
+            test_times_stds.append(statistics[2])
+            if episode_callback is not None:
+                episode_callback(statistics)
+
+            if runs_started < num_test_runs:
+                # Let copy i start the next test run
+                if episode_seeds is not None:
+                    env.env_method('seed', episode_seeds[runs_started], indices=i)
+                runs_started += 1
+                num_steps[i] = 0
+                obs[i] = env.env_method('reset', indices=i)[0]
+                env.env_method('set_step_counter', 0, indices=i)
+            else:
+                active[i] = False
+
+    print_throughput(total_steps, time.perf_counter() - start)
+    return test_scores, test_times_means, test_times_stds
+
+
+def test_run(model_path, params_path, num_envs=1, inference='tf', seed=None, cache=None, journal=None,
+             completed_episodes=None, stopping=None, profiler=None, env_class=None, model_pool=None):
+    """
+        Performs 100 test runs for a given trained model. See method evaluate_measurements_per_param_specification()
+        for thorough explanation. Alternatively, the number of test runs can be determined adaptively (see stopping).
+    :param model_path: Path to a trained model.
+    :param params_path: Path to the file summarizing the parameters used for training the model.
+    :param num_envs: Number of copies of the test environment to be stepped together. With num_envs == 1, the test
+                     runs are performed one after another on a single environment. Otherwise, each copy runs in its own
+                     subprocess and the test runs are distributed over the copies (see run_batched_test_runs()).
+    :param inference: 'tf' to load the model via PPO2.load(), or 'numpy' to compute the policy's forward pass in NumPy
+                      from the weights stored in the model's zip-archive (see numpy_policy.py).
+    :param seed: Seed for the test environment(s) and the policy's action sampling. Each test run gets seeded with a
+                 seed derived from seed, the model and the test run's index (see derive_episode_seed()), so that its
+                 outcome does not depend on the other test runs. Unseeded if None.
+    :param cache: EvaluationCache (see eval_cache.py) to look up the result in before simulating, and to store newly
+                  computed results in. No caching if None.
+    :param journal: EvaluationJournal (see eval_journal.py) each finished test run and the final result get recorded
+                    in. No journaling if None.
+    :param completed_episodes: List of [score, mean time, std time] of test runs already performed for this model by
+                               an interrupted evaluation (see EvaluationJournal.load()); only the remaining test runs
+                               get performed.
+    :param stopping: SequentialStoppingRule (see adaptive_stopping.py). If given, test runs get performed in batches
+                     until the rule is satisfied, i.e. until the mean score and mean reaching time are known precisely
+                     enough, instead of performing exactly 100 test runs.
+    :param profiler: EvaluationProfiler (see profiling.py) recording the time spent per phase of the evaluation loop,
+                     steps/sec and memory usage. Results taken from the cache do not get profiled. No profiling if None.
+    :param env_class: Class of the test environment, instantiated with the same arguments as PandaRobotEnv (e.g. the
+                      stub environment of benchmark.py). PandaRobotEnv if None.
+    :param model_pool: ModelPool the model gets loaded from (see load_test_model()).
+    :return: Tuple (mean score, mean time steps, mean std of time steps, number of test runs performed)
+    """
+
+    # Run simulation 100 times for a single model (at most stopping.max_test_runs times if stopping adaptively)
+
+    num_test_runs = NUM_TEST_RUNS if stopping is None else stopping.max_test_runs
+    iterations = ITERATIONS
+
+    print('Running ' + str(num_test_runs) + ' tests on model: ' + model_path)
+    print('Using params: ' + params_path)
+
+    # Load params
+    params = load_model_params(params_path)
+
+    if cache is not None:
+        cache_key = cache.make_key(model_path, params, num_test_runs, iterations, seed=seed, inference=inference,
+                                   stopping=None if stopping is None else stopping.to_dict())
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            print('Using cached result for model: ' + model_path)
+            if journal is not None:
+                # Test runs stored along with the result (if any), so that the journal lists them for bootstrapping
+                for statistics in cache.get_episodes(cache_key) or []:
+                    journal.record_episode(model_path, statistics)
+                journal.record_model(model_path, cached_result)
+            return tuple(cached_result)
+
+    completed_episodes = (completed_episodes or [])[:num_test_runs]
+    episode_callback = None
+    if journal is not None:
+        episode_callback = lambda statistics: journal.record_episode(model_path, statistics)
+
+    #params['render'] = True
+
+    # Creating test env
+    env = make_test_env(params, num_envs=num_envs, env_class=env_class)
+
+    # Load model
+    def load_model():
+        return load_test_model(model_path, params, inference=inference, model_pool=model_pool)
+
+    if profiler is None:
+        model = load_model()
+    else:
+        profiler.start_model(model_path)
+        model = profiler.load_model(load_model)
+        env, model = profiler.wrap_env(env), profiler.wrap_model(model)
+
+    if seed is not None:
+        env.seed(seed)  # Copy i of a SubprocVecEnv gets seeded with seed + i
+        model.set_random_seed(seed)
+
+    # Test runs completed by an interrupted evaluation (if any)
+    if completed_episodes:
+        print('Resuming from ' + str(len(completed_episodes)) + ' previously completed test runs.')
+    test_scores = [episode[0] for episode in completed_episodes]
+    test_times_means = [episode[1] for episode in completed_episodes]
+    test_times_stds = [episode[2] for episode in completed_episodes]
+
+    # Run simulation; all remaining test runs at once, or batch-wise until the stopping rule is satisfied
+    while len(test_scores) < num_test_runs:
+        if stopping is None:
+            batch_size = num_test_runs - len(test_scores)
+        elif stopping.is_satisfied(test_scores, test_times_means):
+            break
+        else:
+            batch_size = stopping.next_batch_size(len(test_scores))
+
+        episode_seeds = None
+        if seed is not None:
+            episode_seeds = [derive_episode_seed(seed, model_path, episode)
+                             for episode in range(len(test_scores), len(test_scores) + batch_size)]
+
+        if num_envs > 1:
+            batch = run_batched_test_runs(env, model, batch_size, iterations, episode_callback, episode_seeds)
+        else:
+            batch = run_test_runs(env, model, batch_size, iterations, episode_callback, episode_seeds)
+        test_scores.extend(batch[0])
+        test_times_means.extend(batch[1])
+        test_times_stds.extend(batch[2])
+
+    env.close()
+    if profiler is not None:
+        profiler.finish_model(len(test_scores))
 
     # Return mean test score for model
     print('Scores:')
@@ -310,14 +582,31 @@ def test_run(model_path, params_path):
     print('Times:')
     print(test_times_means)
 
-    # Return:
-    # mean test score over number of test runs for a single model,
-    # mean over 100*[mean time per test run],
-    # mean over 100*[std of mean time per test run]
-    return np.nanmean(np.array(test_scores)), np.nanmean(np.array(test_times_means)), np.nanmean(np.array(test_times_stds))
+    result = summarize_test_runs(test_scores, test_times_means, test_times_stds)
+    if cache is not None:
+        cache.put(cache_key, [float(statistic) for statistic in result[:3]] + [result[3]], model_path=model_path,
+                  episodes=list(zip(test_scores, test_times_means, test_times_stds)))
+    if journal is not None:
+        journal.record_model(model_path, result)
+    return result
+
+
+def evaluate_model(job):
+    """
+        Wrapper around test_run() taking a single argument, so that it can be mapped over a pool of worker processes.
+        Each call creates its own PandaRobotEnv and PPO2 instance inside the process executing it (PPO2 instances get
+        re-used across calls within the same process if a model_pool is passed on in test_run_kwargs).
+    :param job: Tuple (model_path, params_path, test_run_kwargs) of the model to be evaluated, where test_run_kwargs is
+                a dict of further keyword arguments to be passed on to test_run().
+    :return: Tuple (avg score, avg time steps, avg std of time steps, number of test runs) as returned by test_run().
+    """
+    model_path, params_path, test_run_kwargs = job
+    return test_run(model_path=model_path, params_path=params_path, **test_run_kwargs)
 
 
-def evaluate_measurements_per_param_specification(path, params):
+def evaluate_measurements_per_param_specification(path, params, num_workers=1, num_envs=1, inference='tf', seed=None,
+                                                  cache=None, journal=None, resume=False, stopping=None,
+                                                  profiler=None, env_class=None, model_pool=None):
     """
         Iterates through all parameter settings used during training of models and all the models trained per parameter
         setting. Parameter settings are referred to by their parameter-setting/specification-id (=ID).
@@ -361,36 +650,116 @@ def evaluate_measurements_per_param_specification(path, params):
     :param path: Path to folder containing the folders in which trained models are located.
     :param params: Dictionary: key = parameter-specification-id (=file-name of parameter-setting-file used for training)
                                val = list of models' folders trained using parameter-id specified as corresponding key
-
-    :return: See above.
+    :param num_workers: Number of worker processes the models get evaluated on. With num_workers == 1, all models are
+                        evaluated one after another in the current process. Otherwise, the models are distributed over
+                        a pool of worker processes. Results are consumed in the order in which the models are listed in
+                        params, so the statistics of a parameter setting get computed as soon as all of its models are
+                        done, and the returned statistics are identical to those of a serial run.
+    :param num_envs: Number of copies of the test environment each model gets evaluated on in parallel (see test_run()).
+                     Since pool workers may not start subprocesses themselves, num_envs > 1 requires num_workers == 1.
+    :param inference: Whether to run the models' policies via TensorFlow ('tf') or NumPy ('numpy') (see test_run()).
+    :param seed: Seed used for evaluating each model (see test_run()).
+    :param cache: EvaluationCache results get looked up in and stored to (see test_run()).
+    :param journal: EvaluationJournal finished test runs and models get recorded in (see test_run()).
+    :param resume: If True, the state of an interrupted evaluation gets rebuilt from the journal: models completed
+                   before are not evaluated again, and models evaluated partially only perform their remaining test
+                   runs. The journal must stem from an evaluation using the same settings. If False, the journal gets
+                   cleared.
+    :param stopping: SequentialStoppingRule determining the number of test runs per model adaptively (see test_run()).
+                     If None, 100 test runs are performed per model.
+    :param profiler: EvaluationProfiler the evaluation of each model gets profiled with (see test_run()).
+    :param env_class: Class of the test environment (see test_run()).
+    :param model_pool: ModelPool the models get loaded from (see test_run()). Each worker process uses its own pool.
+
+    :return: See above. Additionally, the total number of test runs performed per ID is returned in dictionary
+             test_runs_per_param_setting.
     """
     print('Params used and associated test runs:')
+    print(params)
+    print()
+
+    completed_models, completed_episodes = dict(), dict()
+    if journal is not None:
+        settings = {'inference': inference, 'seed': seed,
+                    'stopping': None if stopping is None else stopping.to_dict()}
+        if resume:
+            journal_settings, completed_models, completed_episodes = journal.load()
+            if journal_settings is not None and journal_settings != settings:
+                raise ValueError('Cannot resume: journal was recorded using different settings: ' +
+                                 str(journal_settings))
+            print('Resuming: ' + str(len(completed_models)) + ' models completed, ' + str(len(completed_episodes)) +
+                  ' models partially evaluated.')
+        else:
+            journal.clear()
+        journal.record_start(settings)
+
+    # List of all models to be evaluated, in the order in which their results get aggregated below
+    jobs = []
+    for model_folder_lst in params.values():
+        for model_folder in model_folder_lst:
+            model_path = path + model_folder + '/final_model.zip'
+            jobs.append((model_path, path + model_folder + '/params.json',
+                         {'num_envs': num_envs, 'inference': inference, 'seed': seed, 'cache': cache,
+                          'journal': journal, 'completed_episodes': completed_episodes.get(model_path),
+                          'stopping': stopping, 'profiler': profiler, 'env_class': env_class,
+                          'model_pool': model_pool}))
+    to_do = [job for job in jobs if job[0] not in completed_models]
+
+    pool = None
+    if num_workers > 1:
+        # Spawn fresh interpreters instead of forking, so that no TF state is shared between workers
+        pool = multiprocessing.get_context('spawn').Pool(processes=num_workers)
+        new_results = pool.imap(evaluate_model, to_do)     # Yields results in order of to_do
+    else:
+        new_results = map(evaluate_model, to_do)           # Lazy: models get evaluated one by one while iterating
+    # Results in order of jobs; taken from the journal for models completed before
+    results = (completed_models[job[0]] if job[0] in completed_models else next(new_results) for job in jobs)
+
+    statistics = aggregate_per_param_specification(params, results)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return statistics
+
+
+def aggregate_per_param_specification(params, results):
+    """
+        Averages the results of the models per parameter setting (see evaluate_measurements_per_param_specification()).
+    :param params: Dictionary: key = parameter-specification-id, val = list of models' folders
+    :param results: Iterator yielding the result of test_run() for each model, in the order in which the models are
+                    listed in params.
+    :return: Dictionaries eval_scores_per_param_setting, mean_time_per_param_setting, std_time_per_param_setting,
+             test_runs_per_param_setting (see evaluate_measurements_per_param_specification())
+    """
     eval_scores_per_param_setting = dict()
     mean_time_per_param_setting = dict()
     std_time_per_param_setting = dict()
-    print(params)
-    print()
+    test_runs_per_param_setting = dict()
+    results = iter(results)
+
     # Iterate through all parameter settings on which models were trained
     for param_specification_id, model_folder_lst in params.items():
         print(param_specification_id)
         avg_score_per_model = []
         avg_time_per_model = []
         std_time_per_model = []
+        test_runs_per_model = []
         # Iterate through all models trained on a single parameter setting
         for model_folder in model_folder_lst:
-            model_path = path + model_folder + '/final_model.zip'
-            params_path = path + model_folder + '/params.json'
             print('Going to evaluate:' + model_folder)
             # Evaluate each model 100 times and take the average score obtained per test run,
             #                                        the average time needed to get to the goal per test run, and
             #                                        the standard deviation of average time needed to get to the goal
             #                                         per test run.
             #                                         All measures averaged oder the 100 test runs per model:
-            model_avg_score, avg_time_steps, avg_std_time_steps = test_run(model_path=model_path, params_path=params_path)  # Run 100 test runs per model
+            model_avg_score, avg_time_steps, avg_std_time_steps, num_test_runs = next(results)  # Run 100 test runs per model
             # Collect measurements for all models trained on given parameter setting
             avg_score_per_model.append(model_avg_score)
             avg_time_per_model.append(avg_time_steps)
             std_time_per_model.append(avg_std_time_steps)
+            test_runs_per_model.append(num_test_runs)
 
             print('Avg Score: ' + str(model_avg_score))
             print('Avg time:' + str(avg_time_steps))
@@ -402,6 +771,7 @@ def evaluate_measurements_per_param_specification(path, params):
         eval_scores_per_param_setting[param_specification_id] = np.nanmean(np.array(avg_score_per_model))
         mean_time_per_param_setting[param_specification_id] = np.nanmean(np.array(avg_time_per_model))
         std_time_per_param_setting[param_specification_id] = np.nanmean(np.array(std_time_per_model))
+        test_runs_per_param_setting[param_specification_id] = int(np.sum(test_runs_per_model))
         print()
 
     print('Param-specification-Avg-scores:')
@@ -410,42 +780,367 @@ def evaluate_measurements_per_param_specification(path, params):
     print(mean_time_per_param_setting)
     print('Param-specification-Avg-time-avg-std:')
     print(std_time_per_param_setting)
+    print('Param-specification-test-runs:')
+    print(test_runs_per_param_setting)
     print()
 
-    return eval_scores_per_param_setting, mean_time_per_param_setting, std_time_per_param_setting
+    return eval_scores_per_param_setting, mean_time_per_param_setting, std_time_per_param_setting, \
+        test_runs_per_param_setting
+
+
 
+def run_work_unit(model_path, params_path, first_episode, num_episodes, seed, inference='tf', env_class=None,
+                  model_pool=None):
+    """
+        Performs a block of consecutive test runs of a model, each seeded as it would be seeded by test_run().
+    :param model_path: Path to a trained model.
+    :param params_path: Path to the file summarizing the parameters used for training the model.
+    :param first_episode: Index of the first test run to be performed.
+    :param num_episodes: Number of test runs to be performed.
+    :param seed: Seed of the evaluation (see derive_episode_seed()).
+    :param inference: Whether to run the model's policy via TensorFlow ('tf') or NumPy ('numpy') (see test_run()).
+    :param env_class: Class of the test environment (see test_run()).
+    :param model_pool: ModelPool the model gets loaded from (see load_test_model()).
+    :return: List of [score, mean time steps, std of time steps] per test run
+    """
+    print('Running tests ' + str(first_episode) + ' to ' + str(first_episode + num_episodes - 1) + ' on model: ' +
+          model_path)
+    params = load_model_params(params_path)
+    env = make_test_env(params, env_class=env_class)
+    model = load_test_model(model_path, params, inference=inference, model_pool=model_pool)
+    episode_seeds = [derive_episode_seed(seed, model_path, episode)
+                     for episode in range(first_episode, first_episode + num_episodes)]
+    test_scores, test_times_means, test_times_stds = run_test_runs(env, model, num_episodes, ITERATIONS,
+                                                                   episode_seeds=episode_seeds)
+    env.close()
+    return [list(episode) for episode in zip(test_scores, test_times_means, test_times_stds)]
+
+
+def evaluate_shard(path, used_dict, not_used_lists, shard, num_shards, seed, inference='tf', block_size=10,
+                   resume=False, env_class=None, directory=PATH_WRITE + 'Shards', model_pool=None):
+    """
+        Performs the work units assigned to a single shard of the evaluation (see sharding.py) and records their
+        statistics in the shard's partial result file. Once all shards are done, merge_shards() computes the
+        statistics per parameter setting.
+    :param path: Path to folder containing the folders in which trained models are located.
+    :param used_dict: Dictionary: key = parameter-specification-id, val = list of models' folders to be evaluated
+    :param not_used_lists: Lists of folders excluded from evaluation (see save_which_data_was_used()).
+    :param shard: Index i of the shard.
+    :param num_shards: Number N of shards.
+    :param seed: Seed of the evaluation.
+    :param inference: Whether to run the models' policies via TensorFlow ('tf') or NumPy ('numpy') (see test_run()).
+    :param block_size: Number of test runs per work unit.
+    :param resume: Whether to skip work units recorded by an interrupted run of the same shard.
+    :param env_class: Class of the test environment (see test_run()).
+    :param directory: Folder holding the partial result files.
+    :param model_pool: ModelPool the models get loaded from (see load_test_model()).
+    :return: -
+    """
+    settings = {'seed': seed, 'inference': inference, 'num_test_runs': NUM_TEST_RUNS, 'block_size': block_size,
+                'used_dict': used_dict, 'not_used_lists': not_used_lists}
+    shard_file = ShardFile(directory, shard, num_shards)
+    completed_units = shard_file.start(settings, resume=resume)
 
-candidate_dirs, list_outtakes_failure = get_complete_trials(PATH_READ)
-# list_outtakes_failure == incomplete data sets
+    work_units = assign_work_units(list_work_units(used_dict, NUM_TEST_RUNS, block_size), shard, num_shards)
+    to_do = [unit for unit in work_units if (unit[0], unit[1]) not in completed_units]
+    print('Shard ' + str(shard) + '/' + str(num_shards) + ': ' + str(len(to_do)) + ' work units to be performed ' +
+          '(already performed: ' + str(len(work_units) - len(to_do)) + ')')
 
-used_dict, filtered_out = remove_redundant_runs(PATH_READ, candidate_dirs)
-# filtered_out == directories rejected due to max number of directories to include exceeded
+    for count, (model_folder, first_episode, num_episodes) in enumerate(to_do, 1):
+        statistics = run_work_unit(path + model_folder + '/final_model.zip', path + model_folder + '/params.json',
+                                   first_episode, num_episodes, seed, inference=inference, env_class=env_class,
+                                   model_pool=model_pool)
+        shard_file.record_unit((model_folder, first_episode, num_episodes), statistics)
+        print('Finished work unit (' + str(count) + '/' + str(len(to_do)) + ')')
 
-# used_dict == key : parameter-specification-id ; value : list of directories (including data of a single test run)
-#                                                         associated with a given parameter specification given by key
 
-not_used_lists = [list_outtakes_failure, filtered_out]
+def merge_shards(directory=PATH_WRITE + 'Shards'):
+    """
+        Combines the partial result files of all shards into the statistics per parameter setting. The statistics are
+        identical to those computed by evaluate_measurements_per_param_specification() using the same seed (and
+        num_envs == 1), no matter how many shards were used.
+    :param directory: Folder holding the partial result files.
+    :return:    used_dict: Grouping of the evaluated models the shards were run with
+                not_used_lists: Lists of folders excluded from evaluation
+                statistics: Tuple of dictionaries as returned by evaluate_measurements_per_param_specification()
+                episodes: Dictionary: key = model's folder, val = list of [score, mean time steps, std of time steps]
+                          per test run (see bootstrap_statistics())
+    """
+    settings, episodes = load_shards(directory)
+    used_dict = settings['used_dict']
+    results = (summarize_test_runs(*zip(*episodes[model_folder]))
+               for model_folders in used_dict.values() for model_folder in model_folders)
+    return used_dict, settings['not_used_lists'], aggregate_per_param_specification(used_dict, results), episodes
 
-eval_scores_per_param_setting, mean_time_per_param_setting, std_time_per_param_setting = \
-    evaluate_measurements_per_param_specification(PATH_READ, used_dict)
 
-# Save to file which data was included in final analysis and which wasn't
-save_which_data_was_used(PATH_WRITE+"EvaluatedData", used_dict, not_used_lists)
+def save_statistics(direct, statistics, test_runs=None):
+    """
+        Saves the statistics per parameter setting, both as csv files and as typed binary files (see typed_output.py).
+    :param direct: Folder where to store the emission files.
+    :param statistics: Tuple of dictionaries as returned by evaluate_measurements_per_param_specification().
+    :param test_runs: Optional dictionary containing the number of test runs per parameter setting; saved next to
+                      the statistics if given.
+    :return: -
+    """
+    eval_scores_per_param_setting, mean_time_per_param_setting, std_time_per_param_setting, _ = statistics
+
+    save_dict_to_file(direct=direct, name='param_average_scores', data_dict=eval_scores_per_param_setting,
+                      data_dict_test_runs=test_runs)
+    save_dict_to_file(direct=direct, name='param_average_time', data_dict=mean_time_per_param_setting,
+                      data_dict_test_runs=test_runs)
+    save_dict_to_file(direct=direct, name='param_average_std_time', data_dict=std_time_per_param_setting,
+                      data_dict_test_runs=test_runs)
+    save_mean_and_std_time_to_file(direct=direct,
+                                   name='param_average_time_and_avg_std',
+                                   data_dict_mean=mean_time_per_param_setting,
+                                   data_dict_std=std_time_per_param_setting,
+                                   data_dict_test_runs=test_runs)
+
+    # Typed copies; rows named by parameter-specification-id, as are the rows of the csv files
+    param_ids = list(eval_scores_per_param_setting.keys())
+    extra_columns, extra_data = [], []
+    if test_runs is not None:
+        extra_columns, extra_data = ['Test runs used'], [[test_runs[key] for key in param_ids]]
+    metadata = {'source': 'final_evaluation', 'num_test_runs': NUM_TEST_RUNS if test_runs is None else 'adaptive'}
+    for name, columns, data_dicts in [
+            ('param_average_scores', ['Mean score'], [eval_scores_per_param_setting]),
+            ('param_average_time', ['Mean grasping time steps'], [mean_time_per_param_setting]),
+            ('param_average_std_time', ['Mean std of mean grasping time steps'], [std_time_per_param_setting]),
+            ('param_average_time_and_avg_std', ['Mean grasping time steps', 'Mean std of mean grasping time steps'],
+             [mean_time_per_param_setting, std_time_per_param_setting])]:
+        data = [[data_dict[key] for key in param_ids] for data_dict in data_dicts] + extra_data
+        save_table(direct, name, columns + extra_columns, np.array(data, dtype=np.float64).transpose(),
+                   row_ids=param_ids, metadata=metadata)
+
+
+def collect_episodes(path, params, journal):
+    """
+        Collects the statistics of the test runs of all evaluated models from the journal of an evaluation.
+    :param path: Path to folder containing the folders in which trained models are located.
+    :param params: Dictionary: key = parameter-specification-id, val = list of models' folders
+    :param journal: EvaluationJournal the evaluation got recorded in.
+    :return: Dictionary: key = model's folder, val = list of [score, mean time steps, std of time steps] per test run.
+             A model whose test runs are not known (its result was taken from a cache entry written before test runs
+             got stored along with the results) is represented by its result as single test run. Models not recorded
+             in the journal at all are left out.
+    """
+    _, completed_models, _ = journal.load()
+    journal_episodes = journal.load_episodes()
+    episodes = dict()
+    for model_folder_lst in params.values():
+        for model_folder in model_folder_lst:
+            model_path = path + model_folder + '/final_model.zip'
+            if journal_episodes.get(model_path):
+                episodes[model_folder] = journal_episodes[model_path]
+            elif completed_models.get(model_path) is not None:
+                episodes[model_folder] = [list(completed_models[model_path][:3])]
+    return episodes
 
-save_dict_to_file(direct=PATH_WRITE+'Statistics', name='param_average_scores', data_dict=eval_scores_per_param_setting)
-save_dict_to_file(direct=PATH_WRITE+'Statistics', name='param_average_time', data_dict=mean_time_per_param_setting)
-save_dict_to_file(direct=PATH_WRITE+'Statistics', name='param_average_std_time', data_dict=std_time_per_param_setting)
-save_mean_and_std_time_to_file(direct=PATH_WRITE+'Statistics',
-                               name='param_average_time_and_avg_std',
-                               data_dict_mean=mean_time_per_param_setting,
-                               data_dict_std=std_time_per_param_setting)
 
+def bootstrap_statistics(params, episodes, num_resamples=DEFAULT_NUM_RESAMPLES, confidence=0.95, seed=0):
+    """
+        Bootstrap confidence intervals of the statistics per parameter setting (see
+        evaluate_measurements_per_param_specification()). Each resample draws the models of a parameter setting with
+        replacement and, for each drawn model, its test runs with replacement (see bootstrap.py).
+    :param params: Dictionary: key = parameter-specification-id, val = list of models' folders
+    :param episodes: Dictionary: key = model's folder, val = list of [score, mean time steps, std of time steps] per
+                     test run (see collect_episodes()). Models missing here are left out.
+    :param num_resamples: Number of resamples.
+    :param confidence: Confidence level.
+    :param seed: Seed making the resamples reproducible.
+    :return: Tuple (lower, upper) of dictionaries: key = parameter-specification-id, val = list of the bounds of the
+             mean score, the mean grasping time steps and the mean std of grasping time steps
+    """
+    evaluated = [[model_folder for model_folder in model_folder_lst if model_folder in episodes]
+                 for model_folder_lst in params.values()]
+    run_counts = np.array([len(model_folder_lst) for model_folder_lst in evaluated], dtype=int)
+    max_episodes = max([len(episodes[model_folder]) for model_folder_lst in evaluated
+                        for model_folder in model_folder_lst] or [0])
+    tensor = np.full((len(params), max(run_counts, default=0), max_episodes, 3), np.nan)
+    episode_counts = np.zeros(tensor.shape[:2], dtype=int)
+    for setting_idx, model_folder_lst in enumerate(evaluated):
+        for run_idx, model_folder in enumerate(model_folder_lst):
+            model_episodes = np.array(episodes[model_folder], dtype=np.float64).reshape((-1, 3))
+            tensor[setting_idx, run_idx, :len(model_episodes)] = model_episodes
+            episode_counts[setting_idx, run_idx] = len(model_episodes)
+
+    lower, upper = bootstrap_hierarchical_means(tensor, run_counts, episode_counts, num_resamples=num_resamples,
+                                                confidence=confidence, seed=seed)
+    return dict(zip(params.keys(), lower.tolist())), dict(zip(params.keys(), upper.tolist()))
+
+
+def save_confidence_intervals(direct, statistics, intervals, num_resamples, confidence):
+    """
+        Saves the statistics per parameter setting next to the bounds of their confidence intervals, both as csv file
+        and as typed binary file (param_confidence_intervals).
+    :param direct: Folder where to store the emission files.
+    :param statistics: Tuple of dictionaries as returned by evaluate_measurements_per_param_specification().
+    :param intervals: Tuple (lower, upper) as returned by bootstrap_statistics().
+    :param num_resamples: Number of resamples the intervals are based on.
+    :param confidence: Confidence level of the intervals.
+    :return: -
+    """
+    lower, upper = intervals
+    columns = []
+    for name in ['Mean score', 'Mean grasping time steps', 'Mean std of mean grasping time steps']:
+        columns += [name, name + ' lower', name + ' upper']
+    param_ids = list(statistics[0].keys())
+    data = [[value for idx, data_dict in enumerate(statistics[:3])
+             for value in (data_dict[key], lower[key][idx], upper[key][idx])] for key in param_ids]
 
-print('Complete and sufficient runs:')
-print(candidate_dirs)
-print('Outtakes:')
-print(not_used_lists)
-print()
-print('Used parameter id\'s and the test runs that used them:')
-print(used_dict)
+    create_dir(direct)
+    with open(direct + '/param_confidence_intervals.csv', 'w') as f:
+        w = csv.writer(f, dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
+        w.writerow(['Parameter-specification-id'] + columns)
+        for key, row in zip(param_ids, data):
+            w.writerow([clean_parameter_specification_id_string(key)] + row)
+    save_table(direct, 'param_confidence_intervals', columns, np.array(data, dtype=np.float64), row_ids=param_ids,
+               metadata={'source': 'final_evaluation', 'bootstrap_resamples': num_resamples,
+                         'confidence': confidence})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Final evaluation of all completely trained models.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes to evaluate models on in parallel (default: 1, i.e. serial).')
+    parser.add_argument('--envs', type=int, default=1,
+                        help='Number of env copies per model, each stepped in its own subprocess (default: 1).')
+    parser.add_argument('--inference', choices=['tf', 'numpy'], default='tf',
+                        help='Run the policies via PPO2 (tf) or via the TF-free NumPy implementation (numpy).')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for evaluating each model (default: unseeded).')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Re-evaluate all models instead of re-using results cached by previous runs.')
+    parser.add_argument('--cache-size', type=int, default=1000,
+                        help='Max. number of results kept in the cache (default: 1000).')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume an interrupted evaluation from its journal, skipping completed work.')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Determine the number of test runs per model adaptively (see adaptive_stopping.py).')
+    parser.add_argument('--min-test-runs', type=int, default=20, help='Adaptive: min. test runs per model.')
+    parser.add_argument('--max-test-runs', type=int, default=100, help='Adaptive: max. test runs per model.')
+    parser.add_argument('--batch-size', type=int, default=10, help='Adaptive: test runs between two checks.')
+    parser.add_argument('--score-tolerance', type=float, default=0.25,
+                        help='Adaptive: max. half-width of the confidence interval of the mean score.')
+    parser.add_argument('--time-tolerance', type=float, default=10.,
+                        help='Adaptive: max. half-width of the confidence interval of the mean reaching time.')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='Confidence level of the adaptive stopping rule and of the bootstrap confidence intervals '
+                             '(default: 0.95).')
+    parser.add_argument('--bootstrap', type=int, default=DEFAULT_NUM_RESAMPLES,
+                        help='Number of bootstrap resamples (of the models per parameter setting and their test runs) '
+                             'for the confidence intervals saved to Statistics/param_confidence_intervals.csv; 0 to '
+                             'skip them (default: ' + str(DEFAULT_NUM_RESAMPLES) + ').')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record per-phase timings, steps/sec and memory usage per model and worker to '
+                             'FinalEvaluation/Profiling/profile_report.json (see profiling.py).')
+    add_grouping_arguments(parser)
+    parser.add_argument('--model-pool', type=int, default=4,
+                        help='TF inference: max. number of TF graphs/sessions kept alive per process, each re-used for '
+                             'all models of the same architecture (see model_pool.py). 0: new graph per model '
+                             '(default: 4).')
+    parser.add_argument('--shard', default=None,
+                        help='Only perform shard i out of N (format: i/N) and record its partial results in '
+                             'FinalEvaluation/Shards/ (see sharding.py). Requires --seed.')
+    parser.add_argument('--shard-block-size', type=int, default=10,
+                        help='Shards: number of consecutive test runs of a model per work unit (default: 10).')
+    parser.add_argument('--merge-shards', action='store_true',
+                        help='Compute the statistics from the partial results of all shards.')
+    args = parser.parse_args()
+    if args.workers > 1 and args.envs > 1:
+        parser.error('--workers and --envs cannot both be larger than 1.')
+    if args.shard is not None:
+        if args.seed is None:
+            parser.error('--shard requires --seed.')
+        if args.workers > 1 or args.envs > 1 or args.adaptive:
+            parser.error('--shard cannot be combined with --workers, --envs or --adaptive.')
+        try:
+            shard, num_shards = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    stopping = None
+    if args.adaptive:
+        try:
+            stopping = SequentialStoppingRule(min_test_runs=args.min_test_runs, max_test_runs=args.max_test_runs,
+                                              batch_size=args.batch_size, score_tolerance=args.score_tolerance,
+                                              time_tolerance=args.time_tolerance, confidence=args.confidence)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.merge_shards:
+        used_dict, not_used_lists, statistics, episodes = merge_shards(PATH_WRITE + 'Shards')
+        save_which_data_was_used(PATH_WRITE+"EvaluatedData", used_dict, not_used_lists)
+        save_statistics(PATH_WRITE+'Statistics', statistics)
+        if args.bootstrap > 0:
+            save_confidence_intervals(PATH_WRITE+'Statistics', statistics,
+                                      bootstrap_statistics(used_dict, episodes, num_resamples=args.bootstrap,
+                                                           confidence=args.confidence),
+                                      args.bootstrap, args.confidence)
+        print('Merged shards.')
+        sys.exit(0)
+
+    cache = None if args.no_cache else EvaluationCache(PATH_WRITE + 'Cache', max_entries=args.cache_size)
+
+    model_pool = process_model_pool(args.model_pool) if args.inference == 'tf' and args.model_pool > 0 else None
+
+    profiler = None
+    if args.profile:
+        profiler = EvaluationProfiler(PATH_WRITE + 'Profiling')
+        profiler.clear()
+
+    catalog = RunCatalog(PATH_READ)
+
+    candidate_dirs, list_outtakes_failure = catalog.get_complete_trials()
+    # list_outtakes_failure == incomplete data sets
+
+    used_dict, filtered_out = group_runs_from_arguments(catalog, candidate_dirs, args)
+    # filtered_out == directories rejected due to max number of directories to include exceeded
+
+    # used_dict == key : parameter-specification-id ; value : list of directories (including data of a single test run)
+    #                                                         associated with a given parameter specification given by key
+
+    not_used_lists = [list_outtakes_failure, filtered_out]
+
+    if args.shard is not None:
+        evaluate_shard(PATH_READ, used_dict, not_used_lists, shard, num_shards, args.seed, inference=args.inference,
+                       block_size=args.shard_block_size, resume=args.resume, directory=PATH_WRITE + 'Shards',
+                       model_pool=model_pool)
+        print('Shard ' + args.shard + ' done.')
+        sys.exit(0)
+
+    journal = EvaluationJournal(PATH_WRITE + 'Journal')
+    eval_scores_per_param_setting, mean_time_per_param_setting, std_time_per_param_setting, \
+        test_runs_per_param_setting = \
+        evaluate_measurements_per_param_specification(PATH_READ, used_dict, num_workers=args.workers,
+                                                      num_envs=args.envs, inference=args.inference, seed=args.seed,
+                                                      cache=cache, journal=journal,
+                                                      resume=args.resume, stopping=stopping, profiler=profiler,
+                                                      model_pool=model_pool)
+
+    # Number of test runs only reported next to the statistics if it was determined adaptively
+    test_runs = test_runs_per_param_setting if args.adaptive else None
+
+    # Save to file which data was included in final analysis and which wasn't
+    save_which_data_was_used(PATH_WRITE+"EvaluatedData", used_dict, not_used_lists)
+
+    statistics = (eval_scores_per_param_setting, mean_time_per_param_setting, std_time_per_param_setting,
+                  test_runs_per_param_setting)
+    save_statistics(PATH_WRITE+'Statistics', statistics, test_runs=test_runs)
+    if args.bootstrap > 0:
+        save_confidence_intervals(PATH_WRITE+'Statistics', statistics,
+                                  bootstrap_statistics(used_dict, collect_episodes(PATH_READ, used_dict, journal),
+                                                       num_resamples=args.bootstrap, confidence=args.confidence),
+                                  args.bootstrap, args.confidence)
+
+    if profiler is not None:
+        print('Profiling report: ' + profiler.write_report())
+    if model_pool is not None:
+        print('Model pool (main process): ' + str(model_pool.to_dict()))
+
+    print('Complete and sufficient runs:')
+    print(candidate_dirs)
+    print('Outtakes:')
+    print(not_used_lists)
+    print()
+    print('Used parameter id\'s and the test runs that used them:')
+    print(used_dict)
 
@@ -0,0 +1,212 @@
+import time
+import argparse
+import warnings
+from collections import OrderedDict
+import numpy as np
+
+from training_log import TRAINING_LOG_COLUMNS
+from training_aggregation import load_training_tensor, UPDATE_NR, GRASPS, AVG_GRASP_TIME, STD_GRASP_TIME
+from run_catalog import RunCatalog, add_grouping_arguments, group_runs_from_arguments
+from training_analysis import save_data_package_to_file, PATH_READ, PATH_WRITE
+from typed_output import save_table
+
+'''
+    Sample-efficiency metrics of the learning curves recorded in the runs' training logs (training_eval.csv).
+    All metrics get computed for all runs at once, as reductions over the tensor of shape
+    (parameter setting, run, logged period, column) holding all logs (see training_aggregation.py). Per run:
+        - Total_time_steps, Total_grasps: time steps trained and grasps performed in total,
+        - Time_steps_to_<K>_grasps: time steps trained until the mean number of grasps per logged period over a window
+          of logged periods first reaches K (NaN if it never does),
+        - Normalized_AUC: area under the curve of grasps per logged period over the time steps, divided by the time
+          steps spanned and the max. number of grasps per logged period observed in any run (i.e. within [0, 1]),
+        - Plateau_level, Plateau_onset_time_steps: mean number of grasps per logged period over the last window, and
+          the time steps trained until the windowed mean last rose to (1 - tolerance) of that level, staying there,
+        - Best_window_grasps, Best_window_time_steps: max. windowed mean number of grasps and where its window ends,
+        - Final_<column>, Best_window_avg_grasp_time_steps: windowed means of the grasp-time columns over the last
+          window, and the min. windowed mean grasp time,
+        - Min_grasp_time_steps, Max_grasp_time_steps: fastest and slowest grasp recorded during training.
+    Windowed means only use complete windows; periods without grasps (NaN grasp times) are ignored.
+'''
+
+MAX_GRASP_TIME = TRAINING_LOG_COLUMNS.index('Max_grasp_time_steps')
+MIN_GRASP_TIME = TRAINING_LOG_COLUMNS.index('Min_grasp_time_steps')
+TOTAL_TIME_STEPS = TRAINING_LOG_COLUMNS.index('Total_time_steps')
+
+DEFAULT_THRESHOLDS = [5, 10, 15]
+
+
+def windowed_means(values, logged, window):
+    """
+        Mean over each trailing window of logged periods, ignoring NaN values.
+    :param values: Numpy array of shape (..., logged periods).
+    :param logged: Numpy array (bool) shaped like values; whether the respective period has been logged at all.
+    :param window: Number of logged periods per window.
+    :return: Numpy array shaped like values; NaN where the window ending at a period is incomplete or holds no values
+    """
+    def trailing_sums(x):
+        sums = np.concatenate([np.zeros(x.shape[:-1] + (1,)), np.cumsum(x, axis=-1)], axis=-1)
+        return sums[..., window:] - sums[..., :-window]
+
+    valid = ~np.isnan(values)
+    padding = np.full(values.shape[:-1] + (min(window - 1, values.shape[-1]),), np.nan)
+    if values.shape[-1] < window:
+        return padding
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = trailing_sums(np.where(valid, values, 0.)) / trailing_sums(valid)
+    complete = trailing_sums(logged) == window
+    return np.concatenate([padding, np.where(complete, means, np.nan)], axis=-1)
+
+
+def _first(condition, values):
+    # Per run: value at the first period satisfying condition; NaN if there is none
+    index = np.argmax(condition, axis=-1)[..., np.newaxis]
+    return np.where(condition.any(axis=-1), np.take_along_axis(values, index, axis=-1)[..., 0], np.nan)
+
+
+def _at(values, index):
+    # Per run: value at the given period index; NaN for negative indices (runs without logged periods)
+    picked = np.take_along_axis(values, np.maximum(index, 0)[..., np.newaxis], axis=-1)[..., 0]
+    return np.where(index >= 0, picked, np.nan)
+
+
+def learning_curve_metrics(tensor, thresholds=DEFAULT_THRESHOLDS, window=10, plateau_tolerance=0.1):
+    """
+        Computes the metrics of all runs at once (see above).
+    :param tensor: Tensor as returned by training_aggregation.load_training_tensor().
+    :param thresholds: Numbers K of grasps per logged period to compute Time_steps_to_<K>_grasps for.
+    :param window: Number of logged periods per window.
+    :param plateau_tolerance: Relative tolerance below the plateau level.
+    :return: OrderedDict; key = name of the metric, val = Numpy array of shape (settings, runs); NaN for padded runs
+    """
+    logged = ~np.isnan(tensor[..., UPDATE_NR])
+    last = logged.sum(axis=-1) - 1  # Logs are padded at their ends
+    steps, grasps = tensor[..., TOTAL_TIME_STEPS], tensor[..., GRASPS]
+    windowed = {column: windowed_means(tensor[..., column], logged, window)
+                for column in [GRASPS, AVG_GRASP_TIME, STD_GRASP_TIME, MAX_GRASP_TIME, MIN_GRASP_TIME]}
+    windowed_grasps = windowed[GRASPS]
+    metrics = OrderedDict()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)  # All-NaN slices, e.g. padded runs
+
+        metrics['Total_time_steps'] = _at(steps, last)
+        metrics['Total_grasps'] = np.where(last >= 0, np.nansum(grasps, axis=-1), np.nan)
+
+        for threshold in thresholds:
+            metrics['Time_steps_to_' + str(threshold) + '_grasps'] = _first(windowed_grasps >= threshold, steps)
+
+        # Trapezoidal rule over the time steps, normalized by the time steps spanned and the max. grasps observed
+        segments = (grasps[..., 1:] + grasps[..., :-1]) / 2. * np.diff(steps, axis=-1)
+        areas = np.nansum(segments, axis=-1)
+        spans = _at(steps, last) - steps[..., 0]
+        reference = np.nanmax(grasps) if logged.any() else np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            metrics['Normalized_AUC'] = np.where(spans > 0, areas / (spans * reference), np.nan)
+
+        level = _at(windowed_grasps, last)
+        metrics['Plateau_level'] = level
+        # Periods from which on the windowed mean stays at (or above) the plateau (up to the tolerance)
+        near_plateau = (windowed_grasps >= (1. - plateau_tolerance) * level[..., np.newaxis]) | ~logged
+        staying = np.flip(np.logical_and.accumulate(np.flip(near_plateau, axis=-1), axis=-1), axis=-1)
+        metrics['Plateau_onset_time_steps'] = _first(staying & logged & ~np.isnan(windowed_grasps), steps)
+
+        best = np.nanargmax(np.where(np.isnan(windowed_grasps), -np.inf, windowed_grasps), axis=-1)
+        has_window = (~np.isnan(windowed_grasps)).any(axis=-1)
+        metrics['Best_window_grasps'] = np.where(has_window, np.nanmax(windowed_grasps, axis=-1), np.nan)
+        metrics['Best_window_time_steps'] = np.where(has_window, _at(steps, best), np.nan)
+
+        for column in [AVG_GRASP_TIME, STD_GRASP_TIME, MAX_GRASP_TIME, MIN_GRASP_TIME]:
+            metrics['Final_' + TRAINING_LOG_COLUMNS[column].lower()] = _at(windowed[column], last)
+        metrics['Best_window_avg_grasp_time_steps'] = np.nanmin(windowed[AVG_GRASP_TIME], axis=-1)
+        metrics['Min_grasp_time_steps'] = np.nanmin(tensor[..., MIN_GRASP_TIME], axis=-1)
+        metrics['Max_grasp_time_steps'] = np.nanmax(tensor[..., MAX_GRASP_TIME], axis=-1)
+    return metrics
+
+
+def setting_metrics(metrics, thresholds=DEFAULT_THRESHOLDS):
+    """
+        Aggregates the metrics of the runs per parameter setting.
+    :param metrics: Result of learning_curve_metrics().
+    :param thresholds: Thresholds passed to learning_curve_metrics().
+    :return: OrderedDict; key = column name, val = Numpy array holding the value per setting:
+                Mean_<metric>, Std_<metric>: mean and std over the runs reaching the metric (NaN values ignored), and
+                Runs_reaching_<K>_grasps: number of runs whose windowed mean number of grasps reached K
+    """
+    columns = OrderedDict()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        for name, values in metrics.items():
+            columns['Mean_' + name] = np.nanmean(values, axis=-1)
+            columns['Std_' + name] = np.nanstd(values, axis=-1)
+    for threshold in thresholds:
+        columns['Runs_reaching_' + str(threshold) + '_grasps'] = \
+            (~np.isnan(metrics['Time_steps_to_' + str(threshold) + '_grasps'])).sum(axis=-1).astype(np.float64)
+    return columns
+
+
+def evaluate_learning_curves(path, params, direct=PATH_WRITE + 'LearningCurves/', thresholds=DEFAULT_THRESHOLDS,
+                             window=10, plateau_tolerance=0.1):
+    """
+        Computes the learning-curve metrics of all runs and saves them, both as csv files and as typed binary files:
+            <direct>/Runs.csv: Per run: its parameter setting and metrics.
+            <direct>/Settings.csv: Per parameter setting: its number of runs and the aggregated metrics (see
+                                   setting_metrics()).
+    :param path: Path to the folder containing the runs' folders.
+    :param params: Dictionary; key: parameter-setting-id, val: list of runs trained on the respective parameter setting.
+    :param direct: Folder where to store the emission files.
+    :param thresholds: See learning_curve_metrics().
+    :param window: See learning_curve_metrics().
+    :param plateau_tolerance: See learning_curve_metrics().
+    :return: Tuple (metrics, settings) as returned by learning_curve_metrics() and setting_metrics()
+    """
+    tensor, run_counts = load_training_tensor(path, params)
+    metrics = learning_curve_metrics(tensor, thresholds, window, plateau_tolerance)
+    settings = setting_metrics(metrics, thresholds)
+    keys = list(params.keys())
+    metadata = {'window': window, 'thresholds': list(thresholds), 'plateau_tolerance': plateau_tolerance}
+
+    # Per run
+    runs = [(setting_idx, run_idx, run) for setting_idx, key in enumerate(keys)
+            for run_idx, run in enumerate(params[key])]
+    run_data = np.array([[metrics[name][setting_idx, run_idx] for name in metrics]
+                         for setting_idx, run_idx, _ in runs], dtype=np.float64).reshape((-1, len(metrics)))
+    save_data_package_to_file(direct, 'Runs', [['Run', 'Parameter_setting'] + list(metrics)] +
+                              [[run, keys[setting_idx]] + row for (setting_idx, _, run), row in
+                               zip(runs, run_data.astype(str).tolist())])
+    save_table(direct, 'Runs', list(metrics), run_data, row_ids=[run for _, _, run in runs],
+               metadata=dict(metadata, parameter_settings=[keys[setting_idx] for setting_idx, _, _ in runs]))
+
+    # Per parameter setting
+    setting_data = np.column_stack([run_counts] + list(settings.values())).reshape((len(keys), len(settings) + 1))
+    save_data_package_to_file(direct, 'Settings', [['Parameter_setting', 'Runs'] + list(settings)] +
+                              [[key] + row for key, row in zip(keys, setting_data.astype(str).tolist())])
+    save_table(direct, 'Settings', ['Runs'] + list(settings), setting_data, row_ids=keys, metadata=metadata)
+    return metrics, settings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sample-efficiency metrics of the learning curves of all completely '
+                                                 'trained runs.')
+    parser.add_argument('--thresholds', default=','.join(str(k) for k in DEFAULT_THRESHOLDS),
+                        help='Comma-separated numbers K of grasps per logged period to compute the time steps until '
+                             'reaching them for (default: ' + ','.join(str(k) for k in DEFAULT_THRESHOLDS) + ').')
+    parser.add_argument('--window', type=int, default=10,
+                        help='Number of logged periods per window of the windowed means (default: 10).')
+    parser.add_argument('--plateau-tolerance', type=float, default=0.1,
+                        help='Relative tolerance below the plateau level for detecting the plateau onset '
+                             '(default: 0.1).')
+    add_grouping_arguments(parser)
+    args = parser.parse_args()
+    if args.window < 1:
+        parser.error('--window must be positive.')
+
+    start = time.perf_counter()
+    catalog = RunCatalog(PATH_READ)
+    candidate_dirs, _ = catalog.get_complete_trials()
+    used_dict, _ = group_runs_from_arguments(catalog, candidate_dirs, args)
+    catalog.close()
+    evaluate_learning_curves(PATH_READ, used_dict, thresholds=[float(k) if '.' in k else int(k)
+                                                               for k in args.thresholds.split(',')],
+                             window=args.window, plateau_tolerance=args.plateau_tolerance)
+    print('Computed the learning-curve metrics of ' + str(sum(len(runs) for runs in used_dict.values())) +
+          ' runs in ' + '{:.2f}'.format(time.perf_counter() - start) + ' s.')
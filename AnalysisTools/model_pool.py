@@ -0,0 +1,118 @@
+import json
+import zipfile
+from collections import OrderedDict
+
+from numpy_policy import load_parameters
+
+'''
+    Re-use of TF graphs and sessions across models sharing the same architecture.
+
+    PPO2.load() builds a new TF graph and session for every loaded model, which takes seconds per model and keeps
+    growing the memory usage of a process evaluating many models (or checkpoints). All models trained using the same
+    policy, net_arch and act_fun (and observation/action space) have the same graph though. ModelPool therefore builds
+    the graph once per distinct architecture and only swaps in the trained weights (the 'parameters' stored in the
+    model's zip-archive) when a model of an architecture already loaded is requested. At most max_sessions graphs are
+    kept alive; the least recently used one gets closed first.
+'''
+
+# Entries of a model's data (inside its zip-archive) determining the graph built by PPO2, and their fields compared.
+# Other fields, e.g. the spaces' pickled random states, differ between models of the same architecture.
+ARCHITECTURE_DATA_FIELDS = {'policy': [':serialized:'],  # Pickled by reference, i.e. the policy class' name
+                            'observation_space': [':type:', 'shape', 'dtype', 'low', 'high'],
+                            'action_space': [':type:', 'shape', 'dtype', 'low', 'high']}
+
+_process_pools = dict()
+
+
+def process_model_pool(max_sessions):
+    """
+        ModelPool shared by all evaluations within the current process. Pools passed to worker processes get replaced
+        by the respective worker's own pool upon unpickling, since TF sessions cannot be shared between processes.
+    :param max_sessions: Max. number of TF sessions kept alive.
+    :return: ModelPool
+    """
+    if max_sessions not in _process_pools:
+        _process_pools[max_sessions] = ModelPool(max_sessions)
+    return _process_pools[max_sessions]
+
+
+def architecture_key(model_path, params, parameters):
+    """
+    :param model_path: Path to a model's zip-archive.
+    :param params: Parameters used for training the model (see final_evaluation.load_model_params()).
+    :param parameters: OrderedDict of the model's weights as returned by numpy_policy.load_parameters().
+    :return: Hashable key; models having the same key can share a TF graph
+    """
+    with zipfile.ZipFile(model_path) as archive:
+        data = json.loads(archive.read('data'))
+    return (params.get('policy'), json.dumps(params.get('net_arch')), params.get('act_fun'),
+            tuple((key, field, str(data.get(key, {}).get(field)))
+                  for key, fields in sorted(ARCHITECTURE_DATA_FIELDS.items()) for field in fields),
+            tuple((name, value.shape) for name, value in parameters.items()))
+
+
+class ModelPool(object):
+    """
+        LRU pool of loaded PPO2 models, one per architecture (see architecture_key()).
+    """
+
+    def __init__(self, max_sessions=4):
+        """
+        :param max_sessions: Max. number of TF sessions (i.e. architectures) kept alive at the same time.
+        """
+        if max_sessions < 1:
+            raise ValueError('max_sessions must be at least 1.')
+        self.max_sessions = max_sessions
+        self.models = OrderedDict()  # architecture key -> model; least recently used first
+        self.builds = 0
+        self.swaps = 0
+        self.evictions = 0
+
+    def __reduce__(self):
+        return process_model_pool, (self.max_sessions,)
+
+    def load(self, model_path, params):
+        """
+            Drop-in replacement for PPO2.load(model_path). The returned model may be handed out again (holding other
+            weights) by a later call, so it must not be used anymore afterwards.
+        :param model_path: Path to a model's zip-archive.
+        :param params: Parameters used for training the model (see final_evaluation.load_model_params()).
+        :return: Model holding the weights stored in model_path
+        """
+        parameters = load_parameters(model_path)
+        key = architecture_key(model_path, params, parameters)
+
+        model = self.models.pop(key, None)
+        if model is not None:
+            model.load_parameters(parameters)
+            self.swaps += 1
+        else:
+            from stable_baselines import PPO2
+            model = PPO2.load(model_path)
+            self.builds += 1
+        self.models[key] = model
+
+        while len(self.models) > self.max_sessions:
+            _, evicted = self.models.popitem(last=False)
+            self._close(evicted)
+            self.evictions += 1
+        return model
+
+    @staticmethod
+    def _close(model):
+        sess = getattr(model, 'sess', None)
+        if sess is not None:
+            sess.close()
+
+    def close(self):
+        """
+            Closes the sessions of all pooled models.
+        :return: -
+        """
+        for model in self.models.values():
+            self._close(model)
+        self.models.clear()
+
+    def to_dict(self):
+        return {'max_sessions': self.max_sessions, 'live_sessions': len(self.models), 'builds': self.builds,
+                'swaps': self.swaps, 'evictions': self.evictions}
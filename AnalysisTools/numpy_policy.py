@@ -0,0 +1,323 @@
+import io, json, re, sys
+import argparse
+import zipfile
+from collections import OrderedDict
+import numpy as np
+
+'''
+    TensorFlow-free inference for trained PPO2 MlpPolicy models.
+    Reads the weights straight from a model's zip-archive (final_model.zip or checkpoint_*.zip) and computes the
+    policy's forward pass in NumPy on batches of observations. NumpyMlpPolicy.predict() mirrors PPO2.predict(), so
+    that it can be used as drop-in replacement for a loaded PPO2 model during evaluation.
+
+    Parity with PPO2 can be checked directly (requires TensorFlow; python numpy_policy.py <model.zip>) or against
+    reference outputs stored next to a model (python numpy_policy.py --reference), which runs without TensorFlow.
+    Reference files get created using python numpy_policy.py --record <model.zip>.
+'''
+
+# Max. absolute deviation from PPO2's outputs tolerated by the parity checks
+PARITY_TOLERANCE = 1e-4
+# Outputs compared by the parity checks
+PARITY_OUTPUTS = ['mean', 'std', 'deterministic_actions', 'value']
+# Suffix of the reference files holding a model's outputs on random observations (see record_reference())
+REFERENCE_SUFFIX = '.parity.npz'
+# Model whose reference file is checked by default
+REFERENCE_MODEL = '../Results/PPO2/PandaController_2019_07_11__04_22_12__463949axucqtuhun/final_model.zip'
+
+# Activation functions as they may be specified via params['act_fun'] or stored inside a model's data
+ACTIVATION_FUNCTIONS = {
+    'tanh': np.tanh,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': lambda x: 1. / (1. + np.exp(-x)),
+    'elu': lambda x: np.where(x > 0, x, np.expm1(x)),
+    'softplus': lambda x: np.logaddexp(x, 0),
+}
+
+
+def load_parameters(model_path):
+    """
+        Reads the trained weights from a model's zip-archive without extracting anything to disk.
+    :param model_path: Path to a model's zip-archive as saved by stable-baselines.
+    :return: OrderedDict: key = TF variable name (e.g. 'model/pi/w:0'), val = Numpy array holding the weights; in the
+             order given by the archive's parameter_list.
+    """
+    with zipfile.ZipFile(model_path) as archive:
+        parameter_list = json.loads(archive.read('parameter_list'))
+        parameters = np.load(io.BytesIO(archive.read('parameters')))
+        return OrderedDict((name, parameters[name]) for name in parameter_list)
+
+
+def load_model_data(model_path):
+    """
+        Reads the (json-encoded) class attributes of a trained model from its zip-archive.
+    :param model_path: Path to a model's zip-archive as saved by stable-baselines.
+    :return: Dictionary containing the model's data (hyperparameters, spaces, policy_kwargs, ...)
+    """
+    with zipfile.ZipFile(model_path) as archive:
+        return json.loads(archive.read('data'))
+
+
+def parse_space_bounds(bounds):
+    """
+        Bounds of gym.spaces.Box are stored as string representation of the respective Numpy array inside the model's
+        data, e.g. '[-1. -1. -1.]'. Converts such a string back to an array.
+    :param bounds: String representation of a Numpy array.
+    :return: Numpy array (float32)
+    """
+    return np.array(bounds.replace('[', ' ').replace(']', ' ').split(), dtype=np.float32)
+
+
+def activation_function_name(act_fun):
+    """
+        Extracts the name of an activation function from either its specification in params.json (e.g. 'tf.nn.tanh')
+        or its string representation stored in a model's data (e.g. '<function tanh at 0x7fb20cd4e488>').
+    :param act_fun: String specifying the activation function.
+    :return: Name of the activation function, e.g. 'tanh'
+    """
+    match = re.match(r'<function (\w+)', act_fun)
+    if match:
+        return match.group(1)
+    return act_fun.split('.')[-1]
+
+
+class NumpyMlpPolicy(object):
+    """
+        NumPy re-implementation of the forward pass of stable-baselines' MlpPolicy for continuous (Box) action spaces.
+        Hidden layers: shared_fc0, shared_fc1, ... followed by the policy-specific layers pi_fc0, pi_fc1, ... (if any).
+        Deterministic actions are the means of the diagonal Gaussian; stochastic actions are sampled from it using
+        the learned log standard deviations. As done by PPO2.predict(), actions get clipped to the action space.
+    """
+
+    def __init__(self, parameters, act_fun='tanh', action_low=None, action_high=None, seed=None):
+        """
+        :param parameters: OrderedDict of weights as returned by load_parameters().
+        :param act_fun: Name of the activation function used in the hidden layers (see activation_function_name()).
+        :param action_low: Lower bounds of the action space; actions are not clipped if None.
+        :param action_high: Upper bounds of the action space; actions are not clipped if None.
+        :param seed: Seed for sampling stochastic actions.
+        """
+        act_fun = activation_function_name(act_fun)
+        if act_fun not in ACTIVATION_FUNCTIONS:
+            raise ValueError('Unsupported activation function: ' + act_fun)
+        self.act_fun = ACTIVATION_FUNCTIONS[act_fun]
+
+        self.policy_layers = self._collect_layers(parameters, 'shared_fc') + self._collect_layers(parameters, 'pi_fc')
+        self.value_layers = self._collect_layers(parameters, 'shared_fc') + self._collect_layers(parameters, 'vf_fc')
+        self.pi_w, self.pi_b = parameters['model/pi/w:0'], parameters['model/pi/b:0']
+        self.vf_w, self.vf_b = parameters['model/vf/w:0'], parameters['model/vf/b:0']
+        self.std = np.exp(parameters['model/pi/logstd:0'][0])
+        self.obs_dim = self.policy_layers[0][0].shape[0] if self.policy_layers else self.pi_w.shape[0]
+        self.action_low = action_low
+        self.action_high = action_high
+        self.rng = np.random.RandomState(seed)
+
+    @staticmethod
+    def _collect_layers(parameters, prefix):
+        layers = []
+        while 'model/{}{}/w:0'.format(prefix, len(layers)) in parameters:
+            idx = len(layers)
+            layers.append((parameters['model/{}{}/w:0'.format(prefix, idx)],
+                           parameters['model/{}{}/b:0'.format(prefix, idx)]))
+        return layers
+
+    @classmethod
+    def load(cls, model_path, act_fun=None, seed=None):
+        """
+            Creates a policy from a model's zip-archive.
+        :param model_path: Path to a model's zip-archive.
+        :param act_fun: Activation function, e.g. params['act_fun'] from params.json. If None, it is read from the
+                        policy_kwargs stored inside the archive (defaulting to tanh, as does MlpPolicy).
+        :param seed: Seed for sampling stochastic actions.
+        :return: NumpyMlpPolicy
+        """
+        data = load_model_data(model_path)
+        if act_fun is None:
+            act_fun = data.get('policy_kwargs', {}).get('act_fun', 'tanh')
+        action_space = data['action_space']
+        return cls(load_parameters(model_path),
+                   act_fun=act_fun,
+                   action_low=parse_space_bounds(action_space['low']),
+                   action_high=parse_space_bounds(action_space['high']),
+                   seed=seed)
+
+    def set_random_seed(self, seed):
+        self.rng = np.random.RandomState(seed)
+
+    def _latent(self, obs, layers):
+        latent = obs
+        for w, b in layers:
+            latent = self.act_fun(latent @ w + b)
+        return latent
+
+    def _prepare(self, observation):
+        observation = np.asarray(observation, dtype=np.float32)
+        vectorized = observation.ndim > 1
+        return observation.reshape((-1, self.obs_dim)), vectorized
+
+    def action_probability(self, observation):
+        """
+            Parameters of the policy's action distribution, as returned by PPO2.action_probability() for Box spaces.
+        :param observation: Single observation or batch of observations.
+        :return: List [mean, std] of the diagonal Gaussian, each of shape (batch, action_dim)
+        """
+        obs, vectorized = self._prepare(observation)
+        mean = self._latent(obs, self.policy_layers) @ self.pi_w + self.pi_b
+        std = np.broadcast_to(self.std, mean.shape)
+        if not vectorized:
+            return [mean[0], std[0]]
+        return [mean, std]
+
+    def value(self, observation):
+        """
+            Value estimates for the given observations.
+        :param observation: Batch of observations.
+        :return: Numpy array of shape (batch,)
+        """
+        obs, _ = self._prepare(observation)
+        return (self._latent(obs, self.value_layers) @ self.vf_w + self.vf_b)[:, 0]
+
+    def predict(self, observation, state=None, mask=None, deterministic=False):
+        """
+            Drop-in replacement for PPO2.predict().
+        :param observation: Single observation or batch of observations.
+        :param state: Unused; kept for compatibility (no recurrent policies).
+        :param mask: Unused; kept for compatibility.
+        :param deterministic: Whether to return the mean action instead of sampling one.
+        :return: Tuple (actions, None)
+        """
+        obs, vectorized = self._prepare(observation)
+        actions = self._latent(obs, self.policy_layers) @ self.pi_w + self.pi_b
+        if not deterministic:
+            actions = actions + self.std * self.rng.standard_normal(actions.shape).astype(np.float32)
+        if self.action_low is not None:
+            actions = np.clip(actions, self.action_low, self.action_high)
+        if not vectorized:
+            actions = actions[0]
+        return actions, None
+
+
+def draw_observations(low, high, num_obs, seed=0):
+    """
+        Random observations to compare the outputs of both inference backends on, drawn uniformly from the observation
+        space (clipped to [-1, 1]).
+    :param low: Lower bounds of the observation space.
+    :param high: Upper bounds of the observation space.
+    :param num_obs: Number of observations.
+    :param seed: Seed for drawing the observations.
+    :return: Numpy array (float32) of shape (num_obs, observation dim)
+    """
+    rng = np.random.RandomState(seed)
+    return rng.uniform(np.maximum(low, -1.), np.minimum(high, 1.), size=(num_obs,) + np.shape(low)).astype(np.float32)
+
+
+def tf_outputs(model, obs):
+    """
+        Outputs of a loaded PPO2 model compared by the parity checks.
+    :param model: PPO2 model.
+    :param obs: Batch of observations.
+    :return: Dictionary: key = compared quantity, val = Numpy array
+    """
+    mean, std = model.action_probability(obs)
+    actions, _ = model.predict(obs, deterministic=True)
+    value = model.sess.run(model.act_model.value_flat, {model.act_model.obs_ph: obs})
+    return {'mean': mean, 'std': std, 'deterministic_actions': actions, 'value': value}
+
+
+def numpy_outputs(policy, obs):
+    """
+        Outputs of a NumpyMlpPolicy compared by the parity checks (see tf_outputs()).
+    """
+    mean, std = policy.action_probability(obs)
+    actions, _ = policy.predict(obs, deterministic=True)
+    return {'mean': mean, 'std': std, 'deterministic_actions': actions, 'value': policy.value(obs)}
+
+
+def _max_deviations(outputs, reference):
+    return {name: float(np.max(np.abs(np.asarray(outputs[name]) - np.asarray(reference[name])))) for name in
+            PARITY_OUTPUTS}
+
+
+def check_parity(model_path, num_obs=1000, seed=0):
+    """
+        Compares NumpyMlpPolicy against stable-baselines' PPO2 on random observations drawn from the model's
+        observation space. Requires stable-baselines (and hence TensorFlow) to be installed.
+    :param model_path: Path to a model's zip-archive.
+    :param num_obs: Number of observations to compare the outputs on.
+    :param seed: Seed for drawing the observations.
+    :return: Dictionary: max. absolute deviation per compared quantity
+    """
+    from stable_baselines import PPO2
+
+    model = PPO2.load(model_path)
+    policy = NumpyMlpPolicy.load(model_path)
+    obs = draw_observations(model.observation_space.low, model.observation_space.high, num_obs, seed)
+    return _max_deviations(numpy_outputs(policy, obs), tf_outputs(model, obs))
+
+
+def record_reference(model_path, reference_path=None, num_obs=200, seed=0):
+    """
+        Stores the outputs of PPO2 on random observations as reference file, so that the parity of NumpyMlpPolicy can
+        be checked repeatedly (see check_reference()) without TensorFlow being installed. Requires stable-baselines
+        (and hence TensorFlow) to be installed.
+    :param model_path: Path to a model's zip-archive.
+    :param reference_path: Path of the reference file; <model_path>.parity.npz if None.
+    :param num_obs: Number of observations.
+    :param seed: Seed for drawing the observations.
+    :return: Path of the reference file
+    """
+    from stable_baselines import PPO2
+
+    model = PPO2.load(model_path)
+    obs = draw_observations(model.observation_space.low, model.observation_space.high, num_obs, seed)
+    outputs = tf_outputs(model, obs)
+
+    reference_path = reference_path or model_path + REFERENCE_SUFFIX
+    np.savez_compressed(reference_path, observations=obs, backend=np.array('tf'),
+                        **{name: np.asarray(outputs[name], dtype=np.float32) for name in PARITY_OUTPUTS})
+    return reference_path
+
+
+def check_reference(model_path, reference_path=None):
+    """
+        Compares NumpyMlpPolicy against the PPO2 outputs stored by record_reference(). Does not require TensorFlow.
+    :param model_path: Path to a model's zip-archive.
+    :param reference_path: Path of the reference file; <model_path>.parity.npz if None.
+    :return: Dictionary: max. absolute deviation per compared quantity
+    """
+    with np.load(reference_path or model_path + REFERENCE_SUFFIX) as reference:
+        backend = str(reference['backend']) if 'backend' in reference.files else None
+        if backend != 'tf':
+            raise ValueError('Reference outputs were not computed by PPO2 (backend: ' + str(backend) + '); '
+                             're-record them using python numpy_policy.py --record <model.zip>.')
+        outputs = numpy_outputs(NumpyMlpPolicy.load(model_path), reference['observations'])
+        return _max_deviations(outputs, reference)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checks the parity of the NumPy inference with PPO2 (TensorFlow).')
+    parser.add_argument('models', nargs='*', help='Paths to models\' zip-archives (default with --reference: ' +
+                                                  REFERENCE_MODEL + ').')
+    parser.add_argument('--reference', action='store_true',
+                        help='Compare against the outputs stored next to each model (<model>.parity.npz) instead of '
+                             'running PPO2; does not require TensorFlow. Exits with status 1 on a violation.')
+    parser.add_argument('--record', action='store_true',
+                        help='Store the outputs of PPO2 for each model as reference file (<model>.parity.npz); requires '
+                             'stable-baselines.')
+    args = parser.parse_args()
+
+    violated = False
+    for path in args.models or ([REFERENCE_MODEL] if args.reference else []):
+        if args.record:
+            print(path + ': reference saved to ' + record_reference(path))
+            continue
+        if args.reference:
+            deviations = check_reference(path)
+            print(path + ' (against stored PPO2 outputs)')
+        else:
+            deviations = check_parity(path)
+            print(path)
+        print(deviations)
+        ok = max(deviations.values()) < PARITY_TOLERANCE
+        violated = violated or not ok
+        print('Parity OK' if ok else 'PARITY VIOLATED')
+    sys.exit(1 if violated else 0)
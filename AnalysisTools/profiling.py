@@ -0,0 +1,353 @@
+import os
+import json
+import glob
+import time
+import bisect
+import resource
+from contextlib import contextmanager
+
+'''
+    Opt-in instrumentation of the analysis scripts.
+
+    EvaluationProfiler (final_evaluation.py --profile) wraps the test environment and the model of each evaluated model,
+    recording a wall-time histogram per phase of the evaluation loop (model loading, model.predict, env.step, env.reset,
+    set_step_counter), the number of simulated steps and steps/sec, as well as the process' memory usage after loading
+    and after evaluating the model. Like the evaluation journal, each process appends its per-model records to its own
+    file (profile_<pid>.jsonl), which get merged into a single report (profile_report.json) per model and per worker.
+
+    PhaseCounters (training_analysis.py --profile) only accumulates the number of calls and the total wall time per
+    phase (load, aggregate, write) and is cheap enough to be left enabled while the Results tree grows.
+'''
+
+DEFAULT_PROFILING_DIR = '../FinalEvaluation/Profiling/'
+REPORT_FILE_NAME = 'profile_report.json'
+
+# Upper bounds (in microseconds) of the histogram buckets; durations above the last bound fall into an overflow bucket
+HISTOGRAM_BUCKETS_US = [2 ** k for k in range(31)]
+
+
+def peak_rss_kb():
+    """
+    :return: Peak resident set size of the current process so far in KB (as reported by getrusage on Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def current_rss_kb():
+    """
+    :return: Current resident set size of the current process in KB; None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (IOError, ValueError, IndexError):
+        return None
+
+
+class PhaseHistogram(object):
+    """
+        Wall-time statistics of a single phase: number of calls, total/min/max duration and a histogram over
+        logarithmically (power of 2) spaced buckets.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS_US) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(HISTOGRAM_BUCKETS_US, seconds * 1e6)] += 1
+
+    def merge(self, other):
+        """
+            Adds the statistics of another histogram (e.g. of another model) to this one.
+        :param other: PhaseHistogram.
+        :return: -
+        """
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def to_dict(self):
+        return {'count': self.count,
+                'total_s': self.total,
+                'mean_us': self.total / self.count * 1e6 if self.count else None,
+                'min_us': self.min * 1e6 if self.count else None,
+                'max_us': self.max * 1e6 if self.count else None,
+                'buckets': self.buckets}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.count = data['count']
+        histogram.total = data['total_s']
+        histogram.min = data['min_us'] / 1e6 if data['count'] else float('inf')
+        histogram.max = data['max_us'] / 1e6 if data['count'] else 0.
+        histogram.buckets = list(data['buckets'])
+        return histogram
+
+
+class _ProfiledModel(object):
+    # Times model.predict(); everything else gets passed through to the wrapped model
+    def __init__(self, model, profiler):
+        self._model = model
+        self._profiler = profiler
+
+    def predict(self, *args, **kwargs):
+        return self._profiler.time_phase('predict', self._model.predict, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+class _ProfiledEnv(object):
+    # Times set_step_counter() called directly on an env held by a vectorized env (see run_test_runs())
+    def __init__(self, env, profiler):
+        self._env = env
+        self._profiler = profiler
+
+    def set_step_counter(self, *args, **kwargs):
+        return self._profiler.time_phase('set_step_counter', self._env.set_step_counter, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._env, name)
+
+
+class _ProfiledVecEnv(object):
+    # Times reset(), step() and env_method() of a vectorized env and counts the simulated steps
+    def __init__(self, env, profiler):
+        self._env = env
+        self._profiler = profiler
+        self.num_envs = env.num_envs
+        self.envs = [_ProfiledEnv(e, profiler) for e in getattr(env, 'envs', [])]
+
+    def reset(self):
+        return self._profiler.time_phase('reset', self._env.reset)
+
+    def step(self, actions):
+        self._profiler.steps += self.num_envs
+        return self._profiler.time_phase('step', self._env.step, actions)
+
+    def env_method(self, method_name, *args, **kwargs):
+        phase = method_name if method_name in ('reset', 'set_step_counter') else 'env_method'
+        return self._profiler.time_phase(phase, self._env.env_method, method_name, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._env, name)
+
+
+class EvaluationProfiler(object):
+    """
+        Records per-phase wall-time histograms, steps/sec and memory usage for each model evaluated by test_run().
+        Only the proxies returned by wrap_env() and wrap_model() add timing overhead, so test_run() is unaffected when
+        no profiler is given.
+    """
+
+    def __init__(self, directory=DEFAULT_PROFILING_DIR):
+        """
+        :param directory: Folder holding the per-process record files and the merged report.
+        """
+        self.directory = directory
+        self.phases = dict()
+        self.steps = 0
+        self._model_path = None
+        self._start = None
+        self._rss_after_load = None
+
+    def __getstate__(self):
+        # A worker process starts with an empty record; its records only get shared via its record file
+        return {'directory': self.directory, 'phases': dict(), 'steps': 0, '_model_path': None, '_start': None,
+                '_rss_after_load': None}
+
+    def clear(self):
+        """
+            Removes all record files and the report of a previous evaluation.
+        :return: -
+        """
+        for record_file in glob.glob(os.path.join(self.directory, 'profile_*.jsonl')):
+            os.remove(record_file)
+        if os.path.exists(os.path.join(self.directory, REPORT_FILE_NAME)):
+            os.remove(os.path.join(self.directory, REPORT_FILE_NAME))
+
+    def time_phase(self, phase, fn, *args, **kwargs):
+        """
+            Calls fn(*args, **kwargs) and adds its wall time to the histogram of the given phase.
+        :param phase: Name of the phase.
+        :param fn: Function to be called.
+        :return: Return value of fn
+        """
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        duration = time.perf_counter() - start
+        if phase not in self.phases:
+            self.phases[phase] = PhaseHistogram()
+        self.phases[phase].add(duration)
+        return result
+
+    def start_model(self, model_path):
+        """
+            Starts recording the evaluation of a model.
+        :param model_path: Path to the model.
+        :return: -
+        """
+        self.phases = dict()
+        self.steps = 0
+        self._model_path = model_path
+        self._rss_after_load = None
+        self._start = time.perf_counter()
+
+    def load_model(self, load_fn):
+        """
+            Loads a model by calling load_fn(), recording the time needed and the memory usage afterwards.
+        :param load_fn: Function loading and returning the model.
+        :return: Loaded model
+        """
+        model = self.time_phase('load', load_fn)
+        self._rss_after_load = current_rss_kb()
+        return model
+
+    def wrap_env(self, env):
+        """
+        :param env: Vectorized environment (e.g. SingleEnvVecEnv or SubprocVecEnv).
+        :return: Proxy of env timing reset(), step(), env_method() and set_step_counter()
+        """
+        return _ProfiledVecEnv(env, self)
+
+    def wrap_model(self, model):
+        """
+        :param model: Model as loaded by test_run().
+        :return: Proxy of model timing predict()
+        """
+        return _ProfiledModel(model, self)
+
+    def finish_model(self, num_test_runs):
+        """
+            Finishes recording the evaluation of the current model and appends its record to the record file of the
+            current process.
+        :param num_test_runs: Number of test runs performed.
+        :return: The record (dictionary)
+        """
+        wall_time = time.perf_counter() - self._start
+        record = {'model': self._model_path,
+                  'pid': os.getpid(),
+                  'test_runs': num_test_runs,
+                  'wall_time_s': wall_time,
+                  'steps': self.steps,
+                  'steps_per_s': self.steps / wall_time if wall_time > 0 else None,
+                  'rss_after_load_kb': self._rss_after_load,
+                  'rss_kb': current_rss_kb(),
+                  'peak_rss_kb': peak_rss_kb(),
+                  'phases': {phase: histogram.to_dict() for phase, histogram in sorted(self.phases.items())}}
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'profile_' + str(os.getpid()) + '.jsonl'), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        return record
+
+    def load_records(self):
+        """
+        :return: List of all per-model records written by any process, in order of their record files
+        """
+        records = []
+        for record_file in sorted(glob.glob(os.path.join(self.directory, 'profile_*.jsonl'))):
+            with open(record_file) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue  # Incomplete line of an interrupted evaluation
+        return records
+
+    def write_report(self):
+        """
+            Merges the records of all processes into profile_report.json, listing the per-model records as well as a
+            summary per worker process (merged phase histograms, steps/sec and peak memory usage).
+        :return: Path to the report
+        """
+        records = self.load_records()
+        workers = dict()
+        for record in records:
+            worker = workers.setdefault(record['pid'], {'models': 0, 'test_runs': 0, 'wall_time_s': 0., 'steps': 0,
+                                                        'peak_rss_kb': 0, 'phases': dict()})
+            worker['models'] += 1
+            worker['test_runs'] += record['test_runs']
+            worker['wall_time_s'] += record['wall_time_s']
+            worker['steps'] += record['steps']
+            worker['peak_rss_kb'] = max(worker['peak_rss_kb'], record['peak_rss_kb'])
+            for phase, data in record['phases'].items():
+                if phase not in worker['phases']:
+                    worker['phases'][phase] = PhaseHistogram()
+                worker['phases'][phase].merge(PhaseHistogram.from_dict(data))
+
+        for worker in workers.values():
+            worker['steps_per_s'] = worker['steps'] / worker['wall_time_s'] if worker['wall_time_s'] > 0 else None
+            worker['phases'] = {phase: histogram.to_dict() for phase, histogram in sorted(worker['phases'].items())}
+
+        report = {'histogram_bucket_upper_bounds_us': HISTOGRAM_BUCKETS_US,
+                  'workers': {str(pid): worker for pid, worker in sorted(workers.items())},
+                  'models': records}
+        os.makedirs(self.directory, exist_ok=True)
+        report_path = os.path.join(self.directory, REPORT_FILE_NAME)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report_path
+
+
+class PhaseCounters(object):
+    """
+        Low-overhead counters: number of calls and total wall time per phase. Phases may be nested; the time spent in
+        a nested phase only counts towards the nested phase, not towards the enclosing one. If disabled, phase() does
+        not measure anything.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.calls = dict()
+        self.seconds = dict()
+        self._nested_time = []  # Per currently open phase: time spent in phases nested inside it so far
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        """
+            Context manager adding the wall time of its body (excluding nested phases) to the given phase.
+        :param name: Name of the phase.
+        """
+        if not self.enabled:
+            yield
+            return
+        self._nested_time.append(0.)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested_time = self._nested_time.pop()
+            if self._nested_time:
+                self._nested_time[-1] += elapsed
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.seconds[name] = self.seconds.get(name, 0.) + elapsed - nested_time
+
+    def to_dict(self):
+        return {'wall_time_s': time.perf_counter() - self._start,
+                'peak_rss_kb': peak_rss_kb(),
+                'phases': {name: {'calls': self.calls[name], 'total_s': self.seconds[name]}
+                           for name in sorted(self.calls)}}
+
+    def write_report(self, path):
+        """
+            Writes the counters to a json file.
+        :param path: Path of the file.
+        :return: -
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
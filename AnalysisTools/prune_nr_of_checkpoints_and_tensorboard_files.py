@@ -1,65 +1,47 @@
-import os, shutil, time
+import argparse
+
+from retention import parse_policy, plan_retention, print_plan, apply_plan, undo, purge, DEFAULT_TRASH_DIR
 
 '''
     Script to reduce the number of saved checkpoints and to delete the data recorded for tensorboard
-    evaluation in order to preserve manageable size of evaluation data.
-'''
-
-def get_complete_list_of_checkpoints_to_be_removed(path):
-    """
-        Remove unnecessary data blowing up the repo.
-    :return:    -
-    """
-    models = os.listdir(path)
-    to_be_removed = []
-    to_be_kept = []
-    print()
-
-    for model in models:
-        print(model)
-        print('Path + dir: ' + path+model)
-        test_runs = os.listdir(path+model)
-        for check_point_dir in test_runs:
-            if 'checkpoint_' in check_point_dir:
-                print('Checkpoint: ' + check_point_dir)
-                checkpoint_nr = check_point_dir.replace('checkpoint_', '').replace('.zip', '')
-                if not int(checkpoint_nr) % 500 == 0:
-                    to_be_removed.append(path+model+"/"+check_point_dir)
-                else:
-                    to_be_kept.append(path+model+"/"+check_point_dir)
-
-            if 'tensorboard' in check_point_dir:
-                to_be_removed.append(path + model + "/" + check_point_dir)
-            else:
-                to_be_kept.append(path + model + "/" + check_point_dir)
-    return to_be_removed, to_be_kept
-
-
+    evaluation in order to preserve manageable size of evaluation data (see retention.py).
 
-to_be_removed, to_be_kept = get_complete_list_of_checkpoints_to_be_removed('Results/PPO2/')  # 'Results_Daniel/PPO2/'
-
-
-print('##### TO BE KEPT: #####')
-for d in to_be_kept:
-    pass
-    print('To be kept: ' + d)
-
-print('##### TO BE REMOVED: #####')
-for d in to_be_removed:
-    print('To be removed: ' + d)
-
-confirmation = input('--- Do you intend to remove the files/folders listed above??? Type \'YeSyEs\': ')
+    By default, only the plan is printed (dry run). --apply moves the files to be removed into a trash folder and
+    prints the path of the undo manifest, which may be passed to --undo (restoring the files) or to --purge
+    (permanently deleting them).
+'''
 
-if confirmation == 'YeSyEs':
-    print('Going to remove in 5 seconds...')
-    time.sleep(5)
-    for d in to_be_removed:
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Remove checkpoints (and tensorboard logs) not kept by any policy.')
+    parser.add_argument('--path', default='../Results/PPO2/', help='Folder containing the runs\' folders.')
+    parser.add_argument('--keep', action='append', default=None,
+                        help='Retention policy; may be given multiple times, a checkpoint is kept if any policy keeps '
+                             'it: every:<n>, last:<k> or best:<k>[:<metric>[:<window>[:min]]] (default: every:500). '
+                             'final_model.zip is always kept.')
+    parser.add_argument('--keep-tensorboard', action='store_true', help='Do not remove tensorboard logs.')
+    parser.add_argument('--workers', type=int, default=8, help='Number of threads scanning/moving files (default: 8).')
+    parser.add_argument('--apply', action='store_true', help='Apply the plan instead of only printing it.')
+    parser.add_argument('--trash', default=DEFAULT_TRASH_DIR, help='Folder the removed files get moved to.')
+    parser.add_argument('--undo', metavar='MANIFEST', help='Restore the files removed by an applied plan.')
+    parser.add_argument('--purge', metavar='MANIFEST', help='Permanently delete the files removed by an applied plan.')
+    args = parser.parse_args()
+
+    if args.undo:
+        print('Restored ' + str(undo(args.undo, num_workers=args.workers)) + ' files.')
+    elif args.purge:
+        purge(args.purge)
+        print('Purged: ' + args.purge)
+    else:
         try:
-            os.remove(d)
-        except IsADirectoryError:
-            shutil.rmtree(d)
-else:
-    print('Failed to confirm. No action taken.')
-
-print('Done.')
-
+            policies = [parse_policy(spec) for spec in (args.keep or ['every:500'])]
+        except ValueError as e:
+            parser.error(str(e))
+        plan = plan_retention(args.path, policies, remove_tensorboard=not args.keep_tensorboard,
+                              num_workers=args.workers)
+        print_plan(plan)
+        if args.apply:
+            manifest_path = apply_plan(plan, trash_dir=args.trash, num_workers=args.workers)
+            print('Moved ' + str(plan['files']) + ' files to the trash. Undo via --undo ' + manifest_path +
+                  ', reclaim the disk space via --purge ' + manifest_path)
+        else:
+            print('Dry run; pass --apply to apply the plan.')
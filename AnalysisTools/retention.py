@@ -0,0 +1,278 @@
+import os, re, time
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from training_log import load_training_log, TRAINING_LOG_COLUMNS
+
+'''
+    Policy-driven retention of the checkpoints saved during training.
+
+    A retention plan gets computed from a list of policies, each selecting checkpoints of a run to be kept (e.g. every
+    500th update, the last K checkpoints, the K checkpoints with the most grasps recorded in training_eval.csv). A
+    checkpoint is kept if any of the policies keeps it; final_model.zip is always kept. Optionally, tensorboard logs get
+    removed as well. The plan lists per run the files to be removed and the bytes reclaimed, so that it can be reviewed
+    (dry run) before applying it.
+
+    Applying a plan moves the files to be removed into a trash folder (on the same file system, i.e. without copying)
+    and writes an undo manifest listing each moved file. If moving any file fails, all files moved so far are moved
+    back. An applied plan can be undone via the manifest until its trash folder gets purged, which is when the disk
+    space actually gets reclaimed.
+'''
+
+DEFAULT_TRASH_DIR = '../Results/RetentionTrash/'
+MANIFEST_FILE_NAME = 'undo_manifest.json'
+
+CHECKPOINT_PATTERN = re.compile(r'checkpoint_(\d+)\.zip$')
+
+
+class KeepEvery(object):
+    """
+        Keeps the checkpoints whose update-nr is divisible by n.
+    """
+
+    def __init__(self, n):
+        self.n = n
+
+    def select(self, run_path, checkpoints):
+        """
+        :param run_path: Folder of the run.
+        :param checkpoints: List of tuples (update-nr, file name), ordered by update-nr.
+        :return: Set of the file names of the checkpoints to be kept
+        """
+        return set(file_name for update_nr, file_name in checkpoints if update_nr % self.n == 0)
+
+    def to_spec(self):
+        return 'every:' + str(self.n)
+
+
+class KeepLast(object):
+    """
+        Keeps the k latest checkpoints.
+    """
+
+    def __init__(self, k):
+        self.k = k
+
+    def select(self, run_path, checkpoints):
+        return set(file_name for _, file_name in checkpoints[len(checkpoints) - self.k:]) if self.k > 0 else set()
+
+    def to_spec(self):
+        return 'last:' + str(self.k)
+
+
+class KeepBest(object):
+    """
+        Keeps the k checkpoints scoring best in a metric recorded in the run's training_eval.csv. A checkpoint's score
+        is the mean of the metric over the (at most) window logged periods up to and including its update-nr.
+    """
+
+    def __init__(self, k, metric='Grasps', window=5, higher_is_better=True):
+        if metric not in TRAINING_LOG_COLUMNS:
+            raise ValueError('Unknown metric: ' + metric)
+        self.k = k
+        self.metric = metric
+        self.window = window
+        self.higher_is_better = higher_is_better
+
+    def scores(self, run_path, checkpoints):
+        """
+        :return: Numpy array holding the score of each checkpoint; NaN if nothing was logged before the checkpoint
+        """
+        try:
+            log = load_training_log(os.path.join(run_path, 'training_eval.csv'))
+        except (IOError, ValueError):
+            return np.full(len(checkpoints), np.nan)
+        update_nrs = log[:, TRAINING_LOG_COLUMNS.index('Update_nr')]
+        values = log[:, TRAINING_LOG_COLUMNS.index(self.metric)]
+        # Cumulative sums over the NaN-free values, so that each window's mean takes constant time
+        valid = ~np.isnan(values)
+        sums = np.concatenate([[0.], np.cumsum(np.where(valid, values, 0.))])
+        counts = np.concatenate([[0], np.cumsum(valid)])
+        ends = np.searchsorted(update_nrs, [update_nr for update_nr, _ in checkpoints], side='right')
+        starts = np.maximum(ends - self.window, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (sums[ends] - sums[starts]) / (counts[ends] - counts[starts])
+
+    def select(self, run_path, checkpoints):
+        if self.k <= 0 or not checkpoints:
+            return set()
+        scores = self.scores(run_path, checkpoints)
+        scores = np.where(np.isnan(scores), -np.inf, scores if self.higher_is_better else -scores)
+        # Stable sort, so that ties are resolved in favour of earlier checkpoints
+        best = np.argsort(-scores, kind='stable')[:self.k]
+        return set(checkpoints[idx][1] for idx in best)
+
+    def to_spec(self):
+        return 'best:{}:{}:{}'.format(self.k, self.metric, self.window) + ('' if self.higher_is_better else ':min')
+
+
+def parse_policy(spec):
+    """
+        Parses a retention policy given as string:
+            every:<n>                           Keep checkpoints whose update-nr is divisible by n
+            last:<k>                            Keep the k latest checkpoints
+            best:<k>[:<metric>[:<window>[:min]]]  Keep the k checkpoints scoring best in a metric of training_eval.csv
+                                                  (default: Grasps, averaged over 5 logged periods; ':min' if lower
+                                                  values are better)
+    :param spec: Policy specification.
+    :return: Policy object
+    """
+    parts = spec.split(':')
+    try:
+        if parts[0] == 'every' and len(parts) == 2 and int(parts[1]) > 0:
+            return KeepEvery(int(parts[1]))
+        if parts[0] == 'last' and len(parts) == 2:
+            return KeepLast(int(parts[1]))
+        if parts[0] == 'best' and 2 <= len(parts) <= 5:
+            return KeepBest(int(parts[1]),
+                            metric=parts[2] if len(parts) > 2 else 'Grasps',
+                            window=int(parts[3]) if len(parts) > 3 else 5,
+                            higher_is_better=not (len(parts) > 4 and parts[4] == 'min'))
+    except ValueError as e:
+        raise ValueError('Invalid retention policy: ' + spec + ' (' + str(e) + ')')
+    raise ValueError('Invalid retention policy: ' + spec)
+
+
+def _entry_size(entry):
+    if not entry.is_dir(follow_symlinks=False):
+        return entry.stat(follow_symlinks=False).st_size
+    return sum(_entry_size(child) for child in os.scandir(entry.path))
+
+
+def plan_run(run_path, policies, remove_tensorboard=False):
+    """
+        Determines which files of a single run to remove.
+    :param run_path: Folder of the run.
+    :param policies: List of policies (see parse_policy()).
+    :param remove_tensorboard: Whether to remove the run's tensorboard logs.
+    :return: Dictionary:
+                remove: List of [file name, bytes] of the files (or folders) to be removed
+                keep: List of the file names of the checkpoints kept
+                bytes: Total bytes reclaimed
+    """
+    entries = {entry.name: entry for entry in os.scandir(run_path)}
+    checkpoints = sorted((int(match.group(1)), name) for name, match in
+                         ((name, CHECKPOINT_PATTERN.match(name)) for name in entries) if match)
+
+    keep = set()
+    for policy in policies:
+        keep |= policy.select(run_path, checkpoints)
+
+    remove = [name for _, name in checkpoints if name not in keep]
+    if remove_tensorboard:
+        remove += sorted(name for name in entries if 'tensorboard' in name)
+    remove = [[name, _entry_size(entries[name])] for name in remove]
+    return {'remove': remove, 'keep': [name for _, name in checkpoints if name in keep],
+            'bytes': sum(size for _, size in remove)}
+
+
+def plan_retention(path, policies, remove_tensorboard=False, num_workers=8):
+    """
+        Determines which files of all runs to remove.
+    :param path: Folder containing the runs' folders.
+    :param policies: List of policies (see parse_policy()).
+    :param remove_tensorboard: Whether to remove the runs' tensorboard logs.
+    :param num_workers: Number of threads scanning runs in parallel.
+    :return: Plan (json-serializable dictionary); key 'runs' maps each run folder name to the result of plan_run()
+    """
+    runs = sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        run_plans = list(executor.map(lambda run: plan_run(os.path.join(path, run), policies, remove_tensorboard),
+                                      runs))
+    return {'path': path, 'policies': [policy.to_spec() for policy in policies],
+            'remove_tensorboard': remove_tensorboard,
+            'runs': dict(zip(runs, run_plans)),
+            'files': sum(len(run_plan['remove']) for run_plan in run_plans),
+            'bytes': sum(run_plan['bytes'] for run_plan in run_plans)}
+
+
+def print_plan(plan):
+    """
+        Prints the files to be removed and the bytes reclaimed per run.
+    :param plan: Plan as returned by plan_retention().
+    :return: -
+    """
+    for run, run_plan in plan['runs'].items():
+        if run_plan['remove']:
+            print(run + ': removing ' + str(len(run_plan['remove'])) + ' files, reclaiming ' +
+                  str(run_plan['bytes']) + ' bytes; keeping ' + str(len(run_plan['keep'])) + ' checkpoints')
+    print('Total: removing ' + str(plan['files']) + ' files of ' + str(len(plan['runs'])) + ' runs, reclaiming ' +
+          str(plan['bytes']) + ' bytes (policies: ' + ', '.join(plan['policies']) +
+          (', removing tensorboard logs' if plan['remove_tensorboard'] else '') + ')')
+
+
+def _move(moves, num_workers):
+    # Moves all (source, destination) pairs in parallel; returns the pairs moved successfully and the first error
+    def move(pair):
+        os.makedirs(os.path.dirname(pair[1]), exist_ok=True)
+        os.rename(pair[0], pair[1])
+        return pair
+
+    moved, error = [], None
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(move, pair) for pair in moves]
+        for future in futures:
+            try:
+                moved.append(future.result())
+            except OSError as e:
+                error = error or e
+    return moved, error
+
+
+def apply_plan(plan, trash_dir=DEFAULT_TRASH_DIR, num_workers=8):
+    """
+        Moves all files to be removed according to a plan into a new trash folder and writes the undo manifest. Either
+        all files get moved, or (if moving any of them fails) none.
+    :param plan: Plan as returned by plan_retention().
+    :param trash_dir: Folder holding the trash folders of all applied plans.
+    :param num_workers: Number of threads moving files in parallel.
+    :return: Path to the undo manifest
+    """
+    trash = os.path.join(trash_dir, time.strftime('%Y_%m_%d__%H_%M_%S') + '_' + str(os.getpid()))
+    moves = [(os.path.join(plan['path'], run, name), os.path.join(trash, run, name))
+             for run, run_plan in plan['runs'].items() for name, _ in run_plan['remove']]
+
+    os.makedirs(trash)
+    manifest_path = os.path.join(trash, MANIFEST_FILE_NAME)
+    # Written before moving anything, so that an interrupted apply can still be undone
+    with open(manifest_path, 'w') as f:
+        json.dump({'plan': plan, 'moves': moves}, f)
+
+    moved, error = _move(moves, num_workers)
+    if error is not None:
+        _, rollback_error = _move([(destination, source) for source, destination in moved], num_workers)
+        if rollback_error is not None:
+            raise OSError('Applying the plan failed (' + str(error) + ') and so did rolling it back (' +
+                          str(rollback_error) + '); see ' + manifest_path)
+        shutil.rmtree(trash)
+        raise OSError('Applying the plan failed, no files were removed: ' + str(error))
+    return manifest_path
+
+
+def undo(manifest_path, num_workers=8):
+    """
+        Moves all files removed by an applied plan back to where they were, and deletes the plan's trash folder.
+    :param manifest_path: Path to the undo manifest written by apply_plan().
+    :param num_workers: Number of threads moving files in parallel.
+    :return: Number of files restored
+    """
+    with open(manifest_path) as f:
+        moves = json.load(f)['moves']
+    # Files not moved by an interrupted apply are still where they were
+    pending = [(destination, source) for source, destination in moves if os.path.lexists(destination)]
+    restored, error = _move(pending, num_workers)
+    if error is not None:
+        raise OSError('Restored ' + str(len(restored)) + ' of ' + str(len(pending)) + ' files: ' + str(error))
+    shutil.rmtree(os.path.dirname(manifest_path))
+    return len(restored)
+
+
+def purge(manifest_path):
+    """
+        Permanently deletes the trash folder of an applied plan; it cannot be undone afterwards.
+    :param manifest_path: Path to the undo manifest written by apply_plan().
+    :return: -
+    """
+    shutil.rmtree(os.path.dirname(manifest_path))
@@ -0,0 +1,399 @@
+import os
+import json
+import sqlite3
+import argparse
+
+'''
+    Persistent catalog of the training runs located in a results folder (e.g. Results/PPO2/), stored in a local SQLite
+    file next to it (e.g. Results/run_catalog.sqlite).
+    For each run (= folder created during a single training run), the catalog records its model_id, whether it is
+    complete (i.e. contains final_model.zip), its checkpoints, every field of its params.json and the number of rows
+    logged to its training_eval.csv. On refresh(), only runs whose folder, params.json or training_eval.csv changed
+    since the last refresh get re-read, so that the analysis scripts do not need to walk the whole tree on every
+    invocation.
+    Since every field of every params.json is indexed, runs can be selected by any combination of parameter values
+    (find_runs()) and grouped by any combination of fields (group_runs()) without reading any params.json.
+'''
+
+CATALOG_FILE_NAME = 'run_catalog.sqlite'
+
+# Version of the catalog's content (stored as user_version); catalogs of other versions get re-indexed from scratch
+# 1: params values stored normalised (see normalise_value())
+CATALOG_VERSION = 1
+
+# Field runs are grouped by unless specified otherwise: the parameter specification file a run was trained with
+DEFAULT_GROUP_BY = ['provided_params_file']
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS runs (
+        directory TEXT PRIMARY KEY,
+        model_id TEXT,
+        complete INTEGER NOT NULL,
+        training_eval_rows INTEGER,
+        signature TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS params (
+        directory TEXT NOT NULL REFERENCES runs(directory) ON DELETE CASCADE,
+        key TEXT NOT NULL,
+        value TEXT,
+        PRIMARY KEY (directory, key)
+    );
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        directory TEXT NOT NULL REFERENCES runs(directory) ON DELETE CASCADE,
+        checkpoint INTEGER NOT NULL,
+        file_name TEXT NOT NULL,
+        PRIMARY KEY (directory, checkpoint)
+    );
+    CREATE INDEX IF NOT EXISTS params_by_key_value ON params (key, value);
+'''
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def parse_filters(specs):
+    """
+        Parses parameter filters given as strings <field>=<value>, e.g. 'learning_rate=0.0005' or 'net_arch=[150,150]'.
+        Values are read as json if possible (numbers, lists, true/false, ...), as plain strings otherwise.
+    :param specs: List of filter specifications.
+    :return: Dictionary; key = field, val = value
+    """
+    filters = dict()
+    for spec in specs or []:
+        if '=' not in spec:
+            raise ValueError('Invalid filter (expected <field>=<value>): ' + spec)
+        key, value = spec.split('=', 1)
+        try:
+            filters[key] = json.loads(value)
+        except ValueError:
+            filters[key] = value
+    return filters
+
+
+def normalise_value(value):
+    """
+        Normalises a parameter value for comparisons: numbers holding an integer (e.g. 1e6 or 1000000.0) become ints,
+        so that they equal the same number written differently; lists and dictionaries get normalised element-wise.
+    :param value: Json-compatible value.
+    :return: Normalised value
+    """
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        return [normalise_value(element) for element in value]
+    if isinstance(value, dict):
+        return {key: normalise_value(element) for key, element in value.items()}
+    return value
+
+
+def _comparable(value):
+    # Json string of the normalised value, as stored in the index; unlike comparing the values themselves, keeps true
+    # and 1 apart
+    return json.dumps(normalise_value(value), sort_keys=True)
+
+
+def group_id(group_by, values):
+    """
+        Id of a group of runs sharing the given values of the given fields. Grouped by a single field holding strings
+        (e.g. provided_params_file), the id is the value itself; otherwise, it lists <field>=<json-value> per field.
+    :param group_by: List of fields.
+    :param values: List of the group's values of these fields.
+    :return: String
+    """
+    if len(group_by) == 1 and isinstance(values[0], str):
+        return values[0]
+    return '__'.join(key + '=' + json.dumps(value, separators=(',', ':')) for key, value in zip(group_by, values))
+
+
+def count_training_log_rows(log_path):
+    """
+        Number of data rows (header excluded) logged to a training_eval.csv file.
+    :param log_path: Path to the file.
+    :return: Number of rows; None if the file does not exist.
+    """
+    try:
+        with open(log_path, 'rb') as f:
+            return max(sum(1 for line in f if line.strip()) - 1, 0)
+    except FileNotFoundError:
+        return None
+
+
+class RunCatalog(object):
+    """
+        SQLite-backed index over the training runs inside a given results folder.
+    """
+
+    def __init__(self, path, catalog_path=None, refresh=True):
+        """
+        :param path: Path to the folder containing the runs' folders (e.g. '../Results/PPO2/').
+        :param catalog_path: Path to the SQLite file. Defaults to run_catalog.sqlite inside the parent of path.
+        :param refresh: Whether to bring the catalog up to date right away.
+        """
+        self.path = path
+        if catalog_path is None:
+            catalog_path = os.path.join(os.path.dirname(os.path.normpath(path)), CATALOG_FILE_NAME)
+        self.catalog_path = catalog_path
+        self.connection = sqlite3.connect(catalog_path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != CATALOG_VERSION:
+            with self.connection:
+                self.connection.execute('DELETE FROM runs')  # Params and checkpoints get deleted along with the runs
+                self.connection.execute('PRAGMA user_version = ' + str(CATALOG_VERSION))
+        if refresh:
+            self.refresh()
+
+    def close(self):
+        self.connection.close()
+
+    def _run_signature(self, run_dir):
+        # A folder's mtime changes whenever files get added to or removed from it (e.g. new checkpoints)
+        return json.dumps([_mtime_ns(run_dir),
+                           _mtime_ns(os.path.join(run_dir, 'params.json')),
+                           _mtime_ns(os.path.join(run_dir, 'training_eval.csv'))])
+
+    def _index_run(self, directory, run_dir, signature, training_eval_rows=None):
+        file_names = [entry.name for entry in os.scandir(run_dir) if entry.is_file()]
+
+        try:
+            with open(os.path.join(run_dir, 'params.json')) as json_file:
+                params = json.load(json_file)
+        except (IOError, ValueError):
+            params = {}
+
+        checkpoints = []
+        for file_name in file_names:
+            if file_name.startswith('checkpoint_') and file_name.endswith('.zip'):
+                try:
+                    checkpoints.append((int(file_name[len('checkpoint_'):-len('.zip')]), file_name))
+                except ValueError:
+                    pass  # Not following the naming scheme checkpoint_<update-nr>.zip
+
+        if training_eval_rows is None:
+            training_eval_rows = count_training_log_rows(os.path.join(run_dir, 'training_eval.csv'))
+
+        cursor = self.connection.cursor()
+        cursor.execute('DELETE FROM runs WHERE directory = ?', (directory,))
+        cursor.execute('INSERT INTO runs (directory, model_id, complete, training_eval_rows, signature) '
+                       'VALUES (?, ?, ?, ?, ?)',
+                       (directory, params.get('model_id', directory), int('final_model.zip' in file_names),
+                        training_eval_rows, signature))
+        cursor.executemany('INSERT INTO params (directory, key, value) VALUES (?, ?, ?)',
+                           [(directory, key, _comparable(value)) for key, value in params.items()])
+        cursor.executemany('INSERT INTO checkpoints (directory, checkpoint, file_name) VALUES (?, ?, ?)',
+                           [(directory, nr, file_name) for nr, file_name in checkpoints])
+
+    def refresh(self, row_counts=None):
+        """
+            Brings the catalog up to date with the results folder. Runs are only re-read if their folder, params.json
+            or training_eval.csv changed since they were indexed last; runs no longer present get dropped.
+        :param row_counts: Optional dictionary; key = run folder, val = number of rows of its training_eval.csv known
+                           to the caller (e.g. read incrementally by a TrainingLogReader). The logs of these runs do
+                           not get re-read for counting their rows.
+        :return: Tuple (number of (re-)indexed runs, number of dropped runs)
+        """
+        row_counts = row_counts or dict()
+        known = dict(self.connection.execute('SELECT directory, signature FROM runs'))
+        present = set()
+        indexed = 0
+
+        with self.connection:
+            for entry in os.scandir(self.path):
+                if not entry.is_dir():
+                    continue
+                present.add(entry.name)
+                signature = self._run_signature(entry.path)
+                if known.get(entry.name) != signature:
+                    self._index_run(entry.name, entry.path, signature, row_counts.get(entry.name))
+                    indexed += 1
+
+            dropped = [directory for directory in known if directory not in present]
+            self.connection.executemany('DELETE FROM runs WHERE directory = ?', [(d,) for d in dropped])
+
+        return indexed, len(dropped)
+
+    def get_complete_trials(self):
+        """
+            Determines which runs are complete (due to complete training process), as indicated by the presence of a
+            final model.
+        :return:    dirs: List of run folders containing complete data sets.
+                    list_outtakes: List of run folders containing not completed test runs indicated by absence of final
+                                   model.
+        """
+        dirs, list_outtakes = [], []
+        for directory, complete in self.connection.execute('SELECT directory, complete FROM runs ORDER BY directory'):
+            if complete:
+                dirs.append(directory)
+            else:
+                print('Incomplete data at: ' + directory)
+                list_outtakes.append(directory)
+        return dirs, list_outtakes
+
+    def get_runs(self):
+        """
+        :return: List of all run folders (complete or not), sorted by name
+        """
+        return [directory for directory, in self.connection.execute('SELECT directory FROM runs ORDER BY directory')]
+
+    def get_param(self, directory, key):
+        """
+            Looks up a single field of a run's params.json.
+        :param directory: Run folder.
+        :param key: Name of the field.
+        :return: Value of the field; None if the run's params.json does not contain it.
+        """
+        row = self.connection.execute('SELECT value FROM params WHERE directory = ? AND key = ?',
+                                      (directory, key)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def get_params(self, directory):
+        """
+            Returns the content of a run's params.json as stored in the catalog, i.e. with numbers holding an integer
+            stored as ints (see normalise_value()).
+        :param directory: Run folder.
+        :return: Dictionary of parameters
+        """
+        return {key: json.loads(value) for key, value in
+                self.connection.execute('SELECT key, value FROM params WHERE directory = ?', (directory,))}
+
+    def find_runs(self, filters, directories=None):
+        """
+            Looks up the runs whose params.json holds the given values (via the index over all fields and values).
+            Values are stored and looked up normalised (see normalise_value()), so that e.g. 1e6 matches 1000000.
+        :param filters: Dictionary; key = field, val = value the field must equal (see parse_filters()).
+        :param directories: Optional list of runs to choose from; all runs if None.
+        :return: List of matching run folders, in the order of directories (sorted by name if None)
+        """
+        matches = set(self.get_runs()) if directories is None else set(directories)
+        for key, value in filters.items():
+            matches &= set(directory for directory, in self.connection.execute(
+                'SELECT directory FROM params WHERE key = ? AND value = ?', (key, _comparable(value))))
+        return [directory for directory in (self.get_runs() if directories is None else directories)
+                if directory in matches]
+
+    def get_param_values(self, key, directories=None):
+        """
+        :param key: Name of a params.json field.
+        :param directories: Optional list of runs; all runs if None.
+        :return: Dictionary; key = run folder, val = value of the field (runs lacking the field are left out)
+        """
+        values = {directory: json.loads(value) for directory, value in
+                  self.connection.execute('SELECT directory, value FROM params WHERE key = ?', (key,))}
+        if directories is not None:
+            values = {directory: values[directory] for directory in directories if directory in values}
+        return values
+
+    def group_runs(self, data_directories, group_by=None, filters=None, max_elements=5):
+        """
+            Groups runs by the values of any combination of params.json fields.
+        :param data_directories: Candidate runs to potentially be included, in the order in which they get assigned to
+                                 their groups.
+        :param group_by: List of fields the runs get grouped by (default: DEFAULT_GROUP_BY).
+        :param filters: Optional dictionary of field values the runs must hold (see find_runs()).
+        :param max_elements: Max. number of runs included per group; unlimited if None.
+        :return:    groups: Dictionary; key: group id (see group_id()), val: list of included runs
+                    discarded_data_directories: List of runs not included (not matching the filters, lacking any of the
+                                                fields grouped by, or max_elements exceeded)
+        """
+        group_by = group_by or DEFAULT_GROUP_BY
+        candidates = self.find_runs(filters, data_directories) if filters else list(data_directories)
+        matching = set(candidates)
+        values = [self.get_param_values(key, candidates) for key in group_by]
+
+        groups = dict()
+        discarded_data_directories = [directory for directory in data_directories if directory not in matching]
+        for directory in candidates:
+            if any(field_values.get(directory) is None for field_values in values):
+                discarded_data_directories.append(directory)
+                continue
+            runs = groups.setdefault(group_id(group_by, [field_values[directory] for field_values in values]), [])
+            if max_elements is None or len(runs) < max_elements:
+                runs.append(directory)
+            else:
+                discarded_data_directories.append(directory)
+        return groups, discarded_data_directories
+
+    def get_checkpoints(self, directory):
+        """
+            Lists the checkpoints saved during a run.
+        :param directory: Run folder.
+        :return: List of tuples (update-nr, file name), ordered by update-nr
+        """
+        return list(self.connection.execute('SELECT checkpoint, file_name FROM checkpoints WHERE directory = ? '
+                                            'ORDER BY checkpoint', (directory,)))
+
+    def get_training_eval_rows(self, directory):
+        """
+        :param directory: Run folder.
+        :return: Number of rows logged to the run's training_eval.csv (None if there is none)
+        """
+        row = self.connection.execute('SELECT training_eval_rows FROM runs WHERE directory = ?',
+                                      (directory,)).fetchone()
+        return None if row is None else row[0]
+
+    def remove_redundant_runs(self, data_directories, max_elements=5):
+        """
+            Filter out redundant back-up-test runs which are too many.
+            During training, each train run was called with a given parameter specification provided in a named file.
+            The run's params.json records which parameter specification file was used for generating the respective
+            data set; runs are grouped by it.
+        :param data_directories: Candidate directories to potentially be included in analysis
+        :param max_elements: Max. number of runs included per parameter specification
+        :return:    parameter_specification_ids: Dictionary; key: parameter-specification-id, val: list of included runs
+                    discarded_data_directories: List of runs not included (no parameter-specification-id, or
+                                                max_elements exceeded)
+        """
+        return self.group_runs(data_directories, group_by=DEFAULT_GROUP_BY, max_elements=max_elements)
+
+
+def add_grouping_arguments(parser):
+    """
+        Adds the command line arguments selecting and grouping runs (see RunCatalog.group_runs()) to a parser.
+    :param parser: argparse.ArgumentParser.
+    :return: -
+    """
+    parser.add_argument('--group-by', default=','.join(DEFAULT_GROUP_BY),
+                        help='Comma-separated params.json fields the runs get grouped by (default: '
+                             + ','.join(DEFAULT_GROUP_BY) + ').')
+    parser.add_argument('--where', action='append', default=None, metavar='FIELD=VALUE',
+                        help='Only include runs whose params.json field equals the given (json) value, e.g. '
+                             'learning_rate=0.0005, total_timesteps=1e6 or net_arch=[150,150]; may be given multiple '
+                             'times.')
+    parser.add_argument('--max-runs', type=int, default=5,
+                        help='Max. number of runs included per group; 0 for no limit (default: 5).')
+
+
+def group_runs_from_arguments(catalog, data_directories, args):
+    """
+    :param catalog: RunCatalog.
+    :param data_directories: Candidate runs.
+    :param args: Parsed arguments added by add_grouping_arguments().
+    :return: Result of RunCatalog.group_runs()
+    """
+    return catalog.group_runs(data_directories, group_by=args.group_by.split(','), filters=parse_filters(args.where),
+                              max_elements=args.max_runs or None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the runs by their parameters.')
+    parser.add_argument('--path', default='../Results/PPO2/', help='Folder containing the runs\' folders.')
+    parser.add_argument('--all', action='store_true', help='Include runs lacking final_model.zip.')
+    add_grouping_arguments(parser)
+    args = parser.parse_args()
+
+    catalog = RunCatalog(args.path)
+    directories = catalog.get_runs() if args.all else \
+        [directory for directory, in catalog.connection.execute('SELECT directory FROM runs WHERE complete = 1 '
+                                                                'ORDER BY directory')]
+    groups, discarded = group_runs_from_arguments(catalog, directories, args)
+    for group, runs in groups.items():
+        print(group + ' (' + str(len(runs)) + ' runs):')
+        for run in runs:
+            print('    ' + run)
+    print(str(sum(len(runs) for runs in groups.values())) + ' runs in ' + str(len(groups)) + ' groups; ' +
+          str(len(discarded)) + ' runs not included.')
+    catalog.close()
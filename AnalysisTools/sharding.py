@@ -0,0 +1,173 @@
+import os
+import json
+import glob
+
+'''
+    Splitting the final evaluation into shards, e.g. to be run on different machines sharing a filesystem.
+
+    The test runs of all models to be evaluated get split into work units, each consisting of a block of consecutive
+    test runs of a single model. Work units are assigned to the shards round-robin, in the order in which the models
+    are listed in the grouping of the runs (used_dict), so that each shard's work only depends on the grouping and on
+    the number of shards. Each test run is seeded with a seed derived from the evaluation's seed, the model and the test
+    run's index (see final_evaluation.derive_episode_seed()), so its outcome does not depend on which shard performs it.
+
+    Each shard appends the statistics of its finished work units to its own partial result file
+    (shard_<i>_of_<N>.jsonl). Once all shards are done, the partial result files get merged (see load_shards()), and
+    the statistics get computed exactly as a single evaluation using the same seed would compute them.
+'''
+
+DEFAULT_SHARD_DIR = '../FinalEvaluation/Shards/'
+
+
+def parse_shard(shard):
+    """
+        Parses a shard specification of the form 'i/N', i.e. shard i out of N shards (i = 0, ..., N-1).
+    :param shard: Shard specification.
+    :return: Tuple (i, N)
+    """
+    try:
+        index, num_shards = (int(part) for part in shard.split('/'))
+    except ValueError:
+        raise ValueError('Invalid shard specification (expected i/N): ' + shard)
+    if not 0 <= index < num_shards:
+        raise ValueError('Invalid shard specification (expected 0 <= i < N): ' + shard)
+    return index, num_shards
+
+
+def list_work_units(used_dict, num_test_runs, block_size):
+    """
+        Splits the test runs of all models into work units.
+    :param used_dict: Dictionary: key = parameter-specification-id, val = list of models' folders
+    :param num_test_runs: Number of test runs per model.
+    :param block_size: Max. number of test runs per work unit.
+    :return: List of work units (model folder, index of the first test run, number of test runs)
+    """
+    return [(model_folder, first_episode, min(block_size, num_test_runs - first_episode))
+            for model_folders in used_dict.values()
+            for model_folder in model_folders
+            for first_episode in range(0, num_test_runs, block_size)]
+
+
+def assign_work_units(work_units, index, num_shards):
+    """
+    :param work_units: List of work units as returned by list_work_units().
+    :param index: Index i of the shard.
+    :param num_shards: Number N of shards.
+    :return: Work units to be performed by shard i
+    """
+    return work_units[index::num_shards]
+
+
+class ShardFile(object):
+    """
+        Append-only partial result file of a single shard.
+    """
+
+    def __init__(self, directory, index, num_shards):
+        """
+        :param directory: Folder holding the partial result files of all shards.
+        :param index: Index i of the shard.
+        :param num_shards: Number N of shards.
+        """
+        self.path = os.path.join(directory, 'shard_{}_of_{}.jsonl'.format(index, num_shards))
+        self.index = index
+        self.num_shards = num_shards
+
+    def load(self):
+        """
+        :return:    settings: Settings recorded by start() (None if there are none)
+                    completed_units: Dictionary; key = (model folder, index of first test run), val = list of
+                                     [score, mean time, std time] per test run of the work unit
+        """
+        return _read_shard_file(self.path)
+
+    def start(self, settings, resume=False):
+        """
+            Starts (or, if resume is set and the file was started using the same settings, continues) the shard's file.
+        :param settings: Json-serializable dictionary of settings affecting the evaluation's results.
+        :param resume: Whether to keep the work units completed before.
+        :return: Dictionary of the completed work units (see load())
+        """
+        if resume and os.path.exists(self.path):
+            recorded_settings, completed_units = self.load()
+            if recorded_settings == settings:
+                return completed_units
+            print('Shard file was recorded using different settings, starting from scratch: ' + self.path)
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w') as f:
+            f.write(json.dumps({'type': 'start', 'shard': self.index, 'num_shards': self.num_shards,
+                                'settings': settings}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        return dict()
+
+    def record_unit(self, work_unit, statistics):
+        """
+            Appends the statistics of a finished work unit and syncs the file to disk.
+        :param work_unit: Work unit as listed by list_work_units().
+        :param statistics: List of [score, mean time, std time] per test run of the work unit.
+        :return: -
+        """
+        model_folder, first_episode, _ = work_unit
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'type': 'unit', 'model': model_folder, 'first_episode': first_episode,
+                                'statistics': [[float(s) for s in episode] for episode in statistics]}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _read_shard_file(path):
+    settings, completed_units = None, dict()
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Incomplete line of an interrupted shard
+            if record['type'] == 'start':
+                settings = record['settings']
+            elif record['type'] == 'unit':
+                completed_units[(record['model'], record['first_episode'])] = record['statistics']
+    return settings, completed_units
+
+
+def load_shards(directory):
+    """
+        Merges the partial result files of all shards of an evaluation. Raises a ValueError if shards are missing or
+        incomplete, or if they were run using different settings.
+    :param directory: Folder holding the partial result files.
+    :return:    settings: Settings all shards were run with
+                episodes: Dictionary; key = model folder, val = list of [score, mean time, std time] of all test runs of
+                          the model, in order of the test runs
+    """
+    shard_files = glob.glob(os.path.join(directory, 'shard_*_of_*.jsonl'))
+    if not shard_files:
+        raise ValueError('No shard files found in ' + directory)
+
+    num_shards = set(int(os.path.basename(path)[:-len('.jsonl')].split('_')[-1]) for path in shard_files)
+    if len(num_shards) != 1:
+        raise ValueError('Shard files of evaluations using different numbers of shards found in ' + directory)
+    num_shards = num_shards.pop()
+
+    settings, completed_units = None, dict()
+    for index in range(num_shards):
+        path = ShardFile(directory, index, num_shards).path
+        if not os.path.exists(path):
+            raise ValueError('Missing shard ' + str(index) + '/' + str(num_shards) + ': ' + path)
+        shard_settings, shard_units = _read_shard_file(path)
+        if settings is None:
+            settings = shard_settings
+        elif shard_settings != settings:
+            raise ValueError('Shard ' + str(index) + '/' + str(num_shards) + ' was run using different settings.')
+        completed_units.update(shard_units)
+
+    episodes = dict()
+    work_units = list_work_units(settings['used_dict'], settings['num_test_runs'], settings['block_size'])
+    for model_folder, first_episode, num_episodes in work_units:
+        statistics = completed_units.get((model_folder, first_episode))
+        if statistics is None or len(statistics) != num_episodes:
+            raise ValueError('Incomplete shards: test runs ' + str(first_episode) + ' to ' +
+                             str(first_episode + num_episodes - 1) + ' of ' + model_folder + ' are missing.')
+        episodes.setdefault(model_folder, []).extend(statistics)
+    return settings, episodes
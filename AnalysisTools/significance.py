@@ -0,0 +1,120 @@
+import numpy as np
+
+'''
+    Vectorized permutation tests between all pairs of groups (e.g. the runs of different parameter settings) and
+    corrections of the resulting p-values for multiple comparisons.
+
+    A permutation test for the difference in means of two groups pools their values, repeatedly re-assigns the pooled
+    values to two groups of the original sizes at random, and counts how often the difference in means of such a random
+    assignment is at least as large (in absolute value) as the observed one. Here, the random assignments of all pairs
+    get drawn at once: random keys of shape (pairs, permutations, pooled values) are argsorted, so that the first n_a
+    positions of each sorted row form the first group. Since the pooled sum is fixed, the difference in means of each
+    assignment only depends on the sum of its first group. Permutations are processed in chunks, so that memory usage
+    stays bounded.
+'''
+
+DEFAULT_NUM_PERMUTATIONS = 10000
+
+CORRECTIONS = ['holm', 'bonferroni', 'bh', 'none']
+
+# Max. number of elements held per intermediate array
+CHUNK_ELEMENTS = 1 << 22
+
+
+def pairwise_permutation_tests(values, num_permutations=DEFAULT_NUM_PERMUTATIONS, seed=0):
+    """
+        Two-sided permutation tests of the difference in means between every pair of groups.
+    :param values: Numpy array of shape (groups, max. values per group); NaN where a group lacks values.
+    :param num_permutations: Number of random permutations per pair.
+    :param seed: Seed making the permutations reproducible.
+    :return: Dictionary holding Numpy arrays of shape (groups, groups):
+                differences: Mean of the row's group minus mean of the column's group
+                p_values: p-value of the test of the row's against the column's group; NaN on the diagonal and where a
+                          group has no values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    num_groups = len(values)
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=1)
+    # Values of each group moved to its first counts[group] slots
+    order = np.argsort(~valid, axis=1, kind='stable')
+    values = np.where(np.take_along_axis(valid, order, axis=1), np.take_along_axis(values, order, axis=1), 0.)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = values.sum(axis=1) / counts
+
+    first, second = np.triu_indices(num_groups, 1)
+    first, second = first[counts[first] * counts[second] > 0], second[counts[first] * counts[second] > 0]
+    size_a, size_b = counts[first], counts[second]
+    # Pooled values per pair: the first group's values, followed by the second group's values
+    max_size = values.shape[1]
+    pooled = np.concatenate([values[first], values[second]], axis=1)
+    slots = np.arange(2 * max_size)
+    pooled_valid = np.concatenate([slots[:max_size] < size_a[:, None], slots[:max_size] < size_b[:, None]], axis=1)
+    totals = pooled.sum(axis=1)
+    observed = np.abs(means[first] - means[second])
+    tolerance = 1e-12 * np.maximum(1., observed)
+
+    rng = np.random.RandomState(seed)
+    exceeding = np.zeros(len(first), dtype=int)
+    chunk = max(1, CHUNK_ELEMENTS // max(1, pooled.size))
+    for start in range(0, num_permutations, chunk):
+        size = min(chunk, num_permutations - start)
+        # Random keys; padding slots sorted last, so that the first size_a slots of each row form the first group
+        keys = rng.random_sample((len(first), size, 2 * max_size))
+        keys[~np.broadcast_to(pooled_valid[:, None, :], keys.shape)] = np.inf
+        permuted = np.take_along_axis(np.broadcast_to(pooled[:, None, :], keys.shape), np.argsort(keys, axis=-1),
+                                      axis=-1)
+        sums_a = np.where(slots < size_a[:, None, None], permuted, 0.).sum(axis=-1)
+        differences = sums_a / size_a[:, None] - (totals[:, None] - sums_a) / size_b[:, None]
+        exceeding += (np.abs(differences) >= (observed - tolerance)[:, None]).sum(axis=1)
+
+    p_values = np.full((num_groups, num_groups), np.nan)
+    p_values[first, second] = p_values[second, first] = (exceeding + 1.) / (num_permutations + 1.)
+    return {'differences': means[:, None] - means[None, :], 'p_values': p_values}
+
+
+def adjust_p_values(p_values, method='holm'):
+    """
+        Corrects p-values for multiple comparisons. NaN p-values are ignored (and not counted as comparisons).
+    :param p_values: Numpy array of p-values.
+    :param method: 'holm' (Holm-Bonferroni, controls the family-wise error rate), 'bonferroni', 'bh'
+                   (Benjamini-Hochberg, controls the false discovery rate) or 'none'.
+    :return: Numpy array of the adjusted p-values, shaped like p_values
+    """
+    if method not in CORRECTIONS:
+        raise ValueError('Unknown correction: ' + method)
+    p_values = np.asarray(p_values, dtype=np.float64)
+    adjusted = np.full(p_values.shape, np.nan)
+    valid = ~np.isnan(p_values)
+    p = p_values[valid]
+    num_tests = len(p)
+    order = np.argsort(p, kind='stable')
+    ranked = p[order]
+
+    if method == 'none':
+        ranked_adjusted = ranked
+    elif method == 'bonferroni':
+        ranked_adjusted = ranked * num_tests
+    elif method == 'holm':
+        ranked_adjusted = np.maximum.accumulate(ranked * (num_tests - np.arange(num_tests)))
+    else:
+        ranked_adjusted = np.minimum.accumulate((ranked * num_tests / np.arange(1, num_tests + 1))[::-1])[::-1]
+
+    result = np.empty(num_tests)
+    result[order] = np.minimum(ranked_adjusted, 1.)
+    adjusted[valid] = result
+    return adjusted
+
+
+def adjust_pairwise_p_values(p_values, method='holm'):
+    """
+        Corrects the p-values of a symmetric matrix as returned by pairwise_permutation_tests(), counting each pair
+        once.
+    :param p_values: Numpy array of shape (groups, groups).
+    :param method: See adjust_p_values().
+    :return: Numpy array of shape (groups, groups) holding the adjusted p-values
+    """
+    first, second = np.triu_indices(len(p_values), 1)
+    adjusted = np.full(p_values.shape, np.nan)
+    adjusted[first, second] = adjusted[second, first] = adjust_p_values(p_values[first, second], method)
+    return adjusted
@@ -0,0 +1,4 @@
+import os, sys
+
+# The analysis scripts are run from (and import each other as flat modules inside) AnalysisTools/
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
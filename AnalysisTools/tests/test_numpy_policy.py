@@ -0,0 +1,38 @@
+import os
+import numpy as np
+import pytest
+
+from numpy_policy import (NumpyMlpPolicy, check_reference, check_parity, numpy_outputs, PARITY_OUTPUTS,
+                          PARITY_TOLERANCE, REFERENCE_MODEL, REFERENCE_SUFFIX)
+
+'''
+    Parity of the NumPy inference (numpy_policy.py) with stable-baselines' PPO2 on a committed model: against the PPO2
+    outputs stored next to it (recorded using python numpy_policy.py --record), and live if stable-baselines is
+    installed.
+'''
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), '..', REFERENCE_MODEL)
+
+
+def test_parity_with_stored_reference():
+    if not os.path.exists(MODEL_PATH + REFERENCE_SUFFIX):
+        pytest.skip('No PPO2 reference outputs recorded for ' + REFERENCE_MODEL + ' yet; record them using '
+                    'python numpy_policy.py --record ' + REFERENCE_MODEL + ' (requires stable-baselines).')
+    deviations = check_reference(MODEL_PATH)
+    assert max(deviations.values()) < PARITY_TOLERANCE, deviations
+
+
+def test_reference_not_computed_by_ppo2_is_refused(tmp_path):
+    obs = np.random.RandomState(0).uniform(-1., 1., (10, NumpyMlpPolicy.load(MODEL_PATH).obs_dim)).astype(np.float32)
+    outputs = numpy_outputs(NumpyMlpPolicy.load(MODEL_PATH), obs)
+    reference_path = str(tmp_path / 'reference.npz')
+    np.savez(reference_path, observations=obs, backend=np.array('numpy'),
+             **{name: outputs[name] for name in PARITY_OUTPUTS})
+    with pytest.raises(ValueError):
+        check_reference(MODEL_PATH, reference_path)
+
+
+def test_live_parity_with_ppo2():
+    pytest.importorskip('stable_baselines')
+    deviations = check_parity(MODEL_PATH)
+    assert max(deviations.values()) < PARITY_TOLERANCE, deviations
@@ -0,0 +1,228 @@
+import warnings
+from collections import OrderedDict
+import numpy as np
+
+from training_log import load_training_log, TrainingLogReader, TRAINING_LOG_COLUMNS
+from run_catalog import count_training_log_rows
+
+'''
+    Aggregation of the training logs (training_eval.csv) of all selected runs in a single vectorized pass.
+    All logs get loaded into one float tensor of shape (parameter setting, run, logged period, metric), where the
+    metrics are the columns of TRAINING_LOG_COLUMNS. Parameter settings with fewer runs than others, as well as runs
+    with fewer logged periods than others, are padded with NaN, so that the padding is ignored by all (NaN-aware)
+    statistics computed over the tensor.
+
+    For logs too long (or too many) to be held in memory at once, stream_training_statistics() reads the logs chunk by
+    chunk of logged periods instead and keeps running (Welford) statistics over the runs, so that its memory usage
+    depends on the chunk size, but not on the length of the logs.
+
+    IncrementalTrainingStatistics keeps the same running statistics for the logs of runs still training, only adding
+    the rows appended to each log since its last update.
+'''
+
+UPDATE_NR = TRAINING_LOG_COLUMNS.index('Update_nr')
+GRASPS = TRAINING_LOG_COLUMNS.index('Grasps')
+AVG_GRASP_TIME = TRAINING_LOG_COLUMNS.index('Avg_grasp_time_steps')
+STD_GRASP_TIME = TRAINING_LOG_COLUMNS.index('Std_grasp_time_steps')
+
+# Metrics aggregated by stream_training_statistics()
+STREAMED_METRICS = [GRASPS, AVG_GRASP_TIME, STD_GRASP_TIME]
+
+
+def load_training_tensor(path, params, load=load_training_log):
+    """
+        Loads the training logs of all given runs into a single tensor.
+    :param path: Path to the folder containing the runs' folders.
+    :param params: Dictionary; key: parameter-setting-id, val: list of runs trained on the respective parameter setting.
+    :param load: Function returning the content of a training log as float array (see training_log.py).
+    :return:    tensor: Numpy array (float64) of shape (len(params), max. runs per setting, max. logged periods,
+                        len(TRAINING_LOG_COLUMNS)); NaN-padded
+                run_counts: Numpy array holding the number of runs per parameter setting
+    """
+    logs = [[load(path + file_name + '/training_eval.csv') for file_name in file_names]
+            for file_names in params.values()]
+    run_counts = np.array([len(runs) for runs in logs], dtype=int)
+    num_rows = max([len(log) for runs in logs for log in runs] or [0])
+
+    tensor = np.full((len(logs), max(run_counts, default=0), num_rows, len(TRAINING_LOG_COLUMNS)), np.nan)
+    for setting_idx, runs in enumerate(logs):
+        for run_idx, log in enumerate(runs):
+            tensor[setting_idx, run_idx, :len(log), :] = log
+    return tensor, run_counts
+
+
+def aggregate_training_tensor(tensor):
+    """
+        Computes all statistics over the runs of each parameter setting at once.
+    :param tensor: Tensor as returned by load_training_tensor().
+    :return: Dictionary holding Numpy arrays:
+                update_nrs: Update-nr of each logged period, shape (logged periods,)
+                means: Mean over the runs per setting, logged period and metric, shape (settings, periods, metrics)
+                stds: Corresponding std over the runs, shape (settings, periods, metrics)
+             E.g. means[..., AVG_GRASP_TIME] is the mean over the runs' mean grasp times and means[..., STD_GRASP_TIME]
+             the mean over the runs' stds of the grasp times.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)  # All-NaN slices, e.g. periods without grasps
+        update_nrs = np.nanmax(tensor[..., UPDATE_NR], axis=(0, 1)) if tensor.size else np.zeros(0)
+        means = np.nanmean(tensor, axis=1)
+        stds = np.nanstd(tensor, axis=1)
+    return {'update_nrs': update_nrs, 'means': means, 'stds': stds}
+
+
+class RunningStatistics(object):
+    """
+        Element-wise running count, mean and variance (Welford's algorithm) over a sequence of equally shaped arrays.
+        NaN entries are skipped, so that the results match np.nanmean() and np.nanstd() (ddof=0) up to rounding.
+    """
+
+    def __init__(self, shape):
+        self.count = np.zeros(shape)
+        self._mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)  # Sum of squared deviations from the mean
+
+    def add(self, values, start=0):
+        """
+        :param values: Numpy array of the accumulators' shape, or of the shape of the accumulators' rows start to
+                       start + len(values) (first axis).
+        :param start: Index of the first row (first axis) values get added to.
+        :return: -
+        """
+        rows = slice(start, start + len(values))
+        valid = ~np.isnan(values)
+        self.count[rows] += valid
+        delta = np.where(valid, values - self._mean[rows], 0.)
+        self._mean[rows] += delta / np.maximum(self.count[rows], 1)
+        self._m2[rows] += np.where(valid, delta * (values - self._mean[rows]), 0.)
+
+    def grow(self, num_rows):
+        """
+            Extends the accumulators along the first axis to (at least) num_rows rows, holding no values yet.
+        :param num_rows: Number of rows.
+        :return: -
+        """
+        missing = num_rows - len(self.count)
+        if missing > 0:
+            padding = [(0, missing)] + [(0, 0)] * (self.count.ndim - 1)
+            self.count, self._mean, self._m2 = (np.pad(array, padding) for array in (self.count, self._mean, self._m2))
+
+    def mean(self):
+        """
+        :return: Element-wise mean; NaN where no (non-NaN) value has been added
+        """
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    def std(self):
+        """
+        :return: Element-wise standard deviation (ddof=0); NaN where no (non-NaN) value has been added
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, np.sqrt(self._m2 / self.count), np.nan)
+
+
+def stream_training_statistics(path, params, chunk_rows=1000):
+    """
+        Aggregates the training logs of all given runs chunk by chunk of logged periods. For each chunk of (at most)
+        chunk_rows logged periods, the chunks of the logs of all runs of one parameter setting are read at a time and
+        their statistics get accumulated over the runs. Runs with fewer logged periods than others are padded with NaN.
+    :param path: Path to the folder containing the runs' folders.
+    :param params: Dictionary; key: parameter-setting-id, val: list of runs trained on the respective parameter setting.
+    :param chunk_rows: Number of logged periods per chunk.
+    :return: Generator yielding, chunk by chunk and within each chunk setting by setting (in order of params), tuples
+             (first row of the chunk, index of the setting, update_nrs, run_values, statistics):
+                update_nrs: Update-nr per logged period of the chunk, shape (chunk length,)
+                run_values: STREAMED_METRICS of each run, shape (runs, chunk length, len(STREAMED_METRICS))
+                statistics: RunningStatistics over the runs of shape (chunk length, len(STREAMED_METRICS))
+    """
+    readers = [[TrainingLogReader(path + file_name + '/training_eval.csv') for file_name in file_names]
+               for file_names in params.values()]
+    num_rows = max([count_training_log_rows(reader.log_path) or 0 for runs in readers for reader in runs] or [0])
+
+    for chunk_start in range(0, num_rows, chunk_rows):
+        chunk_length = min(chunk_rows, num_rows - chunk_start)
+        for setting_idx, runs in enumerate(readers):
+            statistics = RunningStatistics((chunk_length, len(STREAMED_METRICS)))
+            run_values = np.full((len(runs), chunk_length, len(STREAMED_METRICS)), np.nan)
+            update_nrs = np.full(chunk_length, np.nan)
+            for run_idx, reader in enumerate(runs):
+                chunk = reader.read(chunk_length)
+                run_values[run_idx, :len(chunk)] = chunk[:, STREAMED_METRICS]
+                update_nrs[:len(chunk)] = np.fmax(update_nrs[:len(chunk)], chunk[:, UPDATE_NR])
+                statistics.add(run_values[run_idx])
+            yield chunk_start, setting_idx, update_nrs, run_values, statistics
+
+
+class IncrementalTrainingStatistics(object):
+    """
+        Running statistics (STREAMED_METRICS) over the runs of each parameter setting per logged period, for logs that
+        may still grow. Each update() only reads and adds the rows appended to the logs since the previous update.
+    """
+
+    def __init__(self, chunk_rows=1000):
+        """
+        :param chunk_rows: Max. number of rows read from a log at a time.
+        """
+        self.chunk_rows = chunk_rows
+        self.runs = OrderedDict()        # parameter-setting-id -> list of runs
+        self.readers = dict()            # run -> TrainingLogReader
+        self.rows_read = dict()          # run -> number of rows added so far
+        self.statistics = OrderedDict()  # parameter-setting-id -> RunningStatistics of shape (rows, metrics)
+        self.update_nrs = np.zeros(0)    # Update-nr per logged period (max. over all runs)
+
+    def add_run(self, setting_id, run, log_path):
+        """
+            Starts tracking a run; its rows get added by the next update().
+        :param setting_id: Parameter-setting-id the run was trained on.
+        :param run: Run folder.
+        :param log_path: Path to the run's training_eval.csv.
+        :return: -
+        """
+        if setting_id not in self.runs:
+            self.runs[setting_id] = []
+            self.statistics[setting_id] = RunningStatistics((0, len(STREAMED_METRICS)))
+        self.runs[setting_id].append(run)
+        self.readers[run] = TrainingLogReader(log_path)
+        self.rows_read[run] = 0
+
+    def update(self):
+        """
+            Adds all complete rows appended to the logs of all tracked runs since the last update.
+        :return: Number of rows added
+        """
+        added = 0
+        for setting_id, runs in self.runs.items():
+            for run in runs:
+                while True:
+                    try:
+                        chunk = self.readers[run].read(self.chunk_rows, complete_lines_only=True)
+                    except FileNotFoundError:
+                        break  # Nothing logged yet
+                    if not len(chunk):
+                        break
+                    start = self.rows_read[run]
+                    end = start + len(chunk)
+                    self.statistics[setting_id].grow(end)
+                    self.statistics[setting_id].add(chunk[:, STREAMED_METRICS], start)
+                    if end > len(self.update_nrs):
+                        self.update_nrs = np.pad(self.update_nrs, (0, end - len(self.update_nrs)),
+                                                 constant_values=np.nan)
+                    self.update_nrs[start:end] = np.fmax(self.update_nrs[start:end], chunk[:, UPDATE_NR])
+                    self.rows_read[run] = end
+                    added += len(chunk)
+        return added
+
+    def summaries(self):
+        """
+        :return:    update_nrs: Update-nr per logged period, shape (logged periods,)
+                    means: Mean over the runs per setting, logged period and metric, shape (settings, periods, metrics)
+                    stds: Corresponding std over the runs, shape (settings, periods, metrics)
+                    Metrics as listed by STREAMED_METRICS; NaN where no run of a setting logged the period (yet).
+        """
+        num_rows = len(self.update_nrs)
+        means = np.full((len(self.statistics), num_rows, len(STREAMED_METRICS)), np.nan)
+        stds = np.full(means.shape, np.nan)
+        for setting_idx, statistics in enumerate(self.statistics.values()):
+            rows = len(statistics.count)
+            means[setting_idx, :rows] = statistics.mean()
+            stds[setting_idx, :rows] = statistics.std()
+        return self.update_nrs, means, stds
@@ -1,7 +1,14 @@
-import os, sys
+import os, sys, time
 import json, csv
+import argparse
 import numpy as np
 from array import array
+from training_aggregation import load_training_tensor, aggregate_training_tensor, stream_training_statistics, \
+    IncrementalTrainingStatistics, GRASPS, AVG_GRASP_TIME, STD_GRASP_TIME, STREAMED_METRICS
+from run_catalog import RunCatalog, add_grouping_arguments, group_runs_from_arguments, parse_filters
+from profiling import PhaseCounters
+from typed_output import save_table, convert_csv
+from bootstrap import resample_counts, bootstrap_run_statistics, DEFAULT_NUM_RESAMPLES
 
 def create_dir(direct):
     """
@@ -18,90 +25,14 @@ PATH_READ = '../Results/PPO2/'
 PATH_WRITE = "../TrainingProgressEvaluation/"
 print(PATH_READ)
 
+# Counters of the time spent loading, aggregating and writing data; only measuring if enabled via --profile
+counters = PhaseCounters(enabled=False)
 
-def get_complete_trials(path):
-    """
-        Takes a path and checks which of the folders/archives inside given folder (specified by path) contain a
-        final model generated during the training progress, and hence determines which data sets in terms of archives
-        are complete (due to complete training process).
-    :param path: Path to archive(s)-location
-    :return:    dirs: List of directories/archives only containing those with complete data sets.
-                list_outtakes: List of data directories/archives containing not completed test runs indicated by
-                               absence of final model.
-    """
-    dirs = os.listdir(path)
-    list_outtakes = []
-    print('All dirs:')
-    print(dirs)
-    print()
-
-    for direct in dirs:
-        f = []
-        for (dirpath, dirnames, filenames) in os.walk(path+direct):
-            f.extend(filenames)
-            break
-        if 'final_model.zip' in f:
-            # print('DATA SET COMPLETE')
-            pass
-        else:
-            print('Incomplete data at: ' + direct)
-            list_outtakes.append(direct)
-            dirs.remove(direct)
-
-    return dirs, list_outtakes
-
-def return_parameter_specification_id_for_file(file_name):
-    """
-        Given a folder name of a folder containing data created during model's training, the method returns which
-        parameter specification file was used to specify the parameters as a function of which the agent's training
-        proceeded.
-    :param file_name: Folder containing data created during training.
-    :return: -
-    """
-    with open(file_name) as json_file:
-        data = json.load(json_file)
-    try:
-        # Data might not contain requested element
-        return data['provided_params_file']
-    except KeyError:
-        return None
-
-def remove_redundant_runs(path, data_directories):
-    """
-        Filter out redundant back-up-test runs which are too many.
-        :param path: Path to directories potentially to be included
-        :param data_directories: Candidate directories to potentially be included in analysis
-        :return:
-            During training, each train run was called with a given parameter specification provided in a named file.
-            This function reads out from the data created during training which parameter specification file was
-            used for generating the respective data set specified by a given data_directory.
-    """
-    parameter_specification_ids = dict()
-    discarded_data_directories = []
-    maxElements = 5
-    #print('Potential data directories: ')
-    #print(data_directories)
-    for directory in data_directories:
-        #print('To be checked: ' + path+directory+'/params.json')
-        parameter_specification_id = return_parameter_specification_id_for_file(path+directory+'/params.json')
-        if parameter_specification_id is not None:
-            if parameter_specification_id not in parameter_specification_ids.keys():
-                id_list = [directory]
-                parameter_specification_ids[parameter_specification_id] = id_list
-            else:
-                prev_records = parameter_specification_ids[parameter_specification_id]
-                if len(prev_records) < maxElements:
-                    prev_records.append(directory)
-                    parameter_specification_ids[parameter_specification_id] = prev_records
-                else:
-                    discarded_data_directories.append(directory)
-        else:
-            discarded_data_directories.append(directory)
-
-    #print(parameter_specification_ids)
-    #print('Filtered: ')
-    #print(discarded_data_directories)
-    return parameter_specification_ids, discarded_data_directories
+# Summaries: file name, metric (column of the training logs) and statistic computed over the runs per setting
+SUMMARIES = [('MeansOverGrasps', GRASPS, 'mean'),
+             ('StdOverGrasps', GRASPS, 'std'),
+             ('MeanOverMeanGraspingTimes', AVG_GRASP_TIME, 'mean'),
+             ('MeanOverStdOfGraspingTimes', STD_GRASP_TIME, 'mean')]
 
 
 def clean_parameter_specification_id_string(param_id):
@@ -124,6 +55,11 @@ def save_which_data_was_used(direct, used_dict, not_used_lists):
                            2. Excluded due to number of data directories to be included per param setting being exceeded
     :return: -
     """
+    with counters.phase('write'):
+        _save_which_data_was_used(direct, used_dict, not_used_lists)
+
+
+def _save_which_data_was_used(direct, used_dict, not_used_lists):
     create_dir(direct)
 
     # Save as csv which data was used (nicer to read)
@@ -166,23 +102,26 @@ def save_which_data_was_used(direct, used_dict, not_used_lists):
     f.close()
 
 
-def save_data_package_to_file(direct, name, data_arr):
+def save_data_package_to_file(direct, name, data_arr, append=False):
     """
         General purpose data saving. Takes either list or Numpy array as input for saving.
     :param direct: Folder where to store emission file
     :param name: Indication how to call resulting file
     :param data_arr: List/Numpy-array containing data (arrays saved row-wise to file)
+    :param append: Whether to append the data to the file instead of overwriting it.
     :return: -
     """
+    with counters.phase('write'):
+        _save_data_package_to_file(direct, name, data_arr, append)
+
+
+def _save_data_package_to_file(direct, name, data_arr, append=False):
     create_dir(direct)
     # Clean name which was itself a directory+name beforehand
-    name = name.replace('ParameterSettings/', '')
-    name = name.replace('.json', '')
-    name = name.replace('.', '_')
-    name = name.replace('/', '_')
+    name = clean_parameter_specification_id_string(name)
 
     # Save as csv
-    with open(direct + "/" + name + ".csv", "w") as f:
+    with open(direct + "/" + name + ".csv", "a" if append else "w") as f:
         w = csv.writer(f, dialect='excel', quoting=csv.QUOTE_NONNUMERIC)
         for row in data_arr:
             w.writerow(row)
@@ -191,7 +130,60 @@ def save_data_package_to_file(direct, name, data_arr):
     f.close()
 
 
-def evaluate_measurements_per_param_specification(path, params):
+def save_table_package_to_file(direct, name, header, table, metadata=None):
+    """
+        Saves a table both as csv file (see save_data_package_to_file()) and as typed binary file (see typed_output.py).
+    :param direct: Folder where to store emission files
+    :param name: Indication how to call resulting files
+    :param header: List of column names
+    :param table: 2-D Numpy array of numbers
+    :param metadata: Optional json-serializable dictionary describing the table (saved to the typed file only)
+    :return: -
+    """
+    save_data_package_to_file(direct, name, _with_header(header, table))
+    with counters.phase('write'):
+        save_table(direct, clean_parameter_specification_id_string(name), header, table, metadata=metadata)
+
+
+def _table_metadata(params, key=None):
+    # Metadata of the typed tables: the parameter setting (and its runs) the table belongs to, or all settings
+    if key is None:
+        return {'parameter_settings': list(params.keys())}
+    return {'parameter_setting': key, 'runs': list(params[key])}
+
+
+def summary_confidence_intervals(values, run_counts, weights, confidence=0.95, metric_index=None):
+    """
+        Bootstrap confidence intervals of all summaries (see bootstrap.py).
+    :param values: Numpy array of shape (settings, runs, logged periods, metrics), e.g. as returned by
+                   training_aggregation.load_training_tensor().
+    :param run_counts: Numpy array holding the number of runs per setting.
+    :param weights: Resamples of the runs of each setting as returned by bootstrap.resample_counts().
+    :param confidence: Confidence level.
+    :param metric_index: Function mapping a column of the training logs to its index along the last axis of values;
+                         identity if None.
+    :return: Dictionary; key = name of the summary (see SUMMARIES), val = tuple (lower, upper) of Numpy arrays of shape
+             (settings, logged periods)
+    """
+    intervals = dict()
+    for metric in (GRASPS, AVG_GRASP_TIME, STD_GRASP_TIME):
+        summaries = [(name, statistic) for name, summary_metric, statistic in SUMMARIES if summary_metric == metric]
+        index = metric if metric_index is None else metric_index(metric)
+        metric_intervals = bootstrap_run_statistics(values[..., index], run_counts, weights=weights,
+                                                    confidence=confidence,
+                                                    statistics=[statistic for _, statistic in summaries])
+        for name, statistic in summaries:
+            intervals[name] = metric_intervals[statistic]
+    return intervals
+
+
+def _interval_metadata(params, num_resamples, confidence):
+    # Metadata of the typed tables holding confidence intervals
+    return dict(_table_metadata(params), bootstrap_resamples=num_resamples, confidence=confidence)
+
+
+def evaluate_measurements_per_param_specification(path, params, direct=PATH_WRITE, num_resamples=DEFAULT_NUM_RESAMPLES,
+                                                  confidence=0.95):
     """
         First, over a given number of an agent's weight updates, the number of successful grasps is recorded via the
         callback function. Particularly, after 10 weight updates have been performed, the number of total grasps
@@ -229,189 +221,315 @@ def evaluate_measurements_per_param_specification(path, params):
             deviation per parameter-setting computed over all the respective standard deviations of all models trained
             on a given parameter setting.
 
+        All statistics get computed in a single vectorized pass over one tensor holding the logs of all runs (see
+        training_aggregation.py).
+
+        For each summary, the lower and upper bound of its bootstrap confidence interval (resampling the runs of each
+        parameter setting, see bootstrap.py) get saved to Summary/ConfidenceIntervals/<summary>_lower.csv and
+        <summary>_upper.csv, laid out like the summary itself.
+
     :param path: Path to where saved models are located.
     :param params: Dictionary; Key: parameter-setting-id; Value: list of model names belonging to models trained given a
     certain parameter setting specified by the parameter-setting-id encoded in a list's respective key.
+    :param direct: Folder where to store the emission files.
+    :param num_resamples: Number of bootstrap resamples for the confidence intervals; 0 to skip them.
+    :param confidence: Confidence level of the confidence intervals.
     :return: -
     """
 
 
     print('PARAMS----')
     print(params)
-    rows_assigned = False
-    summary_grasping_means = []     # Mean of number of grasps over 5 test runs per parameter specification
-    summary_grasping_stds = []      # Std of number of grasps over 5 test runs per parameter specification
-    # Average over [mean number of time steps needed for performing a successful grasp action over 10 updates] over 5 test runs per param specification:
-    summary_grasping_time_mean_means = []
-    # Average over [std of time steps needed for performing a successful grasp action over 10 updates] over 5 test runs per param specification:
-    summary_grasping_time_std_means = []
-    header_summary_graspings_m = ['Updates']
-    header_summary_graspings_s = ['Updates']
-    header_summary_grasping_t_m_m = ['Updates']
-    header_summary_grasping_t_s_m = ['Updates']
-
-    for key in params.keys():
-        init = True
-        header_graspings = []
-
-        header_summary_graspings_m.append(key.replace('ParameterSettings/', '').replace('.json', ''))
-        header_summary_graspings_s.append(key.replace('ParameterSettings/', '').replace('.json', ''))
-        header_summary_grasping_t_m_m.append(key.replace('ParameterSettings/', '').replace('.json', ''))
-        header_summary_grasping_t_s_m.append(key.replace('ParameterSettings/', '').replace('.json', ''))
-
-        # Collect data from all files that made use of that param setting defined by the given key
-        for file_name in params[key]:
-            header_graspings.append(file_name)
-            eval_file_name = path + file_name + '/training_eval.csv'
-            with open(eval_file_name, 'r') as dest_f:
-                # Read in a model's 'private' training log file
-                data_iter = csv.reader(dest_f,
-                                       quotechar='"',
-                                       dialect='excel',
-                                       quoting=csv.QUOTE_ALL)
-                data = [data for data in data_iter]     # Concatenate rows...
-            data_array = np.asarray(data)               # ... and transform them to array
-
-            cropped = data_array[1:, :]             # Remove header-row
-            cropped = cropped.astype(np.float)      # By default, floats are read in as strings from file. Convert back.
-
-            # In summary file: first column contains the number of performed weight-updates row-wise...
-            if not rows_assigned:
-                summary_grasping_means = [cropped[:, 0]]
-                summary_grasping_stds = [cropped[:, 0]]
-                summary_grasping_time_mean_means = [cropped[:, 0]]
-                summary_grasping_time_std_means = [cropped[:, 0]]
-                rows_assigned = True
-
-            # From model's 'personal' file: read in the
-            #   - total number of grasps obtained over every 10 weight updates,
-            #   - the mean time needed to get into grasping pose over last 10 weight updates,
-            #   - the std corresponding to the mean time needed to get into grasping pose over last 10 weight updates,
-            # respectively.
-            grasps = cropped[:, 1]   # Grasps achieved by a read-in model over every 10 last weight updates
-            avg_time = cropped[:, 2] # Avg time it took a model over every 10 last weight updates to get into grasp pose
-            std_time = cropped[:, 3] # Std corresponding to mean/average time for every 10 weight updates above.
-
-            if init:
-                combined_measurements_grasps = [grasps]     # Grasp counts combined over all files created given
-                                                            # key's-param-settings
-                combined_measurements_avg = [avg_time]
-                combined_measurements_std = [std_time]
-                init = False
-            else:
-                combined_measurements_grasps.append(grasps)
-                combined_measurements_avg.append(avg_time)
-                combined_measurements_std.append(std_time)
-
-        # Log data collected from all models trained on a given parameter setting specified by key.
-
-        # Analyze data
-        # # Graspings...
-        # combined_grasps_arr contains the total number of grasps obtained for each individual model over every last 10
-        # weight updates (listed row-wise) for all models trained on a given parameter-setting specified by key (listed
-        # column-wise)
-        combined_grasps_arr = np.array(combined_measurements_grasps).transpose()
 
-        try:
-            combined_grasps_mean_arr = np.array([np.nanmean(combined_grasps_arr, axis=1)])  # mean computed row-wise
-        except RuntimeWarning:
-            pass  # Attempt to suppress printing of these warnings
-        combined_grasps_stds_arr = np.array([np.nanstd(combined_grasps_arr, axis=1)])
-
-        header_mean_times_mean = header_graspings.copy()
-        header_mean_times_std = header_graspings.copy()
-        header_graspings.extend(['Mean_over_grasps', 'Std_over_grasps'])
-
-        grasps_total_mean_std = np.append(combined_grasps_arr, combined_grasps_mean_arr.transpose(), axis=1)  # add mean
-        grasps_total_mean_std = np.append(grasps_total_mean_std, combined_grasps_stds_arr.transpose(), axis=1)  #add std
-        header_graspings = np.array(header_graspings)
-        grasps_total_mean_std = np.append([header_graspings], grasps_total_mean_std, axis=0)  # Adding header line
-        # Save summary
-        save_data_package_to_file(PATH_WRITE+"Grasps", key + "_mean_std", grasps_total_mean_std)
+    # Load all training logs into one tensor (setting x run x logged period x metric) and aggregate it in one pass
+    with counters.phase('load'):
+        tensor, run_counts = load_training_tensor(path, params)
+    statistics = aggregate_training_tensor(tensor)
+    update_nrs, means, stds = statistics['update_nrs'], statistics['means'], statistics['stds']
 
-        # # Mean mean grasp times...
-        combined_mean_times_arr = np.array(combined_measurements_avg).transpose()
+    for setting_idx, key in enumerate(params.keys()):
+        runs = list(params[key])
+        # Per model (column-wise) and logged period (row-wise): grasps, mean grasp time and std of grasp time
+        model_columns = tensor[setting_idx, :run_counts[setting_idx]].transpose(1, 0, 2)
 
-        mean_combined_mean_times_arr = np.array([np.nanmean(combined_mean_times_arr, axis=1)])
-
-        grasp_times_total_mean = np.append(combined_mean_times_arr, mean_combined_mean_times_arr.transpose(), axis=1)  # add mean
-
-        header_mean_times_mean.extend(['Mean_over_mean_grasp_times'])
-        header_mean_times_mean = np.array(header_mean_times_mean)
-        grasp_times_mean_total_mean = np.append([header_mean_times_mean], grasp_times_total_mean, axis=0)  # Adding header line
+        # # Graspings...
+        save_table_package_to_file(direct+"Grasps", key + "_mean_std",
+                                   runs + ['Mean_over_grasps', 'Std_over_grasps'],
+                                   np.column_stack([model_columns[..., GRASPS],
+                                                    means[setting_idx, :, GRASPS],
+                                                    stds[setting_idx, :, GRASPS]]),
+                                   _table_metadata(params, key))
 
-        # Save summaries
-        save_data_package_to_file(PATH_WRITE+"MeansOfGraspMeanTimes", key + "_mean", grasp_times_mean_total_mean)
+        # # Mean mean grasp times...
+        save_table_package_to_file(direct+"MeansOfGraspMeanTimes", key + "_mean",
+                                   runs + ['Mean_over_mean_grasp_times'],
+                                   np.column_stack([model_columns[..., AVG_GRASP_TIME],
+                                                    means[setting_idx, :, AVG_GRASP_TIME]]),
+                                   _table_metadata(params, key))
 
         # # Mean std grasp times...
-        combined_std_times_arr = np.array(combined_measurements_std).transpose()
+        save_table_package_to_file(direct+"MeansOfGraspTimeStds", key + "_mean",
+                                   runs + ['Mean_over_std_grasp_times'],
+                                   np.column_stack([model_columns[..., STD_GRASP_TIME],
+                                                    means[setting_idx, :, STD_GRASP_TIME]]),
+                                   _table_metadata(params, key))
 
-        mean_combined_std_times_arr = np.array([np.nanmean(combined_std_times_arr, axis=1)])
-
-        grasp_times_total_std = np.append(combined_std_times_arr, mean_combined_std_times_arr.transpose(),
-                                           axis=1)  # add mean
-
-        header_mean_times_std.extend(['Mean_over_std_grasp_times'])
-        header_mean_times_stds = np.array(header_mean_times_std)
-        grasp_times_stds_total_mean = np.append([header_mean_times_stds], grasp_times_total_std,
-                                                axis=0)  # Adding header line
+    print('*********************SUMMARY*********************')
+    # Summaries: first column contains the number of performed weight-updates row-wise, followed by one column per
+    # parameter setting
+    header_summary = ['Updates'] + [key.replace('ParameterSettings/', '').replace('.json', '') for key in params]
+    for name, metric, statistic in SUMMARIES:
+        summary = np.column_stack([update_nrs, (means if statistic == 'mean' else stds)[..., metric].transpose()])
+        print(np.array(_with_header(header_summary, summary)))
 
         # Save summary
-        save_data_package_to_file(PATH_WRITE+"MeansOfGraspTimeStds", key + "_mean", grasp_times_stds_total_mean)
-
-        summary_grasping_means.append(combined_grasps_mean_arr[0].tolist())
-        summary_grasping_stds.append(combined_grasps_stds_arr[0].tolist())
-        summary_grasping_time_mean_means.append(mean_combined_mean_times_arr[0].tolist())
-        summary_grasping_time_std_means.append(mean_combined_std_times_arr[0].tolist())
+        save_table_package_to_file(direct+"Summary", name, header_summary, summary, _table_metadata(params))
+
+    if num_resamples > 0:
+        with counters.phase('bootstrap'):
+            weights = resample_counts(run_counts, num_resamples, np.random.RandomState(0))
+            intervals = summary_confidence_intervals(tensor, run_counts, weights, confidence)
+        for name, bounds in intervals.items():
+            for bound, values in zip(['lower', 'upper'], bounds):
+                save_table_package_to_file(direct+"Summary/ConfidenceIntervals", name + '_' + bound, header_summary,
+                                           np.column_stack([update_nrs, values.transpose()]),
+                                           _interval_metadata(params, num_resamples, confidence))
+        print('Bootstrap confidence intervals (' + str(num_resamples) + ' resamples) saved to ' + direct +
+              'Summary/ConfidenceIntervals')
 
+    print()
 
-    print('*********************SUMMARY*********************')
-    summary_grasping_means = np.array(summary_grasping_means).transpose()
-    print(header_summary_graspings_m)
-    print(summary_grasping_means)
-    summary_grasping_means = np.append([header_summary_graspings_m], summary_grasping_means, axis=0)
-    print(summary_grasping_means)
 
-    # Save summary
-    save_data_package_to_file(PATH_WRITE+"Summary", "MeansOverGrasps", summary_grasping_means)
+def evaluate_measurements_per_param_specification_streaming(path, params, direct=PATH_WRITE, chunk_rows=1000,
+                                                            num_resamples=DEFAULT_NUM_RESAMPLES, confidence=0.95):
+    """
+        Streaming variant of evaluate_measurements_per_param_specification(), creating the same files. Instead of
+        loading all training logs at once, the logs are read chunk by chunk of chunk_rows logged periods, and the
+        statistics over the runs of each parameter setting are accumulated as running means and variances (see
+        training_aggregation.stream_training_statistics()). The rows of each chunk get appended to the files right
+        away, so that memory usage does not depend on the length of the logs. Results equal those of the non-streaming
+        variant up to floating point rounding.
+    :param path: Path to where saved models are located.
+    :param params: Dictionary; Key: parameter-setting-id; Value: list of model names belonging to models trained given a
+    certain parameter setting specified by the parameter-setting-id encoded in a list's respective key.
+    :param direct: Folder where to store the emission files.
+    :param chunk_rows: Number of logged periods (rows) processed at a time.
+    :param num_resamples: Number of bootstrap resamples for the confidence intervals; 0 to skip them. The runs drawn
+                          per resample are the same as in the non-streaming variant, so are the intervals.
+    :param confidence: Confidence level of the confidence intervals.
+    :return: -
+    """
+    print('PARAMS----')
+    print(params)
 
-    summary_grasping_stds = np.array(summary_grasping_stds).transpose()
-    summary_grasping_stds = np.append([header_summary_graspings_s], summary_grasping_stds, axis=0)
-    print(summary_grasping_stds)
+    keys = list(params.keys())
+    header_summary = ['Updates'] + [key.replace('ParameterSettings/', '').replace('.json', '') for key in keys]
+    grasps, avg_time, std_time = (STREAMED_METRICS.index(metric) for metric in (GRASPS, AVG_GRASP_TIME, STD_GRASP_TIME))
+    run_counts = np.array([len(runs) for runs in params.values()], dtype=int)
+    weights = None
+    if num_resamples > 0:
+        weights = resample_counts(run_counts, num_resamples, np.random.RandomState(0))
+
+    # Reading the logs is interleaved with aggregating them, hence not counted as separate 'load' phase
+    for chunk_start, setting_idx, update_nrs, run_values, statistics in \
+            stream_training_statistics(path, params, chunk_rows):
+        append = chunk_start > 0
+        runs = list(params[keys[setting_idx]])
+        means, stds = statistics.mean(), statistics.std()
+        model_columns = run_values.transpose(1, 0, 2)
+
+        if setting_idx == 0:
+            # Columns of the summaries for the current chunk, one per parameter setting
+            chunk_update_nrs = update_nrs
+            summaries = {name: np.full((len(update_nrs), len(keys)), np.nan) for name, _, _ in SUMMARIES}
+            interval_bounds = {name + '_' + bound: np.full((len(update_nrs), len(keys)), np.nan)
+                               for name, _, _ in SUMMARIES for bound in ['lower', 'upper']}
+        chunk_update_nrs = np.fmax(chunk_update_nrs, update_nrs)
+        summaries['MeansOverGrasps'][:, setting_idx] = means[:, grasps]
+        summaries['StdOverGrasps'][:, setting_idx] = stds[:, grasps]
+        summaries['MeanOverMeanGraspingTimes'][:, setting_idx] = means[:, avg_time]
+        summaries['MeanOverStdOfGraspingTimes'][:, setting_idx] = means[:, std_time]
+        if weights is not None:
+            with counters.phase('bootstrap'):
+                intervals = summary_confidence_intervals(run_values[np.newaxis],
+                                                         run_counts[setting_idx:setting_idx + 1],
+                                                         weights[setting_idx:setting_idx + 1, :, :len(runs)],
+                                                         confidence, metric_index=STREAMED_METRICS.index)
+            for name, (lower, upper) in intervals.items():
+                interval_bounds[name + '_lower'][:, setting_idx] = lower[0]
+                interval_bounds[name + '_upper'][:, setting_idx] = upper[0]
+
+        save_data_package_to_file(direct+"Grasps", keys[setting_idx] + "_mean_std",
+                                  _with_header(runs + ['Mean_over_grasps', 'Std_over_grasps'],
+                                               np.column_stack([model_columns[..., grasps], means[:, grasps],
+                                                                stds[:, grasps]]), append), append)
+        save_data_package_to_file(direct+"MeansOfGraspMeanTimes", keys[setting_idx] + "_mean",
+                                  _with_header(runs + ['Mean_over_mean_grasp_times'],
+                                               np.column_stack([model_columns[..., avg_time], means[:, avg_time]]),
+                                               append), append)
+        save_data_package_to_file(direct+"MeansOfGraspTimeStds", keys[setting_idx] + "_mean",
+                                  _with_header(runs + ['Mean_over_std_grasp_times'],
+                                               np.column_stack([model_columns[..., std_time], means[:, std_time]]),
+                                               append), append)
+
+        if setting_idx == len(keys) - 1:
+            for name, summary in summaries.items():
+                save_data_package_to_file(direct+"Summary", name,
+                                          _with_header(header_summary, np.column_stack([chunk_update_nrs, summary]),
+                                                       append), append)
+            if weights is not None:
+                for name, bounds in interval_bounds.items():
+                    save_data_package_to_file(direct+"Summary/ConfidenceIntervals", name,
+                                              _with_header(header_summary, np.column_stack([chunk_update_nrs, bounds]),
+                                                           append), append)
+            print('Aggregated logged periods up to ' + str(chunk_start + len(chunk_update_nrs)))
+
+    # Typed binary copies of the completely written csv files
+    with counters.phase('write'):
+        for key in keys:
+            for folder, suffix in [('Grasps', '_mean_std'), ('MeansOfGraspMeanTimes', '_mean'),
+                                   ('MeansOfGraspTimeStds', '_mean')]:
+                convert_csv(direct + folder + '/' + clean_parameter_specification_id_string(key + suffix) + '.csv',
+                            _table_metadata(params, key))
+        for name, _, _ in SUMMARIES:
+            convert_csv(direct + 'Summary/' + name + '.csv', _table_metadata(params))
+            if weights is not None:
+                for bound in ['lower', 'upper']:
+                    convert_csv(direct + 'Summary/ConfidenceIntervals/' + name + '_' + bound + '.csv',
+                                _interval_metadata(params, num_resamples, confidence))
 
-    # Save summary
-    save_data_package_to_file(PATH_WRITE+"Summary", "StdOverGrasps", summary_grasping_stds)
+    print()
 
-    summary_grasping_time_mean_means = np.array(summary_grasping_time_mean_means).transpose()
-    summary_grasping_time_mean_means = np.append([header_summary_grasping_t_m_m], summary_grasping_time_mean_means, axis=0)
-    print(summary_grasping_time_mean_means)
 
-    # Save summary
-    save_data_package_to_file(PATH_WRITE+"Summary", "MeanOverMeanGraspingTimes", summary_grasping_time_mean_means)
+def watch_training_progress(path, direct=PATH_WRITE, interval=5., group_by=None, filters=None, max_elements=5,
+                            max_cycles=None):
+    """
+        Watches the training logs of all runs, including runs still training (i.e. lacking final_model.zip), and keeps
+        the summaries (Summary/*.csv; see evaluate_measurements_per_param_specification()) up to date. Every interval
+        seconds, only the rows appended to the logs since the previous cycle get read and added to the running
+        statistics (see training_aggregation.IncrementalTrainingStatistics); runs started in the meantime get added
+        to their group (up to max_elements runs per group, as done by RunCatalog.group_runs()).
+        The summaries get rewritten whenever anything changed.
+    :param path: Path to where the runs are located.
+    :param direct: Folder where to store the emission files.
+    :param interval: Seconds between two cycles.
+    :param group_by: List of params.json fields the runs get grouped by (see RunCatalog.group_runs()).
+    :param filters: Dictionary of params.json field values the runs must hold (see RunCatalog.group_runs()).
+    :param max_elements: Max. number of runs included per group; unlimited if None.
+    :param max_cycles: Number of cycles after which to stop; watches until interrupted if None.
+    :return: -
+    """
+    catalog = RunCatalog(path, refresh=False)
+    aggregator = IncrementalTrainingStatistics()
+    grasps, avg_time, std_time = (STREAMED_METRICS.index(metric) for metric in (GRASPS, AVG_GRASP_TIME, STD_GRASP_TIME))
+    tracked = set()
+    cycle = 0
 
-    summary_grasping_time_std_means = np.array(summary_grasping_time_std_means).transpose()
-    summary_grasping_time_std_means = np.append([header_summary_grasping_t_s_m], summary_grasping_time_std_means, axis=0)
-    print(summary_grasping_time_std_means)
+    try:
+        while max_cycles is None or cycle < max_cycles:
+            if cycle > 0:
+                time.sleep(interval)
+            cycle += 1
+
+            # Rows of the tracked runs read first, so that refreshing the catalog does not need to re-read their logs
+            new_rows = aggregator.update()
+            catalog.refresh(row_counts=aggregator.rows_read)
+            new_runs = 0
+            groups, _ = catalog.group_runs([run for run in catalog.get_runs() if run not in tracked],
+                                           group_by=group_by, filters=filters, max_elements=None)
+            for setting_id, runs in groups.items():
+                for run in runs:
+                    if max_elements is not None and len(aggregator.runs.get(setting_id, [])) >= max_elements:
+                        break
+                    aggregator.add_run(setting_id, run, path + run + '/training_eval.csv')
+                    tracked.add(run)
+                    new_runs += 1
+
+            new_rows += aggregator.update()
+            if not (new_runs or new_rows):
+                continue
+
+            update_nrs, means, stds = aggregator.summaries()
+            keys = list(aggregator.runs.keys())
+            header_summary = ['Updates'] + [key.replace('ParameterSettings/', '').replace('.json', '') for key in keys]
+            for name, summary in [('MeansOverGrasps', means[..., grasps]),
+                                  ('StdOverGrasps', stds[..., grasps]),
+                                  ('MeanOverMeanGraspingTimes', means[..., avg_time]),
+                                  ('MeanOverStdOfGraspingTimes', means[..., std_time])]:
+                save_table_package_to_file(direct+"Summary", name, header_summary,
+                                           np.column_stack([update_nrs, summary.transpose()]),
+                                           _table_metadata(aggregator.runs))
+            print(time.strftime('%H:%M:%S') + ': added ' + str(new_rows) + ' rows (' + str(new_runs) + ' new runs); ' +
+                  str(len(tracked)) + ' runs tracked, ' + str(len(update_nrs)) + ' logged periods.')
+    finally:
+        catalog.close()
+
+
+def _with_header(header, table, omit_header=False):
+    # Rows of a table preceded by a header row (unless omitted); numbers formatted as strings as done by numpy
+    return ([] if omit_header else [list(header)]) + table.astype(str).tolist()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Analysis of the training progress of all completely trained models.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Count the time spent loading, aggregating and writing data and save the counters to '
+                             'TrainingProgressEvaluation/Profiling/training_analysis_profile.json.')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Read the training logs chunk by chunk instead of loading them completely, keeping memory '
+                             'usage independent of the length of the logs.')
+    parser.add_argument('--chunk-rows', type=int, default=1000,
+                        help='Streaming: number of logged periods processed at a time (default: 1000).')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep the summaries of all runs, including runs still training, up to date by '
+                             'periodically adding the rows newly appended to their training logs.')
+    parser.add_argument('--interval', type=float, default=5., help='Watch: seconds between two updates (default: 5).')
+    parser.add_argument('--bootstrap', type=int, default=DEFAULT_NUM_RESAMPLES,
+                        help='Number of bootstrap resamples of the runs per parameter setting for the confidence '
+                             'intervals of the summaries; 0 to skip them (default: ' + str(DEFAULT_NUM_RESAMPLES) +
+                             ').')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='Confidence level of the confidence intervals (default: 0.95).')
+    add_grouping_arguments(parser)
+    args = parser.parse_args()
+    counters.enabled = args.profile
+
+    if args.watch:
+        print('Watching ' + PATH_READ + ' (stop via Ctrl+C)...')
+        try:
+            watch_training_progress(PATH_READ, interval=args.interval, group_by=args.group_by.split(','),
+                                    filters=parse_filters(args.where), max_elements=args.max_runs or None)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    with counters.phase('catalog'):
+        catalog = RunCatalog(PATH_READ)
+        candidate_dirs, list_outtakes_failure = catalog.get_complete_trials()
+        used_dict, filtered_out = group_runs_from_arguments(catalog, candidate_dirs, args)
+    with counters.phase('aggregate'):
+        if args.streaming:
+            evaluate_measurements_per_param_specification_streaming(PATH_READ, used_dict, chunk_rows=args.chunk_rows,
+                                                                    num_resamples=args.bootstrap,
+                                                                    confidence=args.confidence)
+        else:
+            evaluate_measurements_per_param_specification(PATH_READ, used_dict, num_resamples=args.bootstrap,
+                                                          confidence=args.confidence)
 
-    # Save summary
-    save_data_package_to_file(PATH_WRITE+"Summary", "MeanOverStdOfGraspingTimes", summary_grasping_time_mean_means)
+    not_used_lists = [list_outtakes_failure, filtered_out]
 
+    print('Complete and sufficient runs:')
+    print(candidate_dirs)
+    print('Outtakes:')
+    print(not_used_lists)
     print()
+    print('Used parameter id\'s and the test runs that used them:')
+    print(used_dict)
 
 
-candidate_dirs, list_outtakes_failure = get_complete_trials(PATH_READ)
-used_dict, filtered_out = remove_redundant_runs(PATH_READ, candidate_dirs)
-evaluate_measurements_per_param_specification(PATH_READ, used_dict)
-
-not_used_lists = [list_outtakes_failure, filtered_out]
-
-print('Complete and sufficient runs:')
-print(candidate_dirs)
-print('Outtakes:')
-print(not_used_lists)
-print()
-print('Used parameter id\'s and the test runs that used them:')
-print(used_dict)
-
+    save_which_data_was_used(PATH_WRITE+"EvaluatedData", used_dict, not_used_lists)
 
-save_which_data_was_used(PATH_WRITE+"EvaluatedData", used_dict, not_used_lists)
+    if args.profile:
+        counters.write_report(PATH_WRITE + 'Profiling/training_analysis_profile.json')
+        print('Profiling counters:')
+        print(counters.to_dict()['phases'])
@@ -0,0 +1,161 @@
+import os
+import json, csv
+import numpy as np
+
+'''
+    Loading of the training logs (training_eval.csv) written during training.
+    Each log gets parsed once into a typed float array, which is stored as sidecar file (training_eval.csv.npy,
+    accompanied by training_eval.csv.npy.meta recording the size and modification time of the log it was created
+    from). As long as the log does not change, later loads memory-map the sidecar file instead of parsing the csv-file
+    again. The sidecar files are kept outside the runs' folders, in TrainingLogSidecars/ next to the folder containing
+    the runs (e.g. Results/TrainingLogSidecars/PPO2/<run>/), so that writing them does not modify the runs' folders
+    (whose modification times tell the run catalog when to re-index a run, see run_catalog.py).
+    Alternatively, TrainingLogReader reads a log in chunks of rows without ever loading it completely, which also
+    allows to tail the logs of runs still training.
+'''
+
+# Columns of training_eval.csv, as specified by params['log_train_progress_data'] during training
+TRAINING_LOG_COLUMNS = ['Update_nr', 'Grasps', 'Avg_grasp_time_steps', 'Std_grasp_time_steps', 'Max_grasp_time_steps',
+                        'Min_grasp_time_steps', 'Total_time_steps']
+
+# Entries of a log to be read in as NaN
+NAN_VALUES = {'', 'nan', 'NaN', 'None'}
+
+SIDECAR_SUFFIX = '.npy'
+META_SUFFIX = '.npy.meta'
+SIDECAR_DIR_NAME = 'TrainingLogSidecars'
+
+
+def parse_training_log(log_path):
+    """
+        Parses a training log into a float array. Missing entries as well as entries listed in NAN_VALUES become NaN;
+        columns missing in the log are filled with NaN.
+    :param log_path: Path to a training_eval.csv file.
+    :return: Numpy array (float64) of shape (number of logged rows, len(TRAINING_LOG_COLUMNS)); header row excluded.
+    """
+    with open(log_path, 'r') as f:
+        data_iter = csv.reader(f, quotechar='"', dialect='excel', quoting=csv.QUOTE_ALL)
+        header = next(data_iter, [])
+        rows = [row for row in data_iter if row]
+
+    return _rows_to_array(rows, _column_indices(header))
+
+
+def _column_indices(header):
+    # Per column of TRAINING_LOG_COLUMNS: its index within the log's header (None if missing)
+    return [header.index(column) if column in header else None for column in TRAINING_LOG_COLUMNS]
+
+
+def _rows_to_array(rows, column_indices):
+    data = np.full((len(rows), len(TRAINING_LOG_COLUMNS)), np.nan)
+    for col_idx, src_idx in enumerate(column_indices):
+        if src_idx is None:
+            continue
+        data[:, col_idx] = [np.nan if src_idx >= len(row) or row[src_idx].strip() in NAN_VALUES
+                            else float(row[src_idx])
+                            for row in rows]
+    return data
+
+
+class TrainingLogReader(object):
+    """
+        Reads a training log chunk by chunk, for processing logs too long to be held in memory at once. Between two
+        reads, only the position inside the log is kept (no open file handle), so that readers of thousands of logs
+        can be used side by side.
+    """
+
+    def __init__(self, log_path):
+        """
+        :param log_path: Path to a training_eval.csv file.
+        """
+        self.log_path = log_path
+        self.offset = None          # Position of the next row to be read; None before reading the header
+        self.column_indices = None
+
+    def read(self, num_rows, complete_lines_only=False):
+        """
+            Reads the next rows of the log.
+        :param num_rows: Max. number of rows to be read.
+        :param complete_lines_only: Whether to leave a trailing line lacking its line break (e.g. being written by a
+                                    run still training) to be read by a later call.
+        :return: Numpy array (float64) of shape (number of rows read, len(TRAINING_LOG_COLUMNS)); fewer than num_rows
+                 rows (or none at all) once the end of the log is reached.
+        """
+        lines = []
+        with open(self.log_path, 'r') as f:
+            if self.offset is None:
+                header = f.readline()
+                if complete_lines_only and not header.endswith('\n'):
+                    return _rows_to_array([], [None] * len(TRAINING_LOG_COLUMNS))
+                self.column_indices = _column_indices(next(csv.reader([header]), []))
+            else:
+                f.seek(self.offset)
+            offset = f.tell()
+            while len(lines) < num_rows:
+                line = f.readline()
+                if not line or (complete_lines_only and not line.endswith('\n')):
+                    break
+                if line.strip():
+                    lines.append(line)
+                offset = f.tell()
+            self.offset = offset
+
+        rows = list(csv.reader(lines, quotechar='"', dialect='excel', quoting=csv.QUOTE_ALL))
+        return _rows_to_array(rows, self.column_indices)
+
+
+def _log_signature(log_path):
+    stat = os.stat(log_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def sidecar_base_path(log_path):
+    """
+        Path of the sidecar files of a training log, without suffix (see SIDECAR_SUFFIX and META_SUFFIX).
+    :param log_path: Path to a training_eval.csv file, e.g. '../Results/PPO2/<run>/training_eval.csv'.
+    :return: Path, e.g. '../Results/TrainingLogSidecars/PPO2/<run>/training_eval.csv'
+    """
+    run_dir, log_name = os.path.split(os.path.abspath(log_path))
+    runs_dir, run = os.path.split(run_dir)
+    results_dir, runs = os.path.split(runs_dir)
+    return os.path.join(results_dir, SIDECAR_DIR_NAME, runs, run, log_name)
+
+
+def load_training_log(log_path, use_sidecar=True):
+    """
+        Returns the content of a training log as float array, re-using the sidecar file if it is up to date.
+    :param log_path: Path to a training_eval.csv file.
+    :param use_sidecar: If False, the log gets parsed without reading or writing any sidecar file.
+    :return: Numpy array (float64, read-only memory-map when loaded from the sidecar file) of shape
+             (number of logged rows, len(TRAINING_LOG_COLUMNS)). Columns ordered as in TRAINING_LOG_COLUMNS.
+    """
+    if not use_sidecar:
+        return parse_training_log(log_path)
+
+    sidecar_path = sidecar_base_path(log_path) + SIDECAR_SUFFIX
+    meta_path = sidecar_base_path(log_path) + META_SUFFIX
+    signature = _log_signature(log_path)
+
+    try:
+        with open(meta_path) as f:
+            if json.load(f) == signature:
+                return np.load(sidecar_path, mmap_mode='r')
+    except (IOError, ValueError):
+        pass  # No (valid) sidecar file yet
+
+    data = parse_training_log(log_path)
+
+    try:
+        # Write to temporary files first, so that concurrent readers never see partially written sidecar files
+        tmp_suffix = '.tmp' + str(os.getpid())
+        os.makedirs(os.path.dirname(sidecar_path), exist_ok=True)
+        with open(sidecar_path + tmp_suffix, 'wb') as f:
+            np.save(f, data)
+        with open(meta_path + tmp_suffix, 'w') as f:
+            json.dump(signature, f)
+        os.replace(sidecar_path + tmp_suffix, sidecar_path)
+        os.replace(meta_path + tmp_suffix, meta_path)
+    except IOError:
+        pass  # E.g. read-only Results directory; simply parse again next time
+
+    return data
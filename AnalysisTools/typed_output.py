@@ -0,0 +1,150 @@
+import os
+import csv
+import json
+import zipfile
+import numpy as np
+
+'''
+    Typed, self-describing binary copies of the tables written as csv files by the analysis scripts.
+    Each table gets saved as (uncompressed) .npz file next to the respective csv file, holding
+        data.npy:     the numbers as 2-D float64 array (rows x columns; NaN where no value is available),
+        columns.npy:  the column names,
+        row_ids.npy:  the row names, e.g. parameter-setting-ids (empty if rows are not named),
+        metadata.npy: a json-encoded dictionary describing the table (e.g. the parameter setting its rows belong to).
+    Since the members are stored uncompressed, load_table() can memory-map the data in place, without parsing or
+    copying anything.
+'''
+
+TABLE_SUFFIX = '.npz'
+
+
+def save_table(direct, name, columns, data, row_ids=None, metadata=None):
+    """
+        Saves a table as typed binary file <direct>/<name>.npz.
+    :param direct: Folder where to store the file.
+    :param name: File name (without suffix).
+    :param columns: List of column names.
+    :param data: 2-D array-like of numbers (rows x columns).
+    :param row_ids: Optional list of row names.
+    :param metadata: Optional json-serializable dictionary describing the table.
+    :return: Path to the file
+    """
+    data = np.asarray(data, dtype=np.float64).reshape((-1, len(columns)))
+    row_ids = [] if row_ids is None else list(row_ids)
+    if row_ids and len(row_ids) != len(data):
+        raise ValueError('Number of row ids does not match the number of rows.')
+
+    if not os.path.exists(direct):
+        os.makedirs(direct)
+    path = os.path.join(direct, name + TABLE_SUFFIX)
+    # Write to a temporary file first, so that concurrent readers never see a partially written table
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, data=data, columns=np.array(columns, dtype=str), row_ids=np.array(row_ids, dtype=str),
+                 metadata=np.array(json.dumps(metadata or {})))
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def table_from_rows(rows):
+    """
+        Splits the rows written to a csv file (header row followed by rows of numbers formatted as strings, as created
+        by training_analysis._with_header()) into column names and data.
+    :param rows: List of rows.
+    :return: Tuple (columns, data)
+    """
+    return list(rows[0]), np.array(rows[1:], dtype=np.float64).reshape((-1, len(rows[0])))
+
+
+def convert_csv(csv_path, metadata=None):
+    """
+        Saves the table of a csv file having a header row (e.g. as appended chunk by chunk by the streaming training
+        analysis) as typed binary file next to it.
+    :param csv_path: Path to the csv file.
+    :param metadata: Optional json-serializable dictionary describing the table.
+    :return: Path to the typed file
+    """
+    with open(csv_path) as f:
+        columns, data = table_from_rows(list(csv.reader(f)))
+    return save_table(os.path.dirname(csv_path), os.path.basename(csv_path)[:-len('.csv')], columns, data,
+                      metadata=metadata)
+
+
+def _memmap_member(path, archive, member):
+    # Memory-maps an uncompressed .npy member of a zip-archive in place
+    info = archive.getinfo(member + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(path, 'rb') as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_length = int.from_bytes(local_header[26:28], 'little')
+        extra_length = int.from_bytes(local_header[28:30], 'little')
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        else:
+            return None
+        offset = f.tell()
+    if dtype.hasobject or 0 in shape:
+        return None
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C')
+
+
+class TypedTable(object):
+    """
+        Table loaded by load_table().
+    """
+
+    def __init__(self, data, columns, row_ids, metadata):
+        self.data = data
+        self.columns = columns
+        self.row_ids = row_ids
+        self.metadata = metadata
+
+    def column(self, name):
+        """
+        :param name: Column name.
+        :return: 1-D array holding the column's values
+        """
+        return self.data[:, self.columns.index(name)]
+
+    def row(self, row_id):
+        """
+        :param row_id: Row name.
+        :return: 1-D array holding the row's values
+        """
+        return self.data[self.row_ids.index(row_id)]
+
+    def to_dict(self):
+        """
+        :return: Dictionary; key = column name, val = 1-D array holding the column's values
+        """
+        return {name: self.data[:, idx] for idx, name in enumerate(self.columns)}
+
+
+def load_table(path, mmap=True):
+    """
+    :param path: Path to a table saved by save_table().
+    :param mmap: Whether to memory-map the data in place (read-only) instead of reading it into memory.
+    :return: TypedTable
+    """
+    with zipfile.ZipFile(path) as archive:
+        data = _memmap_member(path, archive, 'data') if mmap else None
+    with np.load(path) as members:
+        if data is None:
+            data = members['data']
+        return TypedTable(data, members['columns'].tolist(), members['row_ids'].tolist(),
+                          json.loads(str(members['metadata'])))
+
+
+def load_tables(direct, mmap=True):
+    """
+    :param direct: Folder containing tables saved by save_table().
+    :param mmap: See load_table().
+    :return: Dictionary; key = file name (without suffix), val = TypedTable
+    """
+    return {file_name[:-len(TABLE_SUFFIX)]: load_table(os.path.join(direct, file_name), mmap=mmap)
+            for file_name in sorted(os.listdir(direct)) if file_name.endswith(TABLE_SUFFIX)}
@@ -0,0 +1,219 @@
+import time
+import zipfile
+import argparse
+import warnings
+from collections import OrderedDict
+import numpy as np
+
+from numpy_policy import load_parameters
+from run_catalog import RunCatalog
+from training_analysis import save_data_package_to_file, clean_parameter_specification_id_string, PATH_READ, \
+    PATH_WRITE
+
+'''
+    Analysis of the trajectories of the weights of all selected runs through their checkpoints (checkpoint_*.zip).
+    The weights ('parameters') are read straight from each zip-archive, without extracting anything to disk. Per
+    parameter setting, the flattened weights of all runs get stacked into one tensor of shape
+    (run, checkpoint, weight), NaN-padded for runs lacking checkpoints of other runs, so that all statistics get
+    computed for all runs of a setting at once:
+        - the norm of each layer's weights (weights and biases of a layer taken together) and of all weights,
+        - the L2 distance and cosine similarity between successive checkpoints, and
+        - the L2 distance of each checkpoint to the run's final model (final_model.zip).
+    Runs whose weights diverge (exploding norms, huge jumps between checkpoints, non-finite weights) stand out in these
+    statistics and may be excluded before spending simulation time on evaluating them.
+'''
+
+TRAJECTORY_STATISTICS = ['Norm', 'StepL2', 'StepCosine', 'DistanceToFinal']
+
+
+def layer_name(variable_name):
+    """
+    :param variable_name: Name of a TF variable, e.g. 'model/shared_fc0/w:0'.
+    :return: Name of the layer the variable belongs to, e.g. 'model/shared_fc0'
+    """
+    name = variable_name.split(':')[0]
+    if name.endswith('/w') or name.endswith('/b'):
+        name = name[:-2]
+    return name
+
+
+def flatten_parameters(parameters, layers):
+    """
+    :param parameters: OrderedDict of weights as returned by numpy_policy.load_parameters().
+    :param layers: OrderedDict; key = layer name, val = list of the names of the layer's variables.
+    :return: 1-D Numpy array (float64) of all weights, layer by layer
+    """
+    return np.concatenate([np.ravel(parameters[name]) for variables in layers.values() for name in variables]) \
+        .astype(np.float64)
+
+
+def group_layers(parameters):
+    """
+    :param parameters: OrderedDict of weights as returned by numpy_policy.load_parameters().
+    :return:    layers: OrderedDict; key = layer name, val = list of the names of the layer's variables, in the order
+                        in which the layers first appear in the archive's parameter_list
+                offsets: Numpy array holding the index of each layer's first weight inside the flattened weights
+    """
+    layers = OrderedDict()
+    for name in parameters:
+        layers.setdefault(layer_name(name), []).append(name)
+    sizes = [sum(np.size(parameters[name]) for name in variables) for variables in layers.values()]
+    return layers, np.cumsum([0] + sizes[:-1])
+
+
+def load_weight_tensor(path, run_folders, checkpoints_per_run, load=load_parameters):
+    """
+        Loads the weights of all checkpoints and final models of the given runs (of the same architecture).
+    :param path: Path to the folder containing the runs' folders.
+    :param run_folders: List of run folders.
+    :param checkpoints_per_run: List (per run) of tuples (update-nr, file name) as returned by
+                                RunCatalog.get_checkpoints().
+    :param load: Function returning the weights stored in a zip-archive (see numpy_policy.load_parameters()).
+    :return: Dictionary:
+                update_nrs: Numpy array of all update-nrs at which any of the runs saved a checkpoint (sorted)
+                weights: Numpy array of shape (runs, len(update_nrs), weights); NaN where a run lacks the checkpoint
+                final: Numpy array of shape (runs, weights) holding the final models' weights; NaN if missing
+                non_finite: Numpy array of shape (runs, len(update_nrs)); True where a checkpoint holds NaN/inf weights
+                layers, offsets: Layers and their offsets inside the flattened weights (see group_layers())
+    """
+    update_nrs = np.array(sorted(set(update_nr for checkpoints in checkpoints_per_run for update_nr, _ in checkpoints)),
+                          dtype=int)
+    layers, offsets, weights, final, non_finite = None, None, None, None, None
+
+    for run_idx, (run_folder, checkpoints) in enumerate(zip(run_folders, checkpoints_per_run)):
+        files = [(np.searchsorted(update_nrs, update_nr), file_name) for update_nr, file_name in checkpoints]
+        files.append((None, 'final_model.zip'))
+        for checkpoint_idx, file_name in files:
+            try:
+                parameters = load(path + run_folder + '/' + file_name)
+            except (IOError, KeyError, ValueError, zipfile.BadZipFile):
+                print('Could not read weights: ' + path + run_folder + '/' + file_name)
+                continue
+            if layers is None:
+                layers, offsets = group_layers(parameters)
+                num_weights = sum(np.size(value) for value in parameters.values())
+                weights = np.full((len(run_folders), len(update_nrs), num_weights), np.nan)
+                final = np.full((len(run_folders), num_weights), np.nan)
+                non_finite = np.zeros((len(run_folders), len(update_nrs)), dtype=bool)
+            flat = flatten_parameters(parameters, layers)
+            if checkpoint_idx is None:
+                final[run_idx] = flat
+            else:
+                weights[run_idx, checkpoint_idx] = flat
+                non_finite[run_idx, checkpoint_idx] = not np.isfinite(flat).all()
+
+    if layers is None:
+        layers, offsets = OrderedDict(), np.zeros(0, dtype=int)
+        weights, final = np.full((len(run_folders), len(update_nrs), 0), np.nan), np.full((len(run_folders), 0), np.nan)
+        non_finite = np.zeros((len(run_folders), len(update_nrs)), dtype=bool)
+    return {'update_nrs': update_nrs, 'weights': weights, 'final': final, 'non_finite': non_finite,
+            'layers': layers, 'offsets': offsets}
+
+
+def weight_trajectory_statistics(weights, final, offsets):
+    """
+        Computes the trajectory statistics of all runs at once.
+    :param weights: Numpy array of shape (runs, checkpoints, weights) as returned by load_weight_tensor().
+    :param final: Numpy array of shape (runs, weights) as returned by load_weight_tensor().
+    :param offsets: Offsets of the layers inside the flattened weights (see group_layers()).
+    :return: Dictionary holding Numpy arrays:
+                LayerNorms: Norm per run, checkpoint and layer, shape (runs, checkpoints, layers)
+                Norm: Norm of all weights per run and checkpoint, shape (runs, checkpoints)
+                StepL2: L2 distance to the run's preceding checkpoint, shape (runs, checkpoints); NaN for the first one
+                StepCosine: Cosine similarity to the preceding checkpoint, shape (runs, checkpoints); NaN for the first
+                DistanceToFinal: L2 distance to the run's final model, shape (runs, checkpoints)
+    """
+    squares = weights ** 2
+    layer_norms = np.sqrt(np.add.reduceat(squares, offsets, axis=-1)) if len(offsets) else squares[..., :0]
+    norms = np.sqrt(squares.sum(axis=-1))
+
+    steps = np.full(norms.shape, np.nan)
+    cosines = np.full(norms.shape, np.nan)
+    if weights.shape[1] > 1:
+        previous, current = weights[:, :-1], weights[:, 1:]
+        steps[:, 1:] = np.sqrt(((current - previous) ** 2).sum(axis=-1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cosines[:, 1:] = (current * previous).sum(axis=-1) / (norms[:, 1:] * norms[:, :-1])
+
+    distance_to_final = np.sqrt(((weights - final[:, np.newaxis, :]) ** 2).sum(axis=-1))
+    return {'LayerNorms': layer_norms, 'Norm': norms, 'StepL2': steps, 'StepCosine': cosines,
+            'DistanceToFinal': distance_to_final}
+
+
+def evaluate_weight_trajectories(path, params, catalog, direct=PATH_WRITE + 'WeightTrajectories/'):
+    """
+        Computes the weight-trajectory statistics of all runs, aggregates them per parameter setting and saves them:
+            <direct>/<statistic>/<setting>.csv: Per checkpoint (rows): the statistic of each run (columns), followed by
+                                                its mean and std over the runs.
+            <direct>/LayerNorms/<setting>.csv: Per checkpoint: mean norm over the runs per layer.
+            <direct>/Summary/Mean<statistic>.csv: Per checkpoint: mean of the statistic per parameter setting.
+            <direct>/Screening.csv: Per run: its largest norm and step, its smallest step cosine, its final distance,
+                                    and the number of checkpoints holding non-finite weights.
+    :param path: Path to the folder containing the runs' folders.
+    :param params: Dictionary; key: parameter-setting-id, val: list of runs trained on the respective parameter setting.
+    :param catalog: RunCatalog listing the runs' checkpoints.
+    :param direct: Folder where to store the emission files.
+    :return: -
+    """
+    results = dict()
+    for key, run_folders in params.items():
+        tensor = load_weight_tensor(path, run_folders, [catalog.get_checkpoints(run) for run in run_folders])
+        results[key] = (tensor, weight_trajectory_statistics(tensor['weights'], tensor['final'], tensor['offsets']))
+
+    all_update_nrs = np.array(sorted(set(int(update_nr) for tensor, _ in results.values()
+                                         for update_nr in tensor['update_nrs'])), dtype=int)
+    summaries = {name: np.full((len(all_update_nrs), len(params)), np.nan) for name in TRAJECTORY_STATISTICS}
+    screening = [['Run', 'Parameter_setting', 'Checkpoints', 'Max_norm', 'Max_step_l2', 'Min_step_cosine',
+                  'Last_distance_to_final', 'Non_finite_checkpoints']]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)  # All-NaN slices, e.g. checkpoints of single runs
+
+        for setting_idx, (key, (tensor, statistics)) in enumerate(results.items()):
+            runs = list(params[key])
+            setting = clean_parameter_specification_id_string(key)
+            update_nrs = tensor['update_nrs'][:, np.newaxis]
+            rows = np.searchsorted(all_update_nrs, tensor['update_nrs'])
+
+            for name in TRAJECTORY_STATISTICS:
+                per_run = statistics[name].transpose()  # Checkpoints x runs
+                mean, std = np.nanmean(per_run, axis=1), np.nanstd(per_run, axis=1)
+                summaries[name][rows, setting_idx] = mean
+                save_data_package_to_file(direct + name, setting,
+                                          [['Updates'] + runs + ['Mean', 'Std']] +
+                                          np.column_stack([update_nrs, per_run, mean, std]).astype(str).tolist())
+
+            save_data_package_to_file(direct + 'LayerNorms', setting,
+                                      [['Updates'] + list(tensor['layers'])] +
+                                      np.column_stack([update_nrs, np.nanmean(statistics['LayerNorms'], axis=0)])
+                                      .astype(str).tolist())
+
+            for run_idx, run in enumerate(runs):
+                present = ~np.isnan(statistics['Norm'][run_idx])
+                distances = statistics['DistanceToFinal'][run_idx][present]
+                screening.append([run, key, int(present.sum()),
+                                  float(np.nanmax(statistics['Norm'][run_idx])),
+                                  float(np.nanmax(statistics['StepL2'][run_idx])),
+                                  float(np.nanmin(statistics['StepCosine'][run_idx])),
+                                  float(distances[-1]) if len(distances) else float('nan'),
+                                  int(tensor['non_finite'][run_idx].sum())])
+
+    header_summary = ['Updates'] + [key.replace('ParameterSettings/', '').replace('.json', '') for key in params]
+    for name, summary in summaries.items():
+        save_data_package_to_file(direct + 'Summary', 'Mean' + name,
+                                  [header_summary] + np.column_stack([all_update_nrs, summary]).astype(str).tolist())
+    save_data_package_to_file(direct, 'Screening', screening)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Analysis of the weight trajectories of all completely trained runs.')
+    parser.parse_args()
+
+    start = time.perf_counter()
+    catalog = RunCatalog(PATH_READ)
+    candidate_dirs, _ = catalog.get_complete_trials()
+    used_dict, _ = catalog.remove_redundant_runs(candidate_dirs)
+    evaluate_weight_trajectories(PATH_READ, used_dict, catalog)
+    catalog.close()
+    print('Analysed the weight trajectories of ' + str(sum(len(runs) for runs in used_dict.values())) + ' runs in ' +
+          '{:.2f}'.format(time.perf_counter() - start) + ' s.')